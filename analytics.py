@@ -0,0 +1,93 @@
+from extensions import db
+from models import Habit
+from utils import user_completions_query
+import datetime
+import numpy as np
+
+def to_epoch_days(dates):
+    """Converts a sequence of dates into an int64 array of days since 1970-01-01."""
+    return np.array(dates, dtype='datetime64[D]').astype(np.int64)
+
+def to_periods(days, weekly):
+    """Maps epoch days to streak periods, bucketing Weekly habits on the Monday-based ISO week."""
+    return np.where(weekly, (days + 3) // 7, days)
+
+def load_completion_arrays(user_id=None, habit_id=None):
+    """Fetches completed (habit_id, completed_on) pairs as column arrays, ordered by habit and day."""
+    query = user_completions_query(user_id, completed_only=True, habit_id=habit_id)
+    rows = db.session.execute(query).tuples().all()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    habit_ids, completed_on, _ = zip(*rows)
+    return np.array(habit_ids, dtype=np.int64), to_epoch_days(completed_on)
+
+def load_habit_arrays(user_id=None, habit_id=None):
+    """Fetches (id, is_weekly, creation day) of the selected habits as column arrays, ordered by id."""
+    query = db.select(Habit.id, Habit.frequency, Habit.creation_date).order_by(Habit.id)
+    if user_id is not None:
+        query = query.filter(Habit.user_id == user_id)
+    if habit_id is not None:
+        query = query.filter(Habit.id == habit_id)
+
+    rows = db.session.execute(query).tuples().all()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=bool), np.empty(0, dtype=np.int64)
+
+    ids, frequencies, creation_dates = zip(*rows)
+    creation_days = to_epoch_days([created.date() if created else datetime.date.today() for created in creation_dates])
+    return np.array(ids, dtype=np.int64), np.array(frequencies) == 'Weekly', creation_days
+
+def streak_runs(habit_ids, periods):
+    """Splits ordered (habit_id, period) pairs into runs of consecutive periods.
+
+    Returns the habit id, first period and length of every run. Repeated periods
+    within a habit (several check-ins in one week, duplicate rows) count once.
+    """
+    new_habit = np.ones(len(periods), dtype=bool)
+    new_habit[1:] = habit_ids[1:] != habit_ids[:-1]
+    keep = new_habit.copy()
+    keep[1:] |= periods[1:] != periods[:-1]
+    habit_ids, periods, new_habit = habit_ids[keep], periods[keep], new_habit[keep]
+
+    starts = new_habit.copy()
+    starts[1:] |= np.diff(periods) != 1
+    start_index = np.flatnonzero(starts)
+    lengths = np.diff(np.append(start_index, len(periods)))
+    return habit_ids[start_index], periods[start_index], lengths
+
+def compute_habit_stats(user_id=None, habit_id=None, today=None):
+    """Computes longest streak, current streak and completion rate for every selected habit.
+
+    Passing no user_id covers the habits of all users. The current streak is the
+    run ending at the latest completion, or 0 once neither today's nor the
+    previous period was completed, matching the stored streak state. The
+    completion rate is the share of periods completed since the habit was
+    created (or first completed, if earlier) up to today.
+    """
+    ids, weekly, creation_days = load_habit_arrays(user_id, habit_id)
+    stats = {int(habit): {'longest_streak': 0, 'current_streak': 0, 'completion_rate': 0.0} for habit in ids}
+    habit_ids, days = load_completion_arrays(user_id, habit_id)
+    if not len(habit_ids) or not len(ids):
+        return stats
+
+    positions = np.searchsorted(ids, habit_ids)
+    run_habits, run_starts, run_lengths = streak_runs(habit_ids, to_periods(days, weekly[positions]))
+
+    first_run = np.flatnonzero(np.r_[True, run_habits[1:] != run_habits[:-1]])
+    last_run = np.r_[first_run[1:] - 1, len(run_lengths) - 1]
+    longest = np.maximum.reduceat(run_lengths, first_run)
+    current = run_lengths[last_run]
+    completed = np.add.reduceat(run_lengths, first_run)
+
+    habit_positions = np.searchsorted(ids, run_habits[first_run])
+    habit_weekly = weekly[habit_positions]
+    today_period = to_periods(to_epoch_days([today or datetime.date.today()])[0], habit_weekly)
+    first_period = np.minimum(run_starts[first_run], to_periods(creation_days[habit_positions], habit_weekly))
+    last_period = np.maximum(run_starts[last_run] + current - 1, today_period)
+    rates = completed / (last_period - first_period + 1)
+    current = np.where(run_starts[last_run] + current - 1 >= today_period - 1, current, 0)
+
+    for habit, longest_streak, current_streak, rate in zip(run_habits[first_run].tolist(), longest.tolist(), current.tolist(), rates.tolist()):
+        stats[habit] = {'longest_streak': longest_streak, 'current_streak': current_streak, 'completion_rate': round(rate, 4)}
+    return stats
@@ -0,0 +1,175 @@
+from extensions import db, bcrypt
+from models import User
+from concurrent.futures import ThreadPoolExecutor
+from flask import abort, jsonify, make_response
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from sqlalchemy import event, inspect
+from collections import OrderedDict
+import threading
+import time
+
+class IdentityCache:
+    """A thread-safe, bounded LRU cache of username -> user id entries that expire after a TTL."""
+
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return None
+            user_id, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[username]
+                return None
+            self._entries.move_to_end(username)
+            return user_id
+
+    def set(self, username, user_id):
+        with self._lock:
+            self._entries[username] = (user_id, time.monotonic() + self.ttl)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username):
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+identity_cache = IdentityCache()
+
+def identity_claims(user):
+    """Returns the extra JWT claims issued with a user's access token."""
+    return {'uid': user.id}
+
+def current_user_id():
+    """Returns the id of the authenticated user without reading the users table when it can.
+
+    Tokens issued by register and login carry the id as their 'uid' claim, which
+    is trusted as is. Older tokens without it are resolved by username through
+    identity_cache, querying the users table on a miss and answering 401 when the
+    user is gone. Whether the token's user still exists is checked in every
+    process by the user row read that ETags and writes already make (see
+    caching.get_data_version and caching.bump_data_version).
+    """
+    claimed_id = get_jwt().get('uid')
+    if claimed_id is not None:
+        return claimed_id
+
+    username = get_jwt_identity()
+    user_id = identity_cache.get(username)
+    if user_id is None:
+        user_id = db.session.execute(db.select(User.id).filter_by(username=username)).scalar()
+        if user_id is None:
+            reject_stale_token()
+        identity_cache.set(username, user_id)
+    return user_id
+
+def token_username():
+    """Returns the username of the request's verified token, or None outside an authenticated request."""
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        return None
+
+def reject_stale_token():
+    """Answers 401 for a token whose user was deleted or renamed, dropping the request's pending writes."""
+    db.session.rollback()
+    abort(make_response(jsonify({'message': 'User not found'}), 401))
+
+@event.listens_for(User, 'after_delete')
+def invalidate_deleted_user(mapper, connection, user):
+    identity_cache.invalidate(user.username)
+
+@event.listens_for(User, 'after_update')
+def invalidate_renamed_user(mapper, connection, user):
+    history = inspect(user).attrs.username.history
+    for username in history.deleted or ():
+        identity_cache.invalidate(username)
+
+class HashPoolSaturated(Exception):
+    """Raised when the password hashing pool has no free slot for another job."""
+
+class HashPool:
+    """Runs bcrypt jobs on a bounded thread pool instead of the request thread.
+
+    At most max_pending jobs may be queued or running; callers beyond that get
+    HashPoolSaturated right away instead of waiting behind a login storm. The
+    limit only sheds load while it is below the number of request threads, so
+    gunicorn.conf.py derives it from GUNICORN_THREADS.
+    """
+
+    def __init__(self, workers=4, max_pending=32):
+        self._stats_lock = threading.Lock()
+        self._executor = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.configure(workers, max_pending)
+
+    def configure(self, workers, max_pending):
+        """Resizes the pool. Jobs already running finish on the threads and slot they started with."""
+        with self._stats_lock:
+            executor = self._executor
+            self.workers = workers
+            self.max_pending = max_pending
+            self._slots = threading.BoundedSemaphore(max_pending)
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def run(self, function, *args):
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            with self._stats_lock:
+                self.rejected += 1
+            raise HashPoolSaturated()
+
+        started = time.perf_counter()
+        try:
+            with self._stats_lock:
+                self.pending += 1
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+                future = self._executor.submit(function, *args)
+            return future.result()
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                self.pending -= 1
+                self.completed += 1
+                self.total_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+            slots.release()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self.pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'total_seconds': self.total_seconds,
+                'max_seconds': self.max_seconds,
+            }
+
+hash_pool = HashPool()
+
+def hash_password(password):
+    """Hashes a password with bcrypt on the hashing pool."""
+    return hash_pool.run(bcrypt.generate_password_hash, password).decode('utf-8')
+
+def check_password(password_hash, password):
+    """Checks a password against its bcrypt hash on the hashing pool."""
+    return hash_pool.run(bcrypt.check_password_hash, password_hash, password)
@@ -0,0 +1,271 @@
+"""Benchmarks every API route at a fixed concurrency and reports the results as JSON.
+
+Usage:
+    python bench.py --users 20 --habits 10 --days 365 --output bench_baseline.json
+    python bench.py --users 20 --habits 10 --days 365 --baseline bench_baseline.json
+    python bench.py --database postgresql://... --server http://127.0.0.1:5000
+
+The data set is generated into --database (a temporary SQLite file by default).
+With --server the requests go to a running server, which must use the same
+database; otherwise they go through the Flask test client, which also lets the
+harness count SQL statements per request. Comparing against a baseline exits
+with status 1 when a route got slower than --tolerance allows or runs more SQL.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PASSWORD = 'bench-password'
+
+class TestClientDriver:
+    """Sends requests through the Flask test client, one client per thread."""
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, token=None, body=None):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = self.local.client.open(path, method=method, headers=headers, json=body)
+        response.get_data()  # run streamed bodies such as the export to the end
+        return response.status_code, response.get_json(silent=True)
+
+    def read_event(self, path, token):
+        """Opens an event stream, reads until its first event and closes it."""
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        response = self.local.client.get(path, headers={'Authorization': f'Bearer {token}'})
+        try:
+            if response.status_code == 200:
+                next((chunk for chunk in response.iter_encoded() if b'data: ' in chunk), None)
+            return response.status_code
+        finally:
+            response.close()
+
+class ServerDriver:
+    """Sends requests to a running server over a pooled session per thread."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.local = threading.local()
+
+    def request(self, method, path, token=None, body=None):
+        import requests
+
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = self.local.session.request(method, self.base_url + path, headers=headers, json=body)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+    def read_event(self, path, token):
+        """Opens an event stream, reads until its first event and closes it."""
+        import requests
+
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        response = self.local.session.get(self.base_url + path, headers={'Authorization': f'Bearer {token}'}, stream=True)
+        try:
+            if response.status_code == 200:
+                next((line for line in response.iter_lines() if line.startswith(b'data: ')), None)
+            return response.status_code
+        finally:
+            response.close()
+
+class StatementCounter:
+    """Counts SQL statements sent through an engine."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        self.lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, *args):
+        with self.lock:
+            self.count += 1
+
+def build_scenarios(username, token, habit_ids, spare_habit_ids, run_id, sync_floor):
+    """Returns (name, method, path(i), body(i), token) for every route.
+
+    Reads go first and deletes last. The change log readers run after the writes
+    that fill the log and read it from the seeded user's sync floor; the EVENTS
+    method opens /events and waits for the first event.
+    """
+    future = datetime.date.today() + datetime.timedelta(days=1)
+    day = lambda i: (future + datetime.timedelta(days=i)).isoformat()
+    habit = lambda i: habit_ids[i % len(habit_ids)]
+    return [
+        ('GET /metrics', 'GET', lambda i: '/metrics', None, None),
+        ('GET /habits', 'GET', lambda i: '/habits', None, token),
+        ('GET /habits/completions', 'GET', lambda i: '/habits/completions', None, token),
+        ('GET /habits/completions/export', 'GET', lambda i: '/habits/completions/export', None, token),
+        ('GET /habits/analytics/all', 'GET', lambda i: '/habits/analytics/all', None, token),
+        ('GET /habits/analytics/periodicity/<periodicity>', 'GET', lambda i: '/habits/analytics/periodicity/Daily', None, token),
+        ('GET /habits/analytics/longest_streak', 'GET', lambda i: '/habits/analytics/longest_streak', None, token),
+        ('GET /habits/analytics/longest_streak/<id>', 'GET', lambda i: f'/habits/analytics/longest_streak/{habit(i)}', None, token),
+        ('GET /habits/analytics/summary', 'GET', lambda i: '/habits/analytics/summary', None, token),
+        ('GET /habits/analytics/completion_rate', 'GET', lambda i: '/habits/analytics/completion_rate?bucket=week&window=4', None, token),
+        ('GET /habits/analytics/heatmap', 'GET', lambda i: '/habits/analytics/heatmap', None, token),
+        ('GET /leaderboard', 'GET', lambda i: '/leaderboard', None, token),
+        ('GET /leaderboard?metric=current', 'GET', lambda i: '/leaderboard?metric=current&frequency=Daily', None, token),
+        ('POST /login', 'POST', lambda i: '/login', lambda i: {'username': username, 'password': PASSWORD}, None),
+        ('POST /register', 'POST', lambda i: '/register', lambda i: {'username': f'bench-{run_id}-{i}', 'email': f'bench-{run_id}-{i}@example.com', 'password': PASSWORD}, None),
+        ('POST /habits', 'POST', lambda i: '/habits', lambda i: {'name': f'Bench habit {i}', 'description': 'Created by bench.py', 'frequency': 'Daily'}, token),
+        ('PUT /habits/<id>', 'PUT', lambda i: f'/habits/{habit(i)}', lambda i: {'description': f'Updated {i}'}, token),
+        ('POST /habits/<id>/completions', 'POST', lambda i: f'/habits/{habit(i)}/completions', lambda i: {'completed_on': day(i), 'completed': True}, token),
+        ('POST /habits/completions/batch', 'POST', lambda i: '/habits/completions/batch', lambda i: [
+            {'habit_id': habit(i + j), 'completed_on': day(i), 'completed': True} for j in range(100)
+        ], token),
+        ('GET /sync', 'GET', lambda i: f'/sync?since={sync_floor}', None, token),
+        ('GET /events', 'EVENTS', lambda i: f'/events?since={sync_floor}', None, token),
+        ('DELETE /habits/<id>', 'DELETE', lambda i: f'/habits/{spare_habit_ids[i]}', None, token),
+    ]
+
+def percentile(quantiles, p):
+    return round(quantiles[p - 1] * 1000, 3)
+
+def run_scenario(driver, counter, scenario, requests, concurrency):
+    """Runs one route `requests` times at the given concurrency and summarizes the latencies."""
+    name, method, path, body, token = scenario
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def call(i):
+        started = time.perf_counter()
+        if method == 'EVENTS':
+            status = driver.read_event(path(i), token)
+        else:
+            status, _ = driver.request(method, path(i), token, body(i) if body else None)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if status >= 400:
+                errors.append(status)
+
+    statements_before = counter.count if counter else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, range(requests)))
+    wall = time.perf_counter() - started
+
+    quantiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': len(errors),
+        'p50_ms': percentile(quantiles, 50),
+        'p95_ms': percentile(quantiles, 95),
+        'p99_ms': percentile(quantiles, 99),
+        'throughput_rps': round(requests / wall, 2),
+        'statements_per_request': round((counter.count - statements_before) / requests, 2) if counter else None,
+    }
+
+def compare(results, baseline, tolerance):
+    """Returns the routes whose p95 latency or statement count regressed against the baseline."""
+    regressions = {}
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        reasons = []
+        if result['p95_ms'] > previous['p95_ms'] * tolerance:
+            reasons.append(f"p95 {previous['p95_ms']}ms -> {result['p95_ms']}ms")
+        if None not in (result['statements_per_request'], previous['statements_per_request']) and result['statements_per_request'] > previous['statements_per_request']:
+            reasons.append(f"statements {previous['statements_per_request']} -> {result['statements_per_request']}")
+        if reasons:
+            regressions[name] = reasons
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--habits', type=int, default=10)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--requests', type=int, default=100, help='Requests per route.')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--database', help='Database URL to generate the data into (default: temporary SQLite file).')
+    parser.add_argument('--server', help='Base URL of a running server to benchmark instead of the test client.')
+    parser.add_argument('--routes', help='Only run routes whose name contains this text.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', help='Compare the results against this JSON file.')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='Allowed p95 slowdown factor against the baseline.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+    from app import app
+    from extensions import db, bcrypt
+    from models import Habit, User
+    from datagen import generate_dataset, rebuild_derived_state
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with app.app_context():
+        db.create_all()
+        run_id = int(time.time())
+        user_ids, habit_count, completion_count = generate_dataset(
+            args.users, args.habits, args.days, bcrypt.generate_password_hash(PASSWORD).decode('utf-8'),
+            seed=args.seed, username_prefix=f'bench{run_id}-',
+        )
+        rebuild_derived_state(user_ids)
+        spare = [{'name': f'Spare {i}', 'frequency': 'Daily', 'user_id': user_ids[0]} for i in range(args.requests)]
+        db.session.execute(db.insert(Habit), spare)
+        db.session.commit()
+        habit_ids = db.session.execute(
+            db.select(Habit.id).filter(Habit.user_id == user_ids[0], Habit.name.notlike('Spare %')).order_by(Habit.id)
+        ).scalars().all()
+        spare_habit_ids = db.session.execute(
+            db.select(Habit.id).filter(Habit.user_id == user_ids[0], Habit.name.like('Spare %')).order_by(Habit.id)
+        ).scalars().all()
+        sync_floor = db.session.get(User, user_ids[0]).sync_floor
+        counter = None if args.server else StatementCounter(db.engine)
+
+    driver = ServerDriver(args.server) if args.server else TestClientDriver(app)
+    username = f'bench{run_id}-0'
+    status, body = driver.request('POST', '/login', body={'username': username, 'password': PASSWORD})
+    if status != 200:
+        sys.exit(f'Could not log in as {username}: HTTP {status}')
+    token = body['access_token']
+
+    results = {}
+    for scenario in build_scenarios(username, token, habit_ids, spare_habit_ids, run_id, sync_floor):
+        if args.routes and args.routes not in scenario[0]:
+            continue
+        results[scenario[0]] = run_scenario(driver, counter, scenario, args.requests, args.concurrency)
+
+    report = {
+        'dataset': {'users': args.users, 'habits': habit_count, 'completions': completion_count, 'days': args.days},
+        'routes': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=4)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            report['regressions'] = compare(results, json.load(baseline)['routes'], args.tolerance)
+        exit_code = 1 if report['regressions'] else 0
+
+    print(json.dumps(report, indent=4))
+    sys.exit(exit_code)
+
+if __name__ == '__main__':
+    main()
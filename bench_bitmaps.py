@@ -0,0 +1,87 @@
+"""Compares completion rows against the bitmap store on a synthetic SQLite database.
+
+Usage: python bench_bitmaps.py --completions 10000000 --habits 5000
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--completions', type=int, default=10_000_000)
+    parser.add_argument('--habits', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench_bitmaps.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+
+    from app import app
+    from extensions import db
+    from models import User, Habit, HabitCompletion
+    from bitmaps import rebuild_bitmaps, compute_bitmap_streaks
+    from streaks import streak_lengths
+    from utils import get_completions_by_habit
+
+    rng = random.Random(args.seed)
+    days_per_habit = int(args.completions / args.habits / 0.8) + 1
+    start = datetime.date.today() - datetime.timedelta(days=days_per_habit)
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com', password='-')
+        db.session.add(user)
+        db.session.flush()
+        habits = [Habit(name=f'Habit {i}', frequency='Daily', user_id=user.id) for i in range(args.habits)]
+        db.session.add_all(habits)
+        db.session.commit()
+        base_size = os.path.getsize(path)
+
+        inserted = 0
+        for habit in habits:
+            rows = [
+                {'habit_id': habit.id, 'completed_on': start + datetime.timedelta(days=day), 'completed': True}
+                for day in range(days_per_habit) if rng.random() < 0.8
+            ][:args.completions - inserted]
+            if rows:
+                db.session.execute(db.insert(HabitCompletion), rows)
+            inserted += len(rows)
+        db.session.commit()
+        rows_size = os.path.getsize(path) - base_size
+
+        completions = get_completions_by_habit(user.id, completed_only=True)
+        for habit in habits:
+            rebuild_bitmaps(habit.id, habit.frequency, [row.completed_on for row in completions.get(habit.id, [])])
+        db.session.commit()
+        bitmap_size = os.path.getsize(path) - base_size - rows_size
+        del completions
+
+        started = time.perf_counter()
+        completions = get_completions_by_habit(user.id, completed_only=True)
+        row_streaks = {habit_id: streak_lengths([row.completed_on for row in rows], 'Daily')[0] for habit_id, rows in completions.items()}
+        rows_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        bitmap_streaks = compute_bitmap_streaks(user.id)
+        bitmap_seconds = time.perf_counter() - started
+
+        assert all(bitmap_streaks[habit_id][0] == longest for habit_id, longest in row_streaks.items())
+
+    print(json.dumps({
+        'completions': inserted,
+        'habits': args.habits,
+        'rows_bytes': rows_size,
+        'bitmap_bytes': bitmap_size,
+        'rows_bytes_per_completion': round(rows_size / inserted, 2),
+        'bitmap_bytes_per_completion': round(bitmap_size / inserted, 2),
+        'rows_streak_seconds': round(rows_seconds, 3),
+        'bitmap_streak_seconds': round(bitmap_seconds, 3),
+    }, indent=4))
+    os.remove(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Measures how fast the app starts and how much memory each forked worker costs.
+
+Usage: python bench_startup.py --runs 5 --workers 4 --output startup.json
+
+Cold start is timed in fresh interpreters, once for `from app import app` (the
+full app with the CLI commands) and once for `from wsgi import app`. A third
+run also imports the optional subsystems (NumPy analytics, bitmaps, event
+broker, leaderboards) that the views load on first use; its difference to
+`wsgi` is what deferring them saves every process that never needs them. Worker
+memory is measured the way gunicorn runs the app: a master forks --workers
+children that each log in and serve GET /habits, either after the master built
+the app (preload_app) or building it in every child. RSS includes the pages
+still shared with the master; USS (Linux only) counts the pages a worker owns,
+which is what each extra worker really costs.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PASSWORD = 'password'
+DEFERRED_MODULES = ('analytics', 'sql_analytics', 'bitmaps', 'events', 'leaderboard')
+
+def memory_kb():
+    """Returns the (RSS, USS) of this process in KiB; USS is None where /proc is unavailable."""
+    try:
+        with open('/proc/self/smaps_rollup') as smaps:
+            fields = dict(line.split(':', 1) for line in smaps if ':' in line)
+    except OSError:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return (rss // 1024 if sys.platform == 'darwin' else rss), None
+    kb = lambda name: int(fields[name].split()[0])
+    return kb('Rss'), kb('Private_Clean') + kb('Private_Dirty')
+
+def cold_start(module, runs, extra_modules=()):
+    """Times `from <module> import app`, followed by importing extra_modules, in fresh interpreters."""
+    imports = ''.join(f'; import {name}' for name in extra_modules)
+    code = f'import time; started = time.perf_counter(); from {module} import app{imports}; print(time.perf_counter() - started)'
+    import_seconds, process_seconds = [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        process_seconds.append(time.perf_counter() - started)
+        import_seconds.append(float(output.strip().splitlines()[-1]))
+    return {
+        'import_ms': round(statistics.median(import_seconds) * 1000, 1),
+        'process_ms': round(statistics.median(process_seconds) * 1000, 1),
+    }
+
+def serve(app):
+    """Logs in and serves one authenticated request, like a worker's first traffic."""
+    client = app.test_client()
+    response = client.post('/login', json={'username': 'startup', 'password': PASSWORD})
+    token = response.get_json()['access_token']
+    response = client.get('/habits', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200, response.status_code
+
+def measure_workers(preload, workers):
+    """Forks the workers (run in a fresh interpreter) and returns their timings and memory as a dict."""
+    if preload:
+        from wsgi import app, reset_after_fork  # noqa: F401
+    master_rss, master_uss = memory_kb()
+
+    read_end, write_end = os.pipe()
+    for _ in range(workers):
+        if os.fork() == 0:
+            os.close(read_end)
+            started = time.perf_counter()
+            from wsgi import app, reset_after_fork
+            reset_after_fork()
+            serve(app)
+            rss, uss = memory_kb()
+            os.write(write_end, json.dumps({'ready_ms': (time.perf_counter() - started) * 1000, 'rss_kb': rss, 'uss_kb': uss}).encode() + b'\n')
+            os._exit(0)
+    os.close(write_end)
+    for _ in range(workers):
+        os.wait()
+    with os.fdopen(read_end) as results:
+        samples = [json.loads(line) for line in results]
+
+    median = lambda key: None if samples[0][key] is None else round(statistics.median(sample[key] for sample in samples), 1)
+    return {
+        'master_rss_kb': master_rss,
+        'master_uss_kb': master_uss,
+        'worker_ready_ms': median('ready_ms'),
+        'worker_rss_kb': median('rss_kb'),
+        'worker_uss_kb': median('uss_kb'),
+    }
+
+def create_database():
+    """Creates the schema and the user the workers log in as."""
+    from app import create_app
+    from extensions import db, bcrypt
+    from models import User
+
+    app = create_app({'CLI_COMMANDS': False})
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username='startup', email='startup@example.com', password=bcrypt.generate_password_hash(PASSWORD).decode('utf-8')))
+        db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per cold start measurement.')
+    parser.add_argument('--workers', type=int, default=4, help='Workers to fork per memory measurement.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--measure', choices=['preload', 'per-worker'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure_workers(args.measure == 'preload', args.workers)))
+        return
+    if not hasattr(os, 'fork'):
+        sys.exit('Measuring forked workers needs os.fork.')
+
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}"
+    os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')  # time the startup, not the password hash
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    create_database()
+
+    report = {'cold_start': {module: cold_start(module, args.runs) for module in ('app', 'wsgi')}, 'workers': {}}
+    report['cold_start']['wsgi+deferred'] = cold_start('wsgi', args.runs, DEFERRED_MODULES)
+    for mode in ('preload', 'per-worker'):
+        output = subprocess.run(
+            [sys.executable, __file__, '--measure', mode, '--workers', str(args.workers)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        report['workers'][mode] = json.loads(output.strip().splitlines()[-1])
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=4)
+    print(json.dumps(report, indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+from extensions import db
+from models import Habit, HabitBitmap
+from streaks import period_of
+from utils import completed_days_query, iter_habit_histories, user_completions_query
+from itertools import groupby
+from sqlalchemy import and_
+import base64
+import datetime
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+DAILY_BYTES = 46  # 366 days
+WEEKLY_BYTES = 7  # 53 ISO weeks
+HEATMAP_MAX_DAYS = 3660
+
+def bitmap_size(frequency):
+    """Returns the byte length of one year's bitmap for the given frequency."""
+    return WEEKLY_BYTES if frequency == 'Weekly' else DAILY_BYTES
+
+def bit_position(day, frequency):
+    """Returns the (year, bit index) of a date: day of year, or ISO year and week for Weekly habits."""
+    if frequency == 'Weekly':
+        iso_year, iso_week, _ = day.isocalendar()
+        return iso_year, iso_week - 1
+    return day.year, day.timetuple().tm_yday - 1
+
+def year_start_period(year, frequency):
+    """Returns the streak period that bit 0 of a year's bitmap stands for."""
+    if frequency == 'Weekly':
+        return period_of(datetime.date.fromisocalendar(year, 1, 1), frequency)
+    return period_of(datetime.date(year, 1, 1), frequency)
+
+def pack_days(dates, frequency):
+    """Packs dates into a dict of year -> int with one bit set per completed period."""
+    masks = {}
+    for day in dates:
+        year, bit = bit_position(day, frequency)
+        masks[year] = masks.get(year, 0) | (1 << bit)
+    return masks
+
+def set_completed_days(habit_id, frequency, dates):
+    """ORs the given completed dates into the habit's yearly bitmaps."""
+    masks = pack_days(dates, frequency)
+    if not masks:
+        return
+
+    size = bitmap_size(frequency)
+    existing = {bitmap.year: bitmap for bitmap in db.session.execute(
+        db.select(HabitBitmap).filter(HabitBitmap.habit_id == habit_id, HabitBitmap.year.in_(masks))
+    ).scalars()}
+    for year, mask in masks.items():
+        bitmap = existing.get(year)
+        if bitmap is None:
+            bitmap = HabitBitmap(habit_id=habit_id, year=year, bits=bytes(size))
+            db.session.add(bitmap)
+        bitmap.bits = (int.from_bytes(bitmap.bits, 'little') | mask).to_bytes(size, 'little')
+
+def sync_bitmaps(habit_id, frequency, dates):
+    """Mirrors completed dates into the bitmap store when COMPLETION_BITMAPS is enabled."""
+    if current_app.config['COMPLETION_BITMAPS']:
+        set_completed_days(habit_id, frequency, dates)
+
+def resync_bitmaps(habit_id, frequency):
+    """Rebuilds a habit's bitmaps after check-ins were withdrawn, when COMPLETION_BITMAPS is enabled."""
+    if current_app.config['COMPLETION_BITMAPS']:
+        rebuild_bitmaps(habit_id, frequency)
+
+def rebuild_bitmaps(habit_id, frequency, dates=None):
+    """Replaces all bitmaps of a habit with ones built from its completed dates.
+
+    The completed dates can be passed in when they were already fetched.
+    """
+    if dates is None:
+        dates = [row.completed_on for row in db.session.execute(user_completions_query(completed_only=True, habit_id=habit_id))]
+    db.session.execute(db.delete(HabitBitmap).filter(HabitBitmap.habit_id == habit_id))
+    size = bitmap_size(frequency)
+    db.session.add_all([
+        HabitBitmap(habit_id=habit_id, year=year, bits=mask.to_bytes(size, 'little'))
+        for year, mask in pack_days(dates, frequency).items()
+    ])
+
+def join_years(years, frequency):
+    """Concatenates (year, bits) pairs into one int whose bit 0 is the earliest period."""
+    history = 0
+    base = None
+    for year, bits in years:
+        start = year_start_period(year, frequency)
+        if base is None:
+            base = start
+        history |= int.from_bytes(bits, 'little') << (start - base)
+    return history
+
+def longest_run(history):
+    """Returns the length of the longest run of set bits."""
+    length = 0
+    while history:
+        history &= history >> 1
+        length += 1
+    return length
+
+def last_run(history):
+    """Returns the length of the run of set bits ending at the highest set bit."""
+    if not history:
+        return 0
+    top = history.bit_length() - 1
+    gaps = ~history & ((1 << top) - 1)
+    return top + 1 if not gaps else top - gaps.bit_length() + 1
+
+def compute_bitmap_streaks(user_id, habit_id=None, today=None):
+    """Returns habit_id -> (longest, current) streak for a user's habits, read from the bitmap store.
+
+    The current streak is 0 once neither today's nor the previous period was completed.
+    """
+    today = today or datetime.date.today()
+    query = (
+        db.select(Habit.id, Habit.frequency, HabitBitmap.year, HabitBitmap.bits)
+        .outerjoin(HabitBitmap)
+        .filter(Habit.user_id == user_id)
+        .order_by(Habit.id, HabitBitmap.year)
+    )
+    if habit_id is not None:
+        query = query.filter(Habit.id == habit_id)
+
+    streaks = {}
+    for current_id, rows in groupby(db.session.execute(query), key=lambda row: row.id):
+        rows = list(rows)
+        frequency = rows[0].frequency
+        years = [(row.year, row.bits) for row in rows if row.year is not None]
+        history = join_years(years, frequency)
+        current = last_run(history)
+        if history and year_start_period(years[0][0], frequency) + history.bit_length() - 1 < period_of(today, frequency) - 1:
+            current = 0
+        streaks[current_id] = (longest_run(history), current)
+    return streaks
+
+def heatmap_layout(date_from, date_to, frequency):
+    """Returns (first period, period count) of a heatmap: days from `date_from`, or ISO weeks from its week."""
+    first = period_of(date_from, frequency)
+    return first, period_of(date_to, frequency) - first + 1
+
+def encode_bits(history, count):
+    """Encodes the low `count` bits of an int as base64, little-endian: bit i is bit i % 8 of byte i // 8."""
+    history &= (1 << count) - 1
+    return base64.b64encode(history.to_bytes((count + 7) // 8, 'little')).decode('ascii')
+
+def heatmap(user_id, date_from, date_to, habit_id=None):
+    """Returns habit_id -> (frequency, base64 bits) of a user's completed periods in an inclusive date range.
+
+    Bit i stands for the i-th day from `date_from`, or for Weekly habits the i-th
+    ISO week from the one holding `date_from`. One grouped query reads plain
+    rows: the yearly bitmaps when COMPLETION_BITMAPS is enabled, otherwise the
+    completed days (archived ones included).
+    """
+    if date_to < date_from:
+        raise ValueError('The from date must not be after the to date')
+    if (date_to - date_from).days >= HEATMAP_MAX_DAYS:
+        raise ValueError(f'At most {HEATMAP_MAX_DAYS} days can be requested at once')
+
+    habit_filter = Habit.user_id == user_id
+    if habit_id is not None:
+        habit_filter = and_(habit_filter, Habit.id == habit_id)
+
+    if current_app.config['COMPLETION_BITMAPS']:
+        # ISO years can start in the previous calendar year or end in the next one
+        query = (
+            db.select(Habit.id, Habit.frequency, HabitBitmap.year, HabitBitmap.bits)
+            .outerjoin(HabitBitmap, and_(HabitBitmap.habit_id == Habit.id,
+                                         HabitBitmap.year.between(date_from.year - 1, date_to.year + 1)))
+            .filter(habit_filter)
+            .order_by(Habit.id, HabitBitmap.year)
+        )
+    else:
+        monday = date_from - datetime.timedelta(days=date_from.weekday())
+        days = completed_days_query(habit_filter, monday, date_to).subquery('completed_days')
+        query = (
+            db.select(Habit.id, Habit.frequency, days.c.completed_on)
+            .outerjoin(days, days.c.habit_id == Habit.id)
+            .filter(habit_filter)
+            .order_by(Habit.id)
+        )
+
+    maps = {}
+    for current_id, rows in groupby(db.session.execute(query), key=lambda row: row.id):
+        rows = list(rows)
+        frequency = rows[0].frequency
+        first, count = heatmap_layout(date_from, date_to, frequency)
+        if current_app.config['COMPLETION_BITMAPS']:
+            years = [(row.year, row.bits) for row in rows if row.year is not None]
+            history = join_years(years, frequency)
+            if years:
+                offset = first - year_start_period(years[0][0], frequency)
+                history = history >> offset if offset >= 0 else history << -offset
+        else:
+            history = 0
+            for row in rows:
+                bit = period_of(row.completed_on, frequency) - first if row.completed_on is not None else -1
+                if 0 <= bit < count:
+                    history |= 1 << bit
+        maps[current_id] = (frequency, encode_bits(history, count))
+    return maps
+
+def rebuild_all_bitmaps(habit_filter=None):
+    """Rebuilds the bitmaps of every habit, or of those matching habit_filter, one habit at a time."""
+    count = 0
+    for habit_id, frequency, dates in iter_habit_histories(habit_filter):
+        rebuild_bitmaps(habit_id, frequency, dates)
+        count += 1
+    return count
+
+@click.command('build-bitmaps')
+@with_appcontext
+def build_bitmaps_command():
+    """Converts the existing completion rows into per-habit yearly bitmaps."""
+    count = rebuild_all_bitmaps()
+    db.session.commit()
+    click.echo(f'Built bitmaps for {count} habit(s).')
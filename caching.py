@@ -0,0 +1,207 @@
+from extensions import db
+from models import User
+from auth import current_user_id, reject_stale_token, token_username
+from routing import record_write
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from flask import g, make_response, request
+from functools import wraps
+import datetime
+import threading
+import time
+
+class CacheBackend(ABC):
+    """Interface of a response cache store. Values are (body, status, headers) tuples.
+
+    Keys always start with the user's ETag, so entries of an older data version
+    are never served even by a shared store that missed an invalidation.
+    """
+
+    @abstractmethod
+    def get(self, user_id, key):
+        """Returns the cached value, or None on a miss."""
+
+    @abstractmethod
+    def set(self, user_id, key, value):
+        """Stores a value under the user's key."""
+
+    @abstractmethod
+    def invalidate_user(self, user_id):
+        """Drops every entry of the user."""
+
+    @abstractmethod
+    def clear(self):
+        """Drops every entry."""
+
+    @abstractmethod
+    def stats(self):
+        """Returns a dict of counters for the metrics endpoint."""
+
+class MemoryCacheBackend(CacheBackend):
+    """A thread-safe LRU of responses bounded by the total size of their bodies, with a TTL."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=60):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._user_keys = {}
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id, key):
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._remove((user_id, key))
+                self._misses += 1
+                return None
+            self._entries.move_to_end((user_id, key))
+            self._hits += 1
+            return entry[0]
+
+    def set(self, user_id, key, value):
+        size = len(value[0])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if (user_id, key) in self._entries:
+                self._remove((user_id, key))
+            self._entries[user_id, key] = (value, time.monotonic() + self.ttl, size)
+            self._user_keys.setdefault(user_id, set()).add(key)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def _remove(self, entry_key):
+        _, _, size = self._entries.pop(entry_key)
+        self._size -= size
+        user_id, key = entry_key
+        keys = self._user_keys[user_id]
+        keys.discard(key)
+        if not keys:
+            del self._user_keys[user_id]
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in list(self._user_keys.get(user_id, ())):
+                self._remove((user_id, key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_keys.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'evictions': self._evictions,
+                    'entries': len(self._entries), 'bytes': self._size}
+
+response_cache = MemoryCacheBackend()
+
+def configure_cache(backend):
+    """Swaps the response cache store, e.g. for a shared one."""
+    global response_cache
+    response_cache = backend
+
+def bump_data_version(user_id):
+    """Marks every cached representation of the user's data as stale. Called by all write routes.
+
+    Write routes call it before they append to the change log: the UPDATE holds
+    the user's row lock until commit, so concurrent writes of one user allocate
+    change log seqs in commit order and /sync never skips a late-committing one.
+
+    It also drops the user's cached responses, keeps the user's reads on the
+    primary for a moment, so they see their own write, and wakes the user's
+    event streams once the write commits. A request whose token no longer
+    matches the user row (deleted, renamed or its id reused) is answered with 401
+    and nothing it wrote is kept.
+    """
+    from events import publish_after_commit  # the event broker loads with the first write, not at startup
+
+    update = db.update(User).filter(User.id == user_id)
+    username = token_username()
+    if username is not None:
+        update = update.filter(User.username == username)
+    if not db.session.execute(update.values(data_version=User.data_version + 1)).rowcount:
+        reject_stale_token()
+    response_cache.invalidate_user(user_id)
+    record_write(user_id)
+    publish_after_commit(user_id)
+
+def bump_data_versions(user_ids):
+    """Marks the cached data of many users as stale with one statement, for maintenance jobs that rewrite it."""
+    if not user_ids:
+        return
+    db.session.execute(db.update(User).filter(User.id.in_(user_ids)).values(data_version=User.data_version + 1))
+    for user_id in user_ids:
+        response_cache.invalidate_user(user_id)
+
+def get_data_version(user_id):
+    """Returns the user's current data version with a single primary-key lookup.
+
+    The same lookup answers 401 when the request's token no longer matches the
+    user row, so a deleted user's token stops working in every process at once.
+    """
+    query = db.select(User.data_version, User.username).filter(User.id == user_id)
+    row = db.session.execute(query).one_or_none()
+    if row is None and g.get('read_replica'):
+        g.read_replica = False  # the replica may not have caught up with a new account yet
+        row = db.session.execute(query).one_or_none()
+    username = token_username()
+    if row is None or (username is not None and row.username != username):
+        reject_stale_token()
+    return row.data_version
+
+def conditional(view):
+    """Adds a strong ETag to a read route and answers a matching If-None-Match with 304.
+
+    The ETag is derived from the user's data version, so a 304 costs one query and
+    the view itself never runs. The date is part of the tag because some analytics
+    (completion rates) are relative to today.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user_id = current_user_id()
+        etag = f'{user_id}-{get_data_version(user_id)}-{datetime.date.today().isoformat()}'
+
+        g.etag = etag
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        return response
+    return wrapper
+
+def cached(view):
+    """Serves a read route from the response cache. Must be applied below @conditional.
+
+    Entries are keyed by the user's ETag, the path and the sorted query parameters,
+    so a write (which bumps the data version) or a new day never hits a stale entry.
+    Only complete 200 responses are stored.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user_id = current_user_id()
+        args_key = '&'.join(f'{name}={value}' for name, values in sorted(request.args.lists()) for value in values)
+        key = f'{g.etag}:{request.path}?{args_key}'
+
+        entry = response_cache.get(user_id, key)
+        if entry is not None:
+            body, status, headers = entry
+            return make_response(body, status, headers)
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            headers = [(name, value) for name, value in response.headers if name in ('Content-Type', 'Link', 'X-Next-Cursor')]
+            response_cache.set(user_id, key, (response.get_data(), 200, headers))
+        return response
+    return wrapper
@@ -0,0 +1,105 @@
+from extensions import db
+from models import ChangeLog, User
+from flask.cli import with_appcontext
+from sqlalchemy import func
+import click
+import datetime
+
+def habit_payload(habit):
+    """Returns the synced fields of a habit."""
+    return {
+        'name': habit.name,
+        'description': habit.description,
+        'frequency': habit.frequency,
+        'creation_date': habit.creation_date.isoformat() if habit.creation_date else None,
+    }
+
+def record_habit_change(user_id, habit, op='upsert'):
+    """Appends a habit change ('create' or 'upsert'), or a tombstone for op='delete', to the user's change log."""
+    payload = habit_payload(habit) if op != 'delete' else None
+    db.session.add(ChangeLog(user_id=user_id, entity='habit', entity_id=habit.id, op=op, payload=payload))
+
+def start_logs_compacted(user_ids):
+    """Starts the change logs of bulk-loaded users as if everything before now had been compacted.
+
+    One marker row per user takes a seq, becomes the user's sync_floor and is
+    deleted again, so a client syncing from 0 gets 410 and fetches the loaded
+    data in full instead of paging through one change per row.
+    """
+    if not user_ids:
+        return
+    now = datetime.datetime.utcnow()
+    db.session.execute(ChangeLog.__table__.insert(), [
+        {'user_id': user_id, 'entity': 'user', 'entity_id': user_id, 'op': 'load', 'created_at': now}
+        for user_id in user_ids
+    ])
+    markers = (ChangeLog.user_id.in_(user_ids), ChangeLog.entity == 'user')
+    floors = db.session.execute(
+        db.select(ChangeLog.user_id.label('id'), func.max(ChangeLog.seq).label('sync_floor')).filter(*markers).group_by(ChangeLog.user_id)
+    ).mappings().all()
+    db.session.execute(db.update(User), [dict(floor) for floor in floors])
+    db.session.execute(db.delete(ChangeLog).where(*markers))
+
+def record_completion_changes(user_id, rows):
+    """Appends recorded (habit_id, completed_on, completed) rows to the user's change log with one insert."""
+    now = datetime.datetime.utcnow()
+    db.session.execute(ChangeLog.__table__.insert(), [
+        {
+            'user_id': user_id, 'entity': 'completion', 'entity_id': row['habit_id'], 'op': 'upsert', 'created_at': now,
+            'payload': {'completed_on': row['completed_on'].isoformat(), 'completed': row['completed']},
+        }
+        for row in rows
+    ])
+
+def get_changes(user_id, since, limit, username=None):
+    """Returns up to `limit` changes after seq `since`, plus whether more are waiting.
+
+    The user's compaction floor comes back in the same indexed query. Raises
+    LookupError when the log was compacted past `since`: the client has missed
+    changes and must refetch everything. Raises KeyError when the user no longer
+    exists, or no longer under `username`.
+    """
+    rows = db.session.execute(
+        db.select(User.sync_floor, User.username, ChangeLog)
+        .outerjoin(ChangeLog, (ChangeLog.user_id == User.id) & (ChangeLog.seq > since))
+        .filter(User.id == user_id)
+        .order_by(ChangeLog.seq)
+        .limit(limit + 1)
+    ).all()
+    if not rows or (username is not None and rows[0].username != username):
+        raise KeyError(user_id)
+    if since < rows[0].sync_floor:
+        raise LookupError(since)
+    changes = [row.ChangeLog for row in rows if row.ChangeLog is not None]
+    return changes[:limit], len(changes) > limit
+
+def get_latest_seq(user_id):
+    """Returns the seq of the user's latest change, also when it was compacted away."""
+    latest = db.select(func.max(ChangeLog.seq)).filter(ChangeLog.user_id == user_id).scalar_subquery()
+    row = db.session.execute(db.select(func.coalesce(latest, 0), User.sync_floor).filter(User.id == user_id)).one_or_none()
+    return max(row) if row else 0
+
+def compact_changelog(older_than):
+    """Deletes log entries created before `older_than` and returns how many were removed.
+
+    Each affected user's sync_floor is raised to the last removed seq, so clients
+    that synced before it are told to resync in full.
+    """
+    floors = db.session.execute(
+        db.select(ChangeLog.user_id.label('id'), func.max(ChangeLog.seq).label('sync_floor'))
+        .filter(ChangeLog.created_at < older_than)
+        .group_by(ChangeLog.user_id)
+    ).mappings().all()
+    if not floors:
+        return 0
+    db.session.execute(db.update(User), [dict(floor) for floor in floors])
+    return db.session.execute(db.delete(ChangeLog).where(ChangeLog.created_at < older_than)).rowcount
+
+@click.command('compact-changelog')
+@click.option('--days', default=30, show_default=True, help='Keep the changes of this many days.')
+@with_appcontext
+def compact_changelog_command(days):
+    """Removes old change log entries; clients that synced longer ago must resync in full."""
+    removed = compact_changelog(datetime.datetime.utcnow() - datetime.timedelta(days=days))
+    db.session.commit()
+    click.echo(f'Removed {removed} change log entries.')
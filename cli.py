@@ -1,97 +1,264 @@
-import requests
+"""Command-line client for the habit tracker API.
+
+Usage:
+    python cli.py login --username alice
+    python cli.py create --name "Read for 30 minutes" --frequency daily
+    python cli.py complete --name "Read for 30 minutes" --on 2025-04-20
+    python cli.py streak --all
+    python cli.py batch completions.ndjson --concurrency 8
+    python cli.py interactive
+
+The token from login or register is saved to ~/.habit_tracker_token (or
+HABIT_TRACKER_TOKEN_FILE) and reused by later commands. HABIT_TRACKER_URL or
+--url selects the server.
+"""
+import argparse
+import asyncio
+import csv
+import getpass
 import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+BASE_URL = os.environ.get('HABIT_TRACKER_URL', 'http://127.0.0.1:5000')
+TOKEN_FILE = os.environ.get('HABIT_TRACKER_TOKEN_FILE', os.path.expanduser('~/.habit_tracker_token'))
+BATCH_CHUNK_SIZE = 5000
+
+_local = threading.local()
+_token = None
+_token_loaded = False
+
+def get_session():
+    """Returns this thread's pooled HTTP session, so connections are reused across calls."""
+    if not hasattr(_local, 'session'):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _local.session = session
+    return _local.session
+
+def load_token():
+    """Returns the saved token, or None when not logged in. The file is read once per invocation."""
+    global _token, _token_loaded
+    if not _token_loaded:
+        try:
+            with open(TOKEN_FILE) as token_file:
+                _token = token_file.read().strip() or None
+        except FileNotFoundError:
+            _token = None
+        _token_loaded = True
+    return _token
+
+def save_token(token):
+    """Saves the token readable by the current user only."""
+    global _token, _token_loaded
+    descriptor = os.open(TOKEN_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, 'w') as token_file:
+        token_file.write(token)
+    _token, _token_loaded = token, True
+
+def api(method, path, body=None, auth=True):
+    """Sends one request to the API and returns the response."""
+    headers = {}
+    if auth:
+        token = load_token()
+        if not token:
+            sys.exit('Not logged in. Run `python cli.py login` first.')
+        headers['Authorization'] = f'Bearer {token}'
+    return get_session().request(method, f'{BASE_URL}{path}', headers=headers, json=body)
 
-BASE_URL = 'http://127.0.0.1:5000'
-TOKEN = None  # Store the token globally
+def print_json(data):
+    print(json.dumps(data, indent=4))
 
-def register():
+def normalize_frequency(frequency):
+    """Accepts daily/weekly in any case and returns the API's Daily/Weekly."""
+    return frequency.capitalize()
+
+def find_habit_id(name):
+    """Resolves a habit name to its id."""
+    response = api('GET', '/habits?fields=id,name')
+    response.raise_for_status()
+    for habit in response.json():
+        if habit['name'] == name:
+            return habit['id']
+    sys.exit(f'No habit named {name!r}.')
+
+def register(username=None, email=None, password=None):
     """Registers a new user."""
-    username = input('Username: ')
-    email = input('Email: ')
-    password = input('Password: ')
-    response = requests.post(f'{BASE_URL}/register', json={'username': username, 'email': email, 'password': password})
+    username = username or input('Username: ')
+    email = email or input('Email: ')
+    password = password or getpass.getpass('Password: ')
+    response = api('POST', '/register', {'username': username, 'email': email, 'password': password}, auth=False)
     if response.status_code == 201:
+        save_token(response.json()['access_token'])
         print('Registration successful!')
     else:
         print('Registration failed.')
 
-def login():
-    """Logs in a user and stores the JWT token."""
-    global TOKEN
-    username = input('Username: ')
-    password = input('Password: ')
-    response = requests.post(f'{BASE_URL}/login', json={'username': username, 'password': password})
+def login(username=None, password=None):
+    """Logs in a user and saves the JWT token."""
+    username = username or input('Username: ')
+    password = password or getpass.getpass('Password: ')
+    response = api('POST', '/login', {'username': username, 'password': password}, auth=False)
     if response.status_code == 200:
-        TOKEN = response.json()['access_token']
+        save_token(response.json()['access_token'])
         print('Login successful!')
     else:
         print('Login failed.')
 
-def create_habit():
+def create_habit(name=None, frequency=None, description=None):
     """Creates habit"""
-    name = input('Habit name: ')
-    description = input('Habit description: ')
-    frequency = input('Habit frequency (Daily/Weekly): ')
-    response = requests.post(f'{BASE_URL}/habits', headers={'Authorization': f'Bearer {TOKEN}'}, json={'name': name, 'description': description, 'frequency': frequency})
+    name = name or input('Habit name: ')
+    description = description if description is not None else input('Habit description: ')
+    frequency = normalize_frequency(frequency or input('Habit frequency (Daily/Weekly): '))
+    response = api('POST', '/habits', {'name': name, 'description': description, 'frequency': frequency})
     if response.status_code == 201:
-        print('Habit created!')
+        print(f"Habit created with ID {response.json()['id']}!")
     else:
         print('Failed to create habit.')
 
 def get_all_habits():
     """Shows all habits"""
-    response = requests.get(f'{BASE_URL}/habits/analytics/all', headers={'Authorization': f'Bearer {TOKEN}'})
+    response = api('GET', '/habits/analytics/all')
     if response.status_code == 200:
-        print(json.dumps(response.json(), indent=4))
+        print_json(response.json())
     else:
         print('Failed to get habits.')
 
-def get_habits_by_periodicity():
+def get_habits_by_periodicity(periodicity=None):
     """Shows habits by periodicity"""
-    periodicity = input('Periodicity (Daily/Weekly): ')
-    response = requests.get(f'{BASE_URL}/habits/analytics/periodicity/{periodicity}', headers={'Authorization': f'Bearer {TOKEN}'})
+    periodicity = normalize_frequency(periodicity or input('Periodicity (Daily/Weekly): '))
+    response = api('GET', f'/habits/analytics/periodicity/{periodicity}')
     if response.status_code == 200:
-        print(json.dumps(response.json(), indent=4))
+        print_json(response.json())
     else:
         print('Failed to get habits.')
 
 def get_longest_streak():
     """Displays longest strike"""
-    response = requests.get(f'{BASE_URL}/habits/analytics/longest_streak', headers={'Authorization': f'Bearer {TOKEN}'})
+    response = api('GET', '/habits/analytics/longest_streak')
     if response.status_code == 200:
-        print(json.dumps(response.json(), indent=4))
+        print_json(response.json())
     else:
         print('Failed to get longest streak.')
 
-def get_longest_streak_by_habit():
+def get_longest_streak_by_habit(habit_id=None):
     """Displays longest strike by habit"""
-    habit_id = input('Habit ID: ')
-    response = requests.get(f'{BASE_URL}/habits/analytics/longest_streak/{habit_id}', headers={'Authorization': f'Bearer {TOKEN}'})
+    habit_id = habit_id or input('Habit ID: ')
+    response = api('GET', f'/habits/analytics/longest_streak/{habit_id}')
     if response.status_code == 200:
-        print(json.dumps(response.json(), indent=4))
+        print_json(response.json())
     else:
         print('Failed to get longest streak.')
 
-def mark_habit_completed():
+def get_all_streaks():
+    """Displays the longest and current streak of every habit"""
+    response = api('GET', '/habits/analytics/summary')
+    if response.status_code == 200:
+        print_json(response.json())
+    else:
+        print('Failed to get streaks.')
+
+def mark_habit_completed(habit_id=None, completed_on=None, completed=None):
     """Marks habit as completed"""
-    habit_id = input('Habit ID: ')
-    completed_on = input('Completed on (YYYY-MM-DD): ')
-    completed = input('Completed (True/False): ').lower() == 'true'
-    response = requests.post(
-        f'{BASE_URL}/habits/{habit_id}/completions',
-        headers={'Authorization': f'Bearer {TOKEN}'},
-        json={'completed_on': completed_on, 'completed': completed}
-    )
+    habit_id = habit_id or input('Habit ID: ')
+    completed_on = completed_on or input('Completed on (YYYY-MM-DD): ')
+    if completed is None:
+        completed = input('Completed (True/False): ').lower() == 'true'
+    response = api('POST', f'/habits/{habit_id}/completions', {'completed_on': completed_on, 'completed': completed})
     if response.status_code == 201:
         print('Habit completion recorded!')
     else:
         print('Failed to record habit completion.')
 
-def main():
-    """Main function for the CLI."""
+def read_operations(path):
+    """Reads batch operations from an NDJSON file or a CSV file with a header row.
+
+    Each operation is {"op": "complete", "habit_id", "completed_on", "completed"}
+    or {"op": "create", "name", "frequency", "description"}; op defaults to complete.
+    """
+    with open(path, newline='') as operations_file:
+        if path.endswith('.csv'):
+            operations = list(csv.DictReader(operations_file))
+            for operation in operations:
+                if 'completed' in operation:
+                    operation['completed'] = operation['completed'].lower() in ('1', 'true', 'yes')
+            return operations
+        return [json.loads(line) for line in operations_file if line.strip()]
+
+def send_operation(operation):
+    """Sends one operation as its own request and returns whether it succeeded."""
+    if operation.get('op', 'complete') == 'create':
+        response = api('POST', '/habits', {
+            'name': operation['name'],
+            'description': operation.get('description'),
+            'frequency': normalize_frequency(operation['frequency']),
+        })
+        return 1 if response.status_code == 201 else 0
+    response = api('POST', f"/habits/{operation['habit_id']}/completions", {
+        'completed_on': operation['completed_on'],
+        'completed': operation.get('completed', True),
+    })
+    return 1 if response.status_code == 201 else 0
+
+def send_completion_chunk(records):
+    """Sends a chunk of completions to the bulk endpoint and returns how many were recorded or updated."""
+    response = api('POST', '/habits/completions/batch', [
+        {'habit_id': record['habit_id'], 'completed_on': record['completed_on'], 'completed': record.get('completed', True)}
+        for record in records
+    ])
+    if response.status_code != 200:
+        return 0
+    summary = response.json()
+    return summary['created'] + summary['updated']
+
+async def run_batch(operations, concurrency, bulk, chunk_size):
+    """Sends the operations with at most `concurrency` requests in flight.
+
+    The requests run on a pool of `concurrency` threads of their own, as the
+    default executor of asyncio.to_thread would cap them at a few per CPU.
+    Habit creations go first, one request each. With bulk, completions are then
+    sent in chunks through the batch endpoint; otherwise one request per completion.
+    Returns the number of operations that succeeded.
+    """
+    loop = asyncio.get_running_loop()
+    creations = [operation for operation in operations if operation.get('op', 'complete') == 'create']
+    completions = [operation for operation in operations if operation.get('op', 'complete') != 'create']
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        def send(function, argument):
+            return loop.run_in_executor(executor, function, argument)
+
+        succeeded = sum(await asyncio.gather(*(send(send_operation, operation) for operation in creations)))
+        if bulk:
+            chunks = [completions[i:i + chunk_size] for i in range(0, len(completions), chunk_size)]
+            succeeded += sum(await asyncio.gather(*(send(send_completion_chunk, chunk) for chunk in chunks)))
+        else:
+            succeeded += sum(await asyncio.gather(*(send(send_operation, operation) for operation in completions)))
+    return succeeded
+
+def batch(path, concurrency=8, bulk=True, chunk_size=BATCH_CHUNK_SIZE):
+    """Runs a file of operations and reports the throughput."""
+    if not load_token():
+        sys.exit('Not logged in. Run `python cli.py login` first.')
+    operations = read_operations(path)
+    started = time.perf_counter()
+    succeeded = asyncio.run(run_batch(operations, concurrency, bulk, chunk_size))
+    elapsed = time.perf_counter() - started
+    print(f'{succeeded} of {len(operations)} operations succeeded in {elapsed:.2f}s '
+          f'({len(operations) / elapsed if elapsed else 0:,.0f} ops/s).')
+
+def interactive():
+    """Menu-driven mode."""
     while True:
         print('\nOptions:')
-        print('1. Register')  # Add this option
+        print('1. Register')
         print('2. Login')
         print('3. Create Habit')
         print('4. Get All Habits')
@@ -103,7 +270,7 @@ def main():
 
         choice = input('Enter your choice: ')
 
-        if choice == '1': #register
+        if choice == '1':
             register()
         elif choice == '2':
             login()
@@ -124,5 +291,80 @@ def main():
         else:
             print('Invalid choice.')
 
+def build_parser():
+    parser = argparse.ArgumentParser(description='Habit tracker command-line client.')
+    parser.add_argument('--url', help=f'API base URL (default: {BASE_URL}).')
+    commands = parser.add_subparsers(dest='command')
+
+    command = commands.add_parser('register', help='Register a new user.')
+    command.add_argument('--username')
+    command.add_argument('--email')
+    command.add_argument('--password')
+
+    command = commands.add_parser('login', help='Log in and save the token.')
+    command.add_argument('--username')
+    command.add_argument('--password')
+
+    command = commands.add_parser('create', help='Create a habit.')
+    command.add_argument('--name', required=True)
+    command.add_argument('--frequency', required=True, type=str.lower, choices=['daily', 'weekly'])
+    command.add_argument('--description', default='')
+
+    command = commands.add_parser('list', help='List habits, optionally of one frequency.')
+    command.add_argument('--frequency', type=str.lower, choices=['daily', 'weekly'])
+
+    command = commands.add_parser('complete', help='Record a completion (today by default).')
+    habit = command.add_mutually_exclusive_group(required=True)
+    habit.add_argument('--name')
+    habit.add_argument('--id', type=int)
+    command.add_argument('--on', help='Date as YYYY-MM-DD.')
+    command.add_argument('--missed', action='store_true', help='Record the day as not completed.')
+
+    command = commands.add_parser('streak', help='Show streaks.')
+    habit = command.add_mutually_exclusive_group()
+    habit.add_argument('--name')
+    habit.add_argument('--id', type=int)
+    habit.add_argument('--all', action='store_true', help='Longest and current streak of every habit.')
+
+    command = commands.add_parser('batch', help='Send a file of operations (NDJSON or CSV).')
+    command.add_argument('file')
+    command.add_argument('--concurrency', type=int, default=8, help='Requests in flight at once.')
+    command.add_argument('--no-bulk', dest='bulk', action='store_false', help='Send one request per completion.')
+    command.add_argument('--chunk-size', type=int, default=BATCH_CHUNK_SIZE, help='Completions per bulk request.')
+
+    commands.add_parser('interactive', help='Menu-driven mode (the default).')
+    return parser
+
+def main():
+    """Main function for the CLI."""
+    global BASE_URL
+    args = build_parser().parse_args()
+    if args.url:
+        BASE_URL = args.url.rstrip('/')
+
+    if args.command == 'register':
+        register(args.username, args.email, args.password)
+    elif args.command == 'login':
+        login(args.username, args.password)
+    elif args.command == 'create':
+        create_habit(args.name, args.frequency, args.description)
+    elif args.command == 'list':
+        get_habits_by_periodicity(args.frequency) if args.frequency else get_all_habits()
+    elif args.command == 'complete':
+        import datetime
+        habit_id = args.id or find_habit_id(args.name)
+        mark_habit_completed(habit_id, args.on or datetime.date.today().isoformat(), not args.missed)
+    elif args.command == 'streak':
+        if args.all:
+            get_all_streaks()
+        elif args.id or args.name:
+            get_longest_streak_by_habit(args.id or find_habit_id(args.name))
+        else:
+            get_longest_streak()
+    elif args.command == 'batch':
+        batch(args.file, args.concurrency, args.bulk, args.chunk_size)
+    else:
+        interactive()
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,175 @@
+from extensions import db, bcrypt
+from models import User, Habit, HabitCompletion
+from changelog import start_logs_compacted
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+from flask.cli import with_appcontext
+import click
+import datetime
+import random
+import time
+
+HABIT_TEMPLATES = [
+    ('Read a book', 'Read for 30 minutes', 'Daily'),
+    ('Exercise', '30 minutes of cardio', 'Daily'),
+    ('Learn a new language', 'Practice for 1 hour', 'Weekly'),
+    ('Write in a journal', 'Write 3 pages', 'Daily'),
+    ('Clean the house', 'Clean for 2 hours', 'Weekly'),
+    ('Meditate', 'Meditate for 10 minutes', 'Daily'),
+    ('Call family', 'Catch up with family', 'Weekly'),
+    ('Drink water', 'Drink 2 liters of water', 'Daily'),
+]
+
+def completion_days(rng, days, frequency):
+    """Yields (day offset, completed) pairs for one habit with a realistic pattern.
+
+    Each habit gets its own adherence level. Completing today makes tomorrow more
+    likely (so streaks form), weekends dip, and Weekly habits are checked in on a
+    preferred weekday.
+    """
+    adherence = rng.uniform(0.35, 0.95)
+    weekday = rng.randrange(7)
+    completed = False
+    for day in range(days):
+        if frequency == 'Weekly' and day % 7 != weekday:
+            continue
+        chance = adherence + (0.1 if completed else -0.1)
+        if frequency == 'Daily' and day % 7 in (5, 6):
+            chance -= 0.15
+        completed = rng.random() < chance
+        if completed or rng.random() < 0.2:  # some clients also log misses
+            yield day, completed
+
+def generate_dataset(users, habits, days, password_hash, seed=0, chunk_size=10000, username_prefix='user', first_user=0):
+    """Inserts users x habits x days of synthetic completions with bulk inserts.
+
+    Users are named username_prefix + number, numbered from first_user. Every
+    chunk of completions is inserted with one executemany and committed on its
+    own. Instead of a change log entry per row, each user's log starts with a
+    sync floor, so clients fetch the loaded data in full. Returns (user ids,
+    number of habits, number of completions). The derived state is not updated;
+    run rebuild_derived_state afterwards.
+    """
+    rng = random.Random(seed)
+    start = datetime.date.today() - datetime.timedelta(days=days)
+
+    user_rows = [
+        {'username': f'{username_prefix}{i}', 'email': f'{username_prefix}{i}@example.com', 'password': password_hash}
+        for i in range(first_user, first_user + users)
+    ]
+    db.session.execute(db.insert(User), user_rows)
+    user_ids = db.session.execute(
+        db.select(User.id).filter(User.username.in_([row['username'] for row in user_rows])).order_by(User.id)
+    ).scalars().all()
+    start_logs_compacted(user_ids)
+
+    habit_rows = []
+    for user_id in user_ids:
+        for i in range(habits):
+            name, description, frequency = HABIT_TEMPLATES[i % len(HABIT_TEMPLATES)]
+            habit_rows.append({'name': f'{name} #{i}', 'description': description, 'frequency': frequency, 'user_id': user_id})
+    db.session.execute(db.insert(Habit), habit_rows)
+    created_habits = db.session.execute(
+        db.select(Habit.id, Habit.frequency).filter(Habit.user_id.in_(user_ids)).order_by(Habit.id)
+    ).all()
+
+    # A Core insert on the table skips the ORM bulk-insert bookkeeping, which costs more than the executemany itself
+    insert_completions = HabitCompletion.__table__.insert()
+
+    completion_count = 0
+    chunk = []
+    for habit in created_habits:
+        for day, completed in completion_days(rng, days, habit.frequency):
+            chunk.append({'habit_id': habit.id, 'completed_on': start + datetime.timedelta(days=day), 'completed': completed})
+            if len(chunk) >= chunk_size:
+                db.session.execute(insert_completions, chunk)
+                db.session.commit()
+                completion_count += len(chunk)
+                chunk = []
+    if chunk:
+        db.session.execute(insert_completions, chunk)
+        completion_count += len(chunk)
+
+    db.session.commit()
+    return user_ids, len(created_habits), completion_count
+
+def rebuild_derived_state(user_ids, chunk_size=10000):
+    """Brings everything kept alongside the completions up to date after a bulk load.
+
+    Rebuilds the streak state and, when COMPLETION_BITMAPS is enabled, the
+    bitmaps of the given users' habits, chunk_size users at a time, then the
+    leaderboards, and bumps the users' data versions so none of their cached
+    responses or ETags outlive the load.
+    """
+    from streaks import rebuild_all_streaks
+    from bitmaps import rebuild_all_bitmaps
+    from leaderboard import rebuild_leaderboard
+    from caching import bump_data_versions
+
+    for first in range(0, len(user_ids), chunk_size):
+        seeded = Habit.user_id.in_(user_ids[first:first + chunk_size])
+        rebuild_all_streaks(seeded)
+        if current_app.config['COMPLETION_BITMAPS']:
+            rebuild_all_bitmaps(seeded)
+    db.session.info.pop('changed_streaks', None)  # the boards are rebuilt as a whole below
+    rebuild_leaderboard(current_app.config['LEADERBOARD_SIZE'])
+    for first in range(0, len(user_ids), chunk_size):
+        bump_data_versions(user_ids[first:first + chunk_size])
+
+def generate_worker(users, habits, days, password_hash, seed, chunk_size, username_prefix, first_user):
+    """Runs generate_dataset in a worker process with its own database connections."""
+    from app import app
+
+    with app.app_context():
+        db.engine.dispose(close=False)  # never reuse connections inherited from the parent
+        user_ids, habit_count, completion_count = generate_dataset(
+            users, habits, days, password_hash, seed, chunk_size, username_prefix, first_user,
+        )
+        return user_ids, habit_count, completion_count
+
+@click.command('seed')
+@click.option('--users', default=10, show_default=True, help='Number of users to create.')
+@click.option('--habits', default=5, show_default=True, help='Habits per user.')
+@click.option('--days', default=365, show_default=True, help='Days of completion history per habit.')
+@click.option('--workers', default=1, show_default=True, help='Worker processes, each seeding a share of the users.')
+@click.option('--chunk-size', default=10000, show_default=True, help='Completion rows per insert and transaction.')
+@click.option('--prefix', default='user', show_default=True, help='Username prefix; users are named prefix0, prefix1, ...')
+@click.option('--password', default='password', show_default=True, help='Password of every seeded user.')
+@click.option('--seed', 'seed_value', default=0, show_default=True, help='Random seed.')
+@click.option('--skip-rebuild', '--skip-streaks', 'skip_rebuild', is_flag=True,
+              help='Do not rebuild the streaks, bitmaps and leaderboards afterwards.')
+@with_appcontext
+def seed_command(users, habits, days, workers, chunk_size, prefix, password, seed_value, skip_rebuild):
+    """Bulk-inserts synthetic users, habits and completions, starting their change logs at a sync floor.
+
+    Several workers only help on PostgreSQL; SQLite serializes writers.
+    """
+    password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+    workers = max(1, min(workers, users))
+    shares = [users // workers + (worker < users % workers) for worker in range(workers)]
+    firsts = [sum(shares[:worker]) for worker in range(workers)]
+
+    started = time.perf_counter()
+    if workers == 1:
+        totals = [generate_dataset(users, habits, days, password_hash, seed_value, chunk_size, prefix)]
+    else:
+        db.engine.dispose()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            totals = list(executor.map(
+                generate_worker, shares, [habits] * workers, [days] * workers, [password_hash] * workers,
+                [seed_value + worker for worker in range(workers)], [chunk_size] * workers, [prefix] * workers, firsts,
+            ))
+    elapsed = time.perf_counter() - started
+
+    user_ids = [user_id for worker_user_ids, _, _ in totals for user_id in worker_user_ids]
+    habit_count = sum(habit_count for _, habit_count, _ in totals)
+    completion_count = sum(completion_count for _, _, completion_count in totals)
+    rows = len(user_ids) + habit_count + completion_count
+    click.echo(f'Inserted {len(user_ids)} users, {habit_count} habits and {completion_count} completions '
+               f'in {elapsed:.2f}s ({rows / elapsed:,.0f} rows/s).')
+
+    if not skip_rebuild:
+        started = time.perf_counter()
+        rebuild_derived_state(user_ids)
+        db.session.commit()
+        click.echo(f'Rebuilt streaks, bitmaps and leaderboards in {time.perf_counter() - started:.2f}s.')
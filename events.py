@@ -0,0 +1,151 @@
+from extensions import db
+from models import Habit, HabitStreak
+from changelog import get_changes, get_latest_seq
+from streaks import live_current_length
+from routing import RoutingSession
+from sqlalchemy import event
+import json
+import threading
+import time
+
+EVENT_NAMES = {
+    ('habit', 'create'): 'habit.created',
+    ('habit', 'upsert'): 'habit.updated',
+    ('habit', 'delete'): 'habit.deleted',
+    ('completion', 'upsert'): 'completion.recorded',
+}
+
+class StreamsFull(Exception):
+    """Raised when this process already holds EVENTS_MAX_STREAMS open event streams."""
+
+class Subscription:
+    """A user's open event stream, woken whenever one of the user's writes commits in this process."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._wakeup = threading.Event()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def wait(self, timeout):
+        """Blocks until notified or until `timeout` seconds passed, and returns whether it was notified."""
+        notified = self._wakeup.wait(timeout)
+        self._wakeup.clear()
+        return notified
+
+class EventBroker:
+    """Fans a user's committed writes out to the user's event streams in this process.
+
+    Only a wake-up travels through the broker; the streams read what changed from
+    the change log, so writes committed by other processes reach them too, at the
+    latest with the next heartbeat.
+    """
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id, limit):
+        with self._lock:
+            if limit and self._count >= limit:
+                raise StreamsFull()
+            subscription = Subscription(user_id)
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+            self._count += 1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id, set())
+            if subscription in subscriptions:
+                subscriptions.discard(subscription)
+                self._count -= 1
+            if not subscriptions:
+                self._subscriptions.pop(subscription.user_id, None)
+
+    def publish(self, user_id):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.notify()
+
+    def stream_count(self):
+        with self._lock:
+            return self._count
+
+broker = EventBroker()
+
+def publish_after_commit(user_id):
+    """Wakes the user's event streams once the current transaction commits."""
+    db.session.info.setdefault('event_users', set()).add(user_id)
+
+@event.listens_for(RoutingSession, 'after_commit')
+def publish_committed(session):
+    for user_id in session.info.pop('event_users', ()):
+        broker.publish(user_id)
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def discard_uncommitted(session):
+    session.info.pop('event_users', None)
+
+def format_event(name, data, event_id=None):
+    """Formats one server-sent event."""
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines += [f'event: {name}', f'data: {json.dumps(data)}']
+    return '\n'.join(lines) + '\n\n'
+
+def streak_events(user_id, habit_ids):
+    """Returns the streak.updated events of the user's given habits, read with one query."""
+    rows = db.session.execute(
+        db.select(HabitStreak.habit_id, Habit.frequency, HabitStreak.longest_length, HabitStreak.current_length, HabitStreak.last_completed_on)
+        .join(Habit, Habit.id == HabitStreak.habit_id)
+        .filter(Habit.user_id == user_id, HabitStreak.habit_id.in_(habit_ids))
+        .order_by(HabitStreak.habit_id)
+    ).all()
+    return [
+        format_event('streak.updated', {
+            'habit_id': row.habit_id,
+            'longest_streak': row.longest_length,
+            'current_streak': live_current_length(row.current_length, row.last_completed_on, row.frequency),
+        })
+        for row in rows
+    ]
+
+def event_stream(user_id, subscription, since, heartbeat, max_seconds, batch_size):
+    """Yields the user's changes after seq `since` as server-sent events, then follows new ones.
+
+    Every change carries its change log seq as event id, so a reconnecting client
+    resumes with Last-Event-ID. After the completion and habit changes of each
+    read, the recomputed streaks of the habits involved follow as streak.updated.
+    A comment line goes out every `heartbeat` seconds while idle, and the stream
+    ends after `max_seconds` so clients reconnect and rebalance across workers.
+    The database connection is released while waiting.
+    """
+    deadline = time.monotonic() + max_seconds
+    seq = since
+    yield f'retry: {int(heartbeat * 1000)}\n\n'
+    while time.monotonic() < deadline:
+        try:
+            changes, has_more = get_changes(user_id, seq, batch_size)
+        except LookupError:
+            seq = get_latest_seq(user_id)
+            changes, has_more = [], False
+            yield format_event('reset', {'seq': seq}, seq)
+
+        chunks = [
+            format_event(EVENT_NAMES[change.entity, change.op], {'id': change.entity_id, 'data': change.payload}, change.seq)
+            for change in changes
+        ]
+        streaked = {change.entity_id for change in changes if change.op != 'delete'}
+        if streaked:
+            chunks += streak_events(user_id, streaked)
+        db.session.close()  # give the connection back to the pool while idle
+        if changes:
+            seq = changes[-1].seq
+            yield ''.join(chunks)
+        if has_more:
+            continue
+        if not subscription.wait(min(heartbeat, max(deadline - time.monotonic(), 0))):
+            yield ': heartbeat\n\n'
@@ -1,5 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from flask_bcrypt import Bcrypt
+from flask_jwt_extended import JWTManager
+from routing import RoutingSession
 
-db = SQLAlchemy()
-migrate = Migrate()
\ No newline at end of file
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+bcrypt = Bcrypt()
+jwt = JWTManager()
@@ -0,0 +1,26 @@
+"""Gunicorn settings for wsgi:app; the environment variables below override the defaults."""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Each open /events stream holds a thread for its whole life, so the default is a
+# threaded worker; an async worker class such as gevent holds them on greenlets instead
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+if worker_class == 'gthread':
+    # Leave a quarter of the threads to ordinary requests however many streams are open
+    os.environ.setdefault('EVENTS_MAX_STREAMS', str(max(threads * 3 // 4, 1)))
+    # Shed logins with 503 before they tie up more than half of the threads waiting on bcrypt
+    os.environ.setdefault('BCRYPT_POOL_MAX_PENDING', str(max(threads // 2, 1)))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))  # gthread and async workers keep streams open past it
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))  # recycle workers after this many requests (0 never)
+max_requests_jitter = max_requests // 10
+
+# Build the app once in the master: workers start without importing anything and
+# share the loaded code copy-on-write instead of each holding their own copy
+preload_app = True
+
+def post_fork(server, worker):
+    from wsgi import reset_after_fork
+    reset_after_fork()
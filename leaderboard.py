@@ -0,0 +1,216 @@
+from extensions import db
+from models import Habit, HabitStreak, LeaderboardEntry, User
+from streaks import current_expires_on, extend_streak, live_current_length
+from utils import completed_days_query
+from flask import current_app
+from flask.cli import with_appcontext
+from itertools import groupby
+from sqlalchemy import func, or_
+import click
+import datetime
+import heapq
+import time
+
+METRICS = ('longest', 'current')
+GLOBAL_BOARD = 'all'
+
+def ranking(value, user_id):
+    """Sort key of a leaderboard entry: the higher streak first, the earlier user on ties."""
+    return value, -user_id
+
+def better(best, candidate):
+    """Returns the higher of two (streak, expires_on) pairs, preferring the one that lapses later on ties."""
+    if best is None:
+        return candidate
+    return max(best, candidate, key=lambda pair: (pair[0], pair[1] or datetime.date.max))
+
+def habit_bests(frequency, longest, current, last_completed_on, today=None):
+    """Returns the (streak, expires_on) pair a habit's streak state contributes to each metric.
+
+    Current streaks that already lapsed count as 0; the others expire on the
+    first day they would have lapsed without another completion.
+    """
+    current = live_current_length(current, last_completed_on, frequency, today)
+    return (longest, None), (current, current_expires_on(last_completed_on, frequency) if current else None)
+
+def user_bests(user_id, today=None):
+    """Returns (board, metric) -> the user's best (streak, expires_on), for the global and per-frequency boards."""
+    rows = db.session.execute(
+        db.select(Habit.frequency, HabitStreak.longest_length, HabitStreak.current_length, HabitStreak.last_completed_on)
+        .join(HabitStreak)
+        .filter(Habit.user_id == user_id)
+    ).all()
+    bests = {}
+    for row in rows:
+        pairs = habit_bests(*row, today)
+        for board in (GLOBAL_BOARD, row.frequency):
+            for metric, pair in zip(METRICS, pairs):
+                bests[board, metric] = better(bests.get((board, metric)), pair)
+    return bests
+
+def update_leaderboard(user_id):
+    """Folds a user's current best streaks into the top-N boards after a write.
+
+    Runs only when the write changed a streak state (see streaks.note_streak_change),
+    and only writes entries whose value changed. A user who climbs onto a full
+    board pushes the lowest entry off, after lapsed current streaks made room. A
+    user whose streak dropped is updated in place, so until the next rebuild a
+    board may miss someone who would now rank above them. Does nothing when
+    LEADERBOARD_SIZE is 0.
+    """
+    size = current_app.config['LEADERBOARD_SIZE']
+    changed = db.session.info.pop('changed_streaks', None)
+    if not size or not changed:
+        return
+
+    today = datetime.date.today()
+    bests = user_bests(user_id, today)
+    entries = {
+        (entry.board, entry.metric): entry
+        for entry in db.session.execute(db.select(LeaderboardEntry).filter_by(user_id=user_id)).scalars()
+    }
+    floors = {}
+    for key in set(bests) | set(entries):
+        value, expires_on = bests.get(key, (0, None))
+        entry = entries.get(key)
+        if entry is not None:
+            if value:
+                entry.streak = value
+                entry.expires_on = expires_on
+            else:
+                db.session.delete(entry)
+            continue
+        if not value:
+            continue
+
+        if not floors:
+            db.session.execute(
+                db.delete(LeaderboardEntry).where(LeaderboardEntry.expires_on <= today, LeaderboardEntry.user_id != user_id),
+                execution_options={'synchronize_session': False},
+            )
+            floors = {
+                (board, metric): (count, lowest)
+                for board, metric, count, lowest in db.session.execute(
+                    db.select(LeaderboardEntry.board, LeaderboardEntry.metric, func.count(), func.min(LeaderboardEntry.streak))
+                    .group_by(LeaderboardEntry.board, LeaderboardEntry.metric)
+                )
+            }
+        count, lowest = floors.get(key, (0, 0))
+        if count >= size:
+            if value <= lowest:
+                continue
+            board, metric = key
+            last = db.session.execute(
+                db.select(LeaderboardEntry).filter_by(board=board, metric=metric)
+                .order_by(LeaderboardEntry.streak, LeaderboardEntry.user_id.desc())
+                .limit(1)
+            ).scalar_one()
+            db.session.delete(last)
+        db.session.add(LeaderboardEntry(board=key[0], metric=key[1], user_id=user_id, streak=value, expires_on=expires_on))
+
+def compute_top(first_user_id, last_user_id, size, today=None):
+    """Computes the top `size` entries of every board for a range of user ids from the full completion history.
+
+    Returns {(board, metric): [(streak, user_id, expires_on), ...]}.
+    """
+    habits = {
+        habit_id: (user_id, frequency)
+        for habit_id, user_id, frequency in db.session.execute(
+            db.select(Habit.id, Habit.user_id, Habit.frequency).filter(Habit.user_id.between(first_user_id, last_user_id))
+        )
+    }
+    days = completed_days_query(Habit.user_id.between(first_user_id, last_user_id)).subquery('completed_days')
+    query = db.select(days.c.habit_id, days.c.completed_on).order_by(days.c.habit_id, days.c.completed_on)
+
+    bests = {}
+    for habit_id, rows in groupby(db.session.execute(query.execution_options(yield_per=10000)), key=lambda row: row.habit_id):
+        user_id, frequency = habits[habit_id]
+        streak = HabitStreak(current_length=0, longest_length=0)  # transient, only used to run extend_streak
+        for row in rows:
+            extend_streak(streak, row.completed_on, frequency)
+        pairs = habit_bests(frequency, streak.longest_length, streak.current_length, streak.last_completed_on, today)
+        for board in (GLOBAL_BOARD, frequency):
+            for metric, pair in zip(METRICS, pairs):
+                user_best = bests.setdefault((board, metric), {})
+                user_best[user_id] = better(user_best.get(user_id), pair)
+
+    return {
+        key: heapq.nlargest(size, ((value, user_id, expires_on) for user_id, (value, expires_on) in user_best.items() if value),
+                            key=lambda entry: ranking(entry[0], entry[1]))
+        for key, user_best in bests.items()
+    }
+
+def leaderboard_worker(first_user_id, last_user_id, size):
+    """Runs compute_top in a worker process with its own database connections."""
+    from app import app
+
+    with app.app_context():
+        db.engine.dispose(close=False)  # never reuse connections inherited from the parent
+        return compute_top(first_user_id, last_user_id, size)
+
+def rebuild_leaderboard(size, workers=1):
+    """Replaces every board with the top `size` entries computed from the completions.
+
+    The user id range is split across `workers` processes, each returning its own
+    top entries; merging those yields the global top. Returns the number of entries written.
+    """
+    first, last = db.session.execute(db.select(func.min(User.id), func.max(User.id))).one()
+    tops = []
+    if first is not None:
+        workers = max(1, min(workers, last - first + 1))
+        step = (last - first + workers) // workers
+        ranges = [(start, min(start + step - 1, last)) for start in range(first, last + 1, step)]
+        if workers == 1:
+            tops = [compute_top(first, last, size)]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+
+            db.engine.dispose()
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                tops = list(executor.map(leaderboard_worker, *zip(*ranges), [size] * len(ranges)))
+
+    merged = {}
+    for top in tops:
+        for key, entries in top.items():
+            merged.setdefault(key, []).extend(entries)
+
+    db.session.execute(db.delete(LeaderboardEntry))
+    rows = [
+        {'board': board, 'metric': metric, 'user_id': user_id, 'streak': value, 'expires_on': expires_on}
+        for (board, metric), entries in merged.items()
+        for value, user_id, expires_on in heapq.nlargest(size, entries, key=lambda entry: ranking(entry[0], entry[1]))
+    ]
+    if rows:
+        db.session.execute(db.insert(LeaderboardEntry), rows)
+    return len(rows)
+
+def leaderboard_query(board, metric):
+    """Builds a select of one board's entries with their rank and username, ordered by rank.
+
+    Boards hold at most LEADERBOARD_SIZE entries, so reading a page costs the
+    same however many users there are. Current streaks that lapsed since they
+    were written are left out.
+    """
+    ranked = (
+        db.select(
+            func.rank().over(order_by=LeaderboardEntry.streak.desc()).label('rank'),
+            LeaderboardEntry.user_id,
+            User.username,
+            LeaderboardEntry.streak,
+        )
+        .join(User, User.id == LeaderboardEntry.user_id)
+        .filter(LeaderboardEntry.board == board, LeaderboardEntry.metric == metric)
+        .filter(or_(LeaderboardEntry.expires_on.is_(None), LeaderboardEntry.expires_on > datetime.date.today()))
+        .subquery('ranked')
+    )
+    return db.select(ranked).order_by(ranked.c.rank, ranked.c.user_id), ranked
+
+@click.command('rebuild-leaderboard')
+@click.option('--workers', default=1, show_default=True, help='Worker processes, each ranking a share of the users.')
+@with_appcontext
+def rebuild_leaderboard_command(workers):
+    """Recomputes the streak leaderboards from the completion history."""
+    started = time.perf_counter()
+    count = rebuild_leaderboard(current_app.config['LEADERBOARD_SIZE'], workers)
+    db.session.commit()
+    click.echo(f'Wrote {count} leaderboard entries in {time.perf_counter() - started:.2f}s.')
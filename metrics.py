@@ -0,0 +1,120 @@
+from auth import hash_pool
+import caching
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import bisect
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+class Histogram:
+    """A thread-safe Prometheus-style histogram with one series per label set."""
+
+    def __init__(self, name, help_text, buckets, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label_names = label_names
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            counts, total = self._series.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._series[labels] = (counts, total + value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted(self._series.items())
+        for labels, (counts, total) in series:
+            label_text = ','.join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {cumulative}')
+        return lines
+
+request_seconds = Histogram('habit_request_duration_seconds', 'Wall time spent serving a request.', LATENCY_BUCKETS, ('route', 'method'))
+sql_seconds = Histogram('habit_request_sql_seconds', 'Time spent in SQL statements per request.', LATENCY_BUCKETS, ('route', 'method'))
+sql_statements = Histogram('habit_request_sql_statements', 'SQL statements executed per request.', STATEMENT_BUCKETS, ('route', 'method'))
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_count' in g:
+        g.sql_started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_started' in g:
+        elapsed = time.perf_counter() - g.pop('sql_started')
+        g.sql_count += 1
+        g.sql_seconds += elapsed
+        if g.sql_log is not None:
+            g.sql_log.append((elapsed, statement))
+
+def start_request_timer():
+    g.slow_request_seconds = current_app.config['SLOW_REQUEST_MS'] / 1000
+    g.request_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_seconds = 0.0
+    g.sql_log = [] if g.slow_request_seconds else None
+
+def record_request(response):
+    """Adds a Server-Timing header and records the request in the histograms."""
+    if 'request_started' not in g:
+        return response
+
+    elapsed = time.perf_counter() - g.request_started
+    labels = (request.url_rule.rule if request.url_rule else 'unmatched', request.method)
+    request_seconds.observe(labels, elapsed)
+    sql_seconds.observe(labels, g.sql_seconds)
+    sql_statements.observe(labels, g.sql_count)
+
+    response.headers['Server-Timing'] = (
+        f'app;dur={elapsed * 1000:.1f}, db;dur={g.sql_seconds * 1000:.1f};desc="{g.sql_count} queries"'
+    )
+
+    if g.slow_request_seconds and elapsed >= g.slow_request_seconds:
+        queries = '\n'.join(f'  {seconds * 1000:.1f}ms {statement}' for seconds, statement in g.sql_log)
+        logger.warning('Slow request %s %s took %.1fms with %d queries:\n%s',
+                       request.method, request.full_path, elapsed * 1000, g.sql_count, queries)
+    return response
+
+def init_app(app):
+    """Hooks request timing and SQL instrumentation into the app."""
+    app.before_request(start_request_timer)
+    app.after_request(record_request)
+
+def format_metric(name, kind, help_text, value):
+    """Formats one metric sample in the Prometheus text exposition format."""
+    return [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+
+def render_metrics():
+    """Renders the application metrics in the Prometheus text exposition format."""
+    stats = hash_pool.stats()
+    lines = []
+    for histogram in (request_seconds, sql_seconds, sql_statements):
+        lines += histogram.render()
+    lines += format_metric('habit_hash_pool_workers', 'gauge', 'Threads available for password hashing.', stats['workers'])
+    lines += format_metric('habit_hash_pool_pending', 'gauge', 'Password hashing jobs queued or running.', stats['pending'])
+    lines += format_metric('habit_hash_pool_completed_total', 'counter', 'Password hashing jobs finished.', stats['completed'])
+    lines += format_metric('habit_hash_pool_rejected_total', 'counter', 'Password hashing jobs refused because the pool was full.', stats['rejected'])
+    lines += format_metric('habit_hash_pool_seconds_total', 'counter', 'Time spent waiting for and running password hashing jobs.', stats['total_seconds'])
+    lines += format_metric('habit_hash_pool_max_seconds', 'gauge', 'Slowest password hashing job so far.', stats['max_seconds'])
+    cache = caching.response_cache.stats()
+    lines += format_metric('habit_response_cache_hits_total', 'counter', 'Read requests served from the response cache.', cache['hits'])
+    lines += format_metric('habit_response_cache_misses_total', 'counter', 'Read requests the response cache could not serve.', cache['misses'])
+    lines += format_metric('habit_response_cache_evictions_total', 'counter', 'Responses evicted to stay within the size limit.', cache['evictions'])
+    lines += format_metric('habit_response_cache_entries', 'gauge', 'Responses held in the cache.', cache['entries'])
+    lines += format_metric('habit_response_cache_bytes', 'gauge', 'Size of the cached response bodies.', cache['bytes'])
+    return '\n'.join(lines) + '\n'
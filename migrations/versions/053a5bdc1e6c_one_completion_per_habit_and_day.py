@@ -0,0 +1,30 @@
+"""One completion per habit and day: drop duplicates, then add the unique index
+
+Revision ID: 053a5bdc1e6c
+Revises: a6d3408648fd
+Create Date: 2026-10-18 09:01:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '053a5bdc1e6c'
+down_revision = 'a6d3408648fd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the latest row per habit and day, as `flask dedupe-completions` does
+    completion = sa.table('habit_completion', sa.column('id'), sa.column('habit_id'), sa.column('completed_on'))
+    latest = sa.select(sa.func.max(completion.c.id)).group_by(completion.c.habit_id, completion.c.completed_on)
+    op.execute(completion.delete().where(completion.c.id.not_in(latest)))
+    with op.batch_alter_table('habit_completion', schema=None) as batch_op:
+        batch_op.create_index('ix_habit_completion_habit_id_completed_on', ['habit_id', 'completed_on'], unique=True, postgresql_include=['completed'])
+
+
+def downgrade():
+    with op.batch_alter_table('habit_completion', schema=None) as batch_op:
+        batch_op.drop_index('ix_habit_completion_habit_id_completed_on')
@@ -0,0 +1,38 @@
+"""Add the top-N streak leaderboards
+
+Revision ID: 55367f5e3946
+Revises: e3cb07ed49d9
+Create Date: 2026-10-18 09:08:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '55367f5e3946'
+down_revision = 'e3cb07ed49d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by `flask rebuild-leaderboard`, which needs the streak state
+    op.create_table('leaderboard_entry',
+    sa.Column('board', sa.String(length=20), nullable=False),
+    sa.Column('metric', sa.String(length=10), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('streak', sa.Integer(), nullable=False),
+    sa.Column('expires_on', sa.Date(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('board', 'metric', 'user_id')
+    )
+    with op.batch_alter_table('leaderboard_entry', schema=None) as batch_op:
+        batch_op.create_index('ix_leaderboard_entry_board_metric_streak', ['board', 'metric', 'streak'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('leaderboard_entry', schema=None) as batch_op:
+        batch_op.drop_index('ix_leaderboard_entry_board_metric_streak')
+
+    op.drop_table('leaderboard_entry')
@@ -0,0 +1,60 @@
+"""Add the change log for delta sync and the users' sync floors
+
+Revision ID: 6f7c8390f0f1
+Revises: 78a61206bd9c
+Create Date: 2026-10-18 09:04:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f7c8390f0f1'
+down_revision = '78a61206bd9c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_log',
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('entity', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('op', sa.String(length=20), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('seq'),
+    sqlite_autoincrement=True
+    )
+    with op.batch_alter_table('change_log', schema=None) as batch_op:
+        batch_op.create_index('ix_change_log_user_id_seq', ['user_id', 'seq'], unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sync_floor', sa.Integer(), server_default='0', nullable=False))
+
+    # Existing data has no log entries, so start every log at a floor, as
+    # changelog.start_logs_compacted does for seeded users: syncing from 0
+    # answers 410 and clients fetch everything once
+    user = sa.table('user', sa.column('id'), sa.column('sync_floor'))
+    change_log = sa.table('change_log', sa.column('seq'), sa.column('user_id'), sa.column('entity'),
+                          sa.column('entity_id'), sa.column('op'), sa.column('created_at'))
+    op.execute(change_log.insert().from_select(
+        ['user_id', 'entity', 'entity_id', 'op', 'created_at'],
+        sa.select(user.c.id, sa.literal('user'), user.c.id, sa.literal('load'), sa.func.current_timestamp()),
+    ))
+    op.execute(user.update().values(sync_floor=sa.select(sa.func.max(change_log.c.seq))
+                                    .where(change_log.c.user_id == user.c.id).scalar_subquery()))
+    op.execute(change_log.delete().where(change_log.c.entity == 'user'))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('sync_floor')
+
+    with op.batch_alter_table('change_log', schema=None) as batch_op:
+        batch_op.drop_index('ix_change_log_user_id_seq')
+
+    op.drop_table('change_log')
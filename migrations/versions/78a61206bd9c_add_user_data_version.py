@@ -0,0 +1,26 @@
+"""Add the per-user data version behind ETags and the response cache
+
+Revision ID: 78a61206bd9c
+Revises: 94e7c367d5cf
+Create Date: 2026-10-18 09:03:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '78a61206bd9c'
+down_revision = '94e7c367d5cf'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('data_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('data_version')
@@ -0,0 +1,33 @@
+"""Add the stored streak state of habits
+
+Revision ID: 8c738e6600f8
+Revises: 6f7c8390f0f1
+Create Date: 2026-10-18 09:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c738e6600f8'
+down_revision = '6f7c8390f0f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by `flask rebuild-streaks`
+    op.create_table('habit_streak',
+    sa.Column('habit_id', sa.Integer(), nullable=False),
+    sa.Column('current_start', sa.Date(), nullable=True),
+    sa.Column('current_length', sa.Integer(), nullable=False),
+    sa.Column('longest_length', sa.Integer(), nullable=False),
+    sa.Column('last_completed_on', sa.Date(), nullable=True),
+    sa.ForeignKeyConstraint(['habit_id'], ['habit.id'], ),
+    sa.PrimaryKeyConstraint('habit_id')
+    )
+
+
+def downgrade():
+    op.drop_table('habit_streak')
@@ -0,0 +1,26 @@
+"""Index habits by user and frequency
+
+Revision ID: 94e7c367d5cf
+Revises: 053a5bdc1e6c
+Create Date: 2026-10-18 09:02:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '94e7c367d5cf'
+down_revision = '053a5bdc1e6c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('habit', schema=None) as batch_op:
+        batch_op.create_index('ix_habit_user_id_frequency', ['user_id', 'frequency'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('habit', schema=None) as batch_op:
+        batch_op.drop_index('ix_habit_user_id_frequency')
@@ -0,0 +1,33 @@
+"""Add the monthly rollups that old completions are archived into
+
+Revision ID: e3cb07ed49d9
+Revises: e60535027b93
+Create Date: 2026-10-18 09:07:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3cb07ed49d9'
+down_revision = 'e60535027b93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('completion_rollup',
+    sa.Column('habit_id', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('completed_days', sa.Integer(), nullable=False),
+    sa.Column('missed_days', sa.Integer(), nullable=False),
+    sa.Column('completed_count', sa.Integer(), nullable=False),
+    sa.Column('missed_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['habit_id'], ['habit.id'], ),
+    sa.PrimaryKeyConstraint('habit_id', 'month')
+    )
+
+
+def downgrade():
+    op.drop_table('completion_rollup')
@@ -0,0 +1,31 @@
+"""Add the yearly completion bitmaps
+
+Revision ID: e60535027b93
+Revises: 8c738e6600f8
+Create Date: 2026-10-18 09:06:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e60535027b93'
+down_revision = '8c738e6600f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by `flask build-bitmaps`, and only kept up to date with COMPLETION_BITMAPS=1
+    op.create_table('habit_bitmap',
+    sa.Column('habit_id', sa.Integer(), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('bits', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['habit_id'], ['habit.id'], ),
+    sa.PrimaryKeyConstraint('habit_id', 'year')
+    )
+
+
+def downgrade():
+    op.drop_table('habit_bitmap')
@@ -7,6 +7,8 @@ class User(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(128), nullable=False)
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    sync_floor = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # last change log seq removed by compaction
     habits = db.relationship('Habit', backref='user', lazy=True)
 
     def __repr__(self):
@@ -21,6 +23,11 @@ class Habit(db.Model):
     creation_date = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     completions = db.relationship('HabitCompletion', backref='habit', lazy=True)
+    streak = db.relationship('HabitStreak', backref='habit', uselist=False, cascade='all, delete-orphan')
+    bitmaps = db.relationship('HabitBitmap', backref='habit', lazy=True, cascade='all, delete-orphan')
+    rollups = db.relationship('CompletionRollup', backref='habit', lazy=True, cascade='all, delete-orphan')
+
+    __table_args__ = (db.Index('ix_habit_user_id_frequency', 'user_id', 'frequency'),)
 
     def __repr__(self):
         return f'<Habit {self.name}>'
@@ -32,5 +39,72 @@ class HabitCompletion(db.Model):
     completed_on = db.Column(db.Date, nullable=False)
     completed = db.Column(db.Boolean, nullable=False)
 
+    # One row per habit and day; on PostgreSQL the index also covers `completed` so streak scans are index-only
+    __table_args__ = (
+        db.Index('ix_habit_completion_habit_id_completed_on', 'habit_id', 'completed_on', unique=True, postgresql_include=['completed']),
+    )
+
+    def __repr__(self):
+        return f'<HabitCompletion {self.habit_id} - {self.completed_on}>'
+
+class HabitStreak(db.Model):
+    """Holds the incrementally maintained streak state of a habit."""
+    habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'), primary_key=True)
+    current_start = db.Column(db.Date)
+    current_length = db.Column(db.Integer, nullable=False, default=0)
+    longest_length = db.Column(db.Integer, nullable=False, default=0)
+    last_completed_on = db.Column(db.Date)
+
+    def __repr__(self):
+        return f'<HabitStreak {self.habit_id} - {self.current_length}/{self.longest_length}>'
+
+class HabitBitmap(db.Model):
+    """Stores one year of a habit's completions as packed bits (per day, or per ISO week for Weekly habits)."""
+    habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    bits = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f'<HabitBitmap {self.habit_id} - {self.year}>'
+
+class CompletionRollup(db.Model):
+    """Holds one archived month of a habit's completions as day bits (bit 0 is the 1st)."""
+    habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)  # first day of the month
+    completed_days = db.Column(db.Integer, nullable=False, default=0)
+    missed_days = db.Column(db.Integer, nullable=False, default=0)  # days recorded as not completed
+    completed_count = db.Column(db.Integer, nullable=False, default=0)
+    missed_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CompletionRollup {self.habit_id} - {self.month}>'
+
+class LeaderboardEntry(db.Model):
+    """Holds a user's best streak on one of the top-N leaderboards."""
+    board = db.Column(db.String(20), primary_key=True)  # 'all' or a habit frequency
+    metric = db.Column(db.String(10), primary_key=True)  # 'longest' or 'current'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    streak = db.Column(db.Integer, nullable=False)
+    expires_on = db.Column(db.Date)  # first day a current streak has lapsed; None for longest streaks
+
+    __table_args__ = (db.Index('ix_leaderboard_entry_board_metric_streak', 'board', 'metric', 'streak'),)
+
+    def __repr__(self):
+        return f'<LeaderboardEntry {self.board}/{self.metric} {self.user_id} - {self.streak}>'
+
+class ChangeLog(db.Model):
+    """Records every habit and completion mutation of a user in one increasing sequence, for delta sync."""
+    seq = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    entity = db.Column(db.String(20), nullable=False)  # 'habit' or 'completion' ('user' only briefly, see changelog.start_logs_compacted)
+    entity_id = db.Column(db.Integer, nullable=False)  # the habit id, also for completions
+    op = db.Column(db.String(20), nullable=False)  # 'create', 'upsert' or 'delete'
+    payload = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    # AUTOINCREMENT keeps SQLite from reusing the seq of compacted rows. Seqs are only commit-ordered
+    # per user because writers take the user's row lock first (see caching.bump_data_version)
+    __table_args__ = (db.Index('ix_change_log_user_id_seq', 'user_id', 'seq'), {'sqlite_autoincrement': True})
+
     def __repr__(self):
-        return f'<HabitCompletion {self.habit_id} - {self.completed_on}>'
\ No newline at end of file
+        return f'<ChangeLog {self.seq} {self.entity} {self.op}>'
@@ -0,0 +1,147 @@
+from extensions import db
+from models import CompletionRollup, Habit, HabitCompletion
+from caching import bump_data_versions
+from flask import current_app
+from flask.cli import with_appcontext
+from itertools import groupby
+import click
+import datetime
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def fold_day(rollup, day, completed):
+    """Sets a day of a monthly rollup to completed or missed, replacing what it held before."""
+    bit = 1 << (day - 1)
+    if completed:
+        rollup.completed_days |= bit
+        rollup.missed_days &= ~bit
+    else:
+        rollup.missed_days |= bit
+        rollup.completed_days &= ~bit
+    rollup.completed_count = rollup.completed_days.bit_count()
+    rollup.missed_count = rollup.missed_days.bit_count()
+
+def archive_completions(before, chunk_habits=500):
+    """Moves the completion rows of whole months before `before` into monthly rollups.
+
+    Rows are deleted and folded into the rollups in the same transaction, one
+    chunk of habits at a time. Rows recorded for an archived month later on
+    (backfills) are merged into its rollup by the next run, replacing the day's
+    bit. The owners' data versions are bumped, so no ETag or cached response
+    outlives the rewrite. Returns (rows archived, rollups written).
+    """
+    cutoff = before.replace(day=1)
+    archived = written = 0
+    last_habit_id = 0
+    while True:
+        habit_ids = db.session.execute(
+            db.select(HabitCompletion.habit_id)
+            .filter(HabitCompletion.completed_on < cutoff, HabitCompletion.habit_id > last_habit_id)
+            .group_by(HabitCompletion.habit_id)
+            .order_by(HabitCompletion.habit_id)
+            .limit(chunk_habits)
+        ).scalars().all()
+        if not habit_ids:
+            return archived, written
+        last_habit_id = habit_ids[-1]
+
+        # DELETE ... RETURNING folds exactly the rows it removed, even if one was rewritten meanwhile
+        rows = db.session.execute(
+            db.delete(HabitCompletion)
+            .where(HabitCompletion.habit_id.in_(habit_ids), HabitCompletion.completed_on < cutoff)
+            .returning(HabitCompletion.habit_id, HabitCompletion.completed_on, HabitCompletion.completed)
+        ).all()
+        months = {row.completed_on.replace(day=1) for row in rows}
+        rollups = {
+            (rollup.habit_id, rollup.month): rollup
+            for rollup in db.session.execute(
+                db.select(CompletionRollup).filter(CompletionRollup.habit_id.in_(habit_ids), CompletionRollup.month.in_(months))
+            ).scalars()
+        }
+        for (habit_id, month), month_rows in groupby(sorted(rows), key=lambda row: (row.habit_id, row.completed_on.replace(day=1))):
+            rollup = rollups.get((habit_id, month))
+            if rollup is None:
+                rollup = CompletionRollup(habit_id=habit_id, month=month, completed_days=0, missed_days=0)
+                db.session.add(rollup)
+            for row in month_rows:
+                fold_day(rollup, row.completed_on.day, row.completed)
+            written += 1
+        archived += len(rows)
+        bump_data_versions(db.session.execute(
+            db.select(Habit.user_id).filter(Habit.id.in_(habit_ids)).distinct()
+        ).scalars().all())
+        db.session.commit()
+
+def run_archive(days):
+    """Archives the months that ended more than `days` days ago and logs the outcome."""
+    started = time.perf_counter()
+    archived, written = archive_completions(datetime.date.today() - datetime.timedelta(days=days))
+    logger.info('Archived %d completion rows into %d monthly rollups in %.1fs', archived, written, time.perf_counter() - started)
+    return archived, written
+
+class RollupScheduler:
+    """Runs the archiver every `interval` seconds on a daemon thread of this process."""
+
+    def __init__(self):
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self, app, days, interval):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(app, days, interval), name='rollups', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, app, days, interval):
+        while not self._stop.is_set():
+            with app.app_context():
+                try:
+                    run_archive(days)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Archiving completions failed')
+                finally:
+                    db.session.remove()
+            self._stop.wait(interval)
+
+rollup_scheduler = RollupScheduler()
+
+def init_app(app):
+    """Starts the in-process archiver when ARCHIVE_AFTER_DAYS and ROLLUP_INTERVAL_SECONDS are both set.
+
+    Only the development server calls this. create_app never does, so CLI
+    commands, the preloading Gunicorn master and its workers never archive;
+    production runs `flask archive-completions --every` as a single worker.
+    """
+    if app.config['ARCHIVE_AFTER_DAYS'] and app.config['ROLLUP_INTERVAL_SECONDS']:
+        rollup_scheduler.start(app, app.config['ARCHIVE_AFTER_DAYS'], app.config['ROLLUP_INTERVAL_SECONDS'])
+
+@click.command('archive-completions')
+@click.option('--days', type=int, help='Archive the months that ended more than this many days ago, at least ARCHIVE_AFTER_DAYS [default: ARCHIVE_AFTER_DAYS].')
+@click.option('--every', type=int, help='Keep running as a worker, archiving every this many seconds.')
+@with_appcontext
+def archive_completions_command(days, every):
+    """Folds old completion rows into monthly rollups and deletes them."""
+    # Reads only look for rollups before the ARCHIVE_AFTER_DAYS cutoff (see utils.archive_cutoff)
+    if not current_app.config['ARCHIVE_AFTER_DAYS']:
+        raise click.UsageError('Set ARCHIVE_AFTER_DAYS to enable archiving.')
+    days = current_app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    if days < current_app.config['ARCHIVE_AFTER_DAYS']:
+        raise click.UsageError('--days cannot be less than ARCHIVE_AFTER_DAYS.')
+    while True:
+        archived, written = run_archive(days)
+        click.echo(f'Archived {archived} completion row(s) into {written} monthly rollup(s).')
+        if not every:
+            return
+        db.session.remove()
+        time.sleep(every)
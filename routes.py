@@ -1,12 +1,33 @@
-from flask import jsonify, request
-from app import app, bcrypt, jwt
+from flask import Blueprint, Response, current_app, g, jsonify, request, stream_with_context
 from extensions import db
 from models import User, Habit, HabitCompletion
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from streaks import apply_completion, apply_completions, retract_completions, rebuild_streak, note_streak_change, get_user_longest_streak, get_habit_streak
+from utils import user_completions_query, upsert_completions, recorded_keys, paginate, parse_fields, serialize_rows, HABIT_FIELDS, COMPLETION_FIELDS
+from auth import current_user_id, identity_cache, identity_claims, hash_password, check_password, reject_stale_token, token_username, HashPoolSaturated
+from metrics import render_metrics
+from caching import bump_data_version, cached, conditional, get_data_version
+from changelog import record_habit_change, record_completion_changes, get_changes, get_latest_seq
+from flask_jwt_extended import create_access_token, jwt_required
+from collections import Counter
 import datetime
-from sqlalchemy import func
+import json
+from urllib.parse import urlencode
 
-@app.route('/register', methods=['POST'])
+api = Blueprint('api', __name__)
+
+@api.app_errorhandler(HashPoolSaturated)
+def handle_hash_pool_saturated(error):
+    """Sheds password requests when the hashing pool is full instead of stalling the worker."""
+    response = jsonify({'message': 'Server is busy, please retry shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    """Exposes application metrics for Prometheus"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
     username = data.get('username')
@@ -22,17 +43,18 @@ def register():
     if User.query.filter_by(email=email).first():
         return jsonify({"msg": "Email already exists"}), 400
 
-    password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+    password_hash = hash_password(password)
 
     # Ensure you are using the correct column name from your User model
     new_user = User(username=username, email=email, password=password_hash)
     db.session.add(new_user)
     db.session.commit()
+    identity_cache.set(username, new_user.id)
 
-    access_token = create_access_token(identity=username)
+    access_token = create_access_token(identity=username, additional_claims=identity_claims(new_user))
     return jsonify(access_token=access_token), 201
 
-@app.route('/login', methods=['POST'])
+@api.route('/login', methods=['POST'])
 def login():
     """Logs in a user and returns a JWT token."""
     data = request.get_json()
@@ -41,13 +63,14 @@ def login():
 
     user = User.query.filter_by(username=username).first()
 
-    if user and bcrypt.check_password_hash(user.password, password):
-        access_token = create_access_token(identity=username)
+    if user and check_password(user.password, password):
+        identity_cache.set(username, user.id)
+        access_token = create_access_token(identity=username, additional_claims=identity_claims(user))
         return jsonify({'access_token': access_token}), 200
     else:
         return jsonify({'message': 'Invalid username or password'}), 401
 
-@app.route('/habits', methods=['POST'])
+@api.route('/habits', methods=['POST'])
 @jwt_required()
 def create_habit():
     """Creates a new habit."""
@@ -55,47 +78,67 @@ def create_habit():
     name = data.get('name')
     description = data.get('description')
     frequency = data.get('frequency')
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
+    user_id = current_user_id()
 
     if not name or not frequency:
         return jsonify({'message': 'Name and frequency are required'}), 400
 
-    new_habit = Habit(name=name, description=description, frequency=frequency, user_id=user.id)
+    new_habit = Habit(name=name, description=description, frequency=frequency, user_id=user_id)
     db.session.add(new_habit)
+    db.session.flush()
+    bump_data_version(user_id)
+    record_habit_change(user_id, new_habit, op='create')
     db.session.commit()
 
     return jsonify({'message': 'Habit created successfully', 'id': new_habit.id}), 201
 
-@app.route('/habits', methods=['GET'])
+def list_response(query, allowed_fields, default_fields, key_columns):
+    """Serves a listing with optional fields=, limit= and cursor= parameters.
+
+    Only the requested fields are selected. With a limit (or a cursor) the rows
+    are paged by key_columns and the next page is linked from the headers.
+    """
+    try:
+        fields = parse_fields(request.args.get('fields'), allowed_fields, default_fields)
+        limit = request.args.get('limit', type=int)
+        if 'limit' in request.args and (limit is None or limit < 1):
+            raise ValueError('limit must be a positive integer')
+        if limit is not None or 'cursor' in request.args:
+            limit = min(limit or current_app.config['MAX_PAGE_SIZE'], current_app.config['MAX_PAGE_SIZE'])
+        rows, next_cursor = paginate(query, {field: allowed_fields[field] for field in fields}, key_columns, limit, request.args.get('cursor'))
+    except ValueError as error:
+        return jsonify({'message': str(error)}), 400
+
+    response = jsonify(serialize_rows(rows, fields))
+    if next_cursor:
+        args = request.args.to_dict(flat=False)
+        args['cursor'] = [next_cursor]
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(args, doseq=True)}>; rel="next"'
+    return response, 200
+
+@api.route('/habits', methods=['GET'])
 @jwt_required()
+@conditional
+@cached
 def get_habits():
     """Displays all habits."""
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
-    habits = Habit.query.filter_by(user_id=user.id).all()
-    habit_list = []
-    for habit in habits:
-        habit_list.append({
-            'id': habit.id,
-            'name': habit.name,
-            'description': habit.description,
-            'frequency': habit.frequency,
-            'creation_date': habit.creation_date.isoformat()
-        })
-    return jsonify(habit_list), 200
-
-@app.route('/habits/<int:habit_id>', methods=['PUT'])
+    user_id = current_user_id()
+    query = db.select(Habit.id).filter(Habit.user_id == user_id).order_by(Habit.id)
+    return list_response(query, HABIT_FIELDS, HABIT_FIELDS, [Habit.id])
+
+@api.route('/habits/<int:habit_id>', methods=['PUT'])
 @jwt_required()
 def update_habit(habit_id):
     """Displays habit by the ID"""
+    from leaderboard import update_leaderboard
+
     data = request.get_json()
     name = data.get('name')
     description = data.get('description')
     frequency = data.get('frequency')
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
-    habit = Habit.query.filter_by(id=habit_id, user_id=user.id).first()
+    user_id = current_user_id()
+    habit = Habit.query.filter_by(id=habit_id, user_id=user_id).first()
 
     if not habit:
         return jsonify({'message': 'Habit not found'}), 404
@@ -104,34 +147,51 @@ def update_habit(habit_id):
         habit.name = name
     if description:
         habit.description = description
-    if frequency:
+    if frequency and frequency != habit.frequency:
         habit.frequency = frequency
-
+        rebuild_streak(habit.id, habit.frequency)
+        if current_app.config['COMPLETION_BITMAPS']:
+            from bitmaps import rebuild_bitmaps
+            rebuild_bitmaps(habit.id, habit.frequency)
+        note_streak_change(habit.id)  # the streak moves to another frequency's board
+        update_leaderboard(user_id)
+
+    bump_data_version(user_id)
+    record_habit_change(user_id, habit)
     db.session.commit()
     return jsonify({'message': 'Habit updated successfully'}), 200
 
-@app.route('/habits/<int:habit_id>', methods=['DELETE'])
+@api.route('/habits/<int:habit_id>', methods=['DELETE'])
 @jwt_required()
 def delete_habit(habit_id):
     """Deletes habit"""
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
-    habit = Habit.query.filter_by(id=habit_id, user_id=user.id).first()
+    from leaderboard import update_leaderboard
+
+    user_id = current_user_id()
+    habit = Habit.query.filter_by(id=habit_id, user_id=user_id).first()
 
     if not habit:
         return jsonify({'message': 'Habit not found'}), 404
 
+    # Clients drop a deleted habit's completions along with its tombstone
+    db.session.execute(db.delete(HabitCompletion).where(HabitCompletion.habit_id == habit.id))
     db.session.delete(habit)
+    bump_data_version(user_id)
+    record_habit_change(user_id, habit, op='delete')
+    note_streak_change(habit.id)
+    update_leaderboard(user_id)
     db.session.commit()
     return jsonify({'message': 'Habit deleted successfully'}), 200
 
-@app.route('/habits/<int:habit_id>/completions', methods=['POST'])
+@api.route('/habits/<int:habit_id>/completions', methods=['POST'])
 @jwt_required()
 def record_completion(habit_id):
     """Marks habit as completed"""
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
-    habit = Habit.query.filter_by(id=habit_id, user_id=user.id).first()
+    from bitmaps import sync_bitmaps, resync_bitmaps
+    from leaderboard import update_leaderboard
+
+    user_id = current_user_id()
+    habit = Habit.query.filter_by(id=habit_id, user_id=user_id).first()
 
     if not habit:
         return jsonify({'message': 'Habit not found'}), 404
@@ -148,156 +208,403 @@ def record_completion(habit_id):
     except ValueError:
         return jsonify({'message': 'Invalid date format. Use YYYY-MM-DD'}), 400
 
-    new_completion = HabitCompletion(habit_id=habit_id, completed_on=completed_on_date, completed=completed)
-    db.session.add(new_completion)
+    # Recording the same day again updates the existing row, so retries never add rows
+    rows = [{'habit_id': habit_id, 'completed_on': completed_on_date, 'completed': completed}]
+    bump_data_version(user_id)
+    upsert_completions(rows)
+    record_completion_changes(user_id, rows)
+    if completed:
+        apply_completion(habit, completed_on_date, completed)
+        sync_bitmaps(habit.id, habit.frequency, [completed_on_date])
+    elif retract_completions(habit.id, habit.frequency, [completed_on_date]):
+        resync_bitmaps(habit.id, habit.frequency)
+    update_leaderboard(user_id)
     db.session.commit()
 
     return jsonify({'message': 'Completion recorded successfully'}), 201
 
-@app.route('/habits/completions', methods=['GET'])
+def parse_completion_record(record):
+    """Validates one batch record and returns (habit_id, completed_on_date, completed)."""
+    if not isinstance(record, dict):
+        raise ValueError('Record must be an object')
+
+    habit_id = record.get('habit_id')
+    completed_on = record.get('completed_on')
+    completed = record.get('completed')
+
+    if not isinstance(habit_id, int) or isinstance(habit_id, bool):
+        raise ValueError('habit_id must be an integer')
+    if not completed_on or completed is None:
+        raise ValueError('Completed date and status are required')
+    if not isinstance(completed, bool):
+        raise ValueError('completed must be a boolean')
+
+    try:
+        completed_on_date = datetime.datetime.strptime(completed_on, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise ValueError('Invalid date format. Use YYYY-MM-DD')
+
+    return habit_id, completed_on_date, completed
+
+def parse_date_arg(name):
+    """Parses an optional YYYY-MM-DD query parameter."""
+    value = request.args.get(name)
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+def parse_int_arg(name, default=None):
+    """Parses an optional integer query parameter, raising ValueError when it is malformed."""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer') from None
+
+def read_batch_records():
+    """Reads the batch payload as a JSON array or as NDJSON, one record per line."""
+    if request.mimetype == 'application/x-ndjson':
+        records = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append(None)
+        return records
+
+    records = request.get_json(silent=True)
+    return records if isinstance(records, list) else None
+
+@api.route('/habits/completions/batch', methods=['POST'])
+@jwt_required()
+def record_completions_batch():
+    """Records many completions across habits in a single transaction"""
+    from bitmaps import sync_bitmaps, resync_bitmaps
+    from leaderboard import update_leaderboard
+
+    user_id = current_user_id()
+
+    records = read_batch_records()
+    if records is None:
+        return jsonify({'message': 'Expected a JSON array or NDJSON records'}), 400
+    if len(records) > current_app.config['BATCH_COMPLETIONS_MAX_ROWS']:
+        return jsonify({'message': f"At most {current_app.config['BATCH_COMPLETIONS_MAX_ROWS']} records per batch"}), 413
+
+    results = []
+    parsed = []
+    for index, record in enumerate(records):
+        try:
+            parsed.append((index, *parse_completion_record(record)))
+            results.append({'index': index, 'status': 'recorded'})
+        except ValueError as error:
+            results.append({'index': index, 'status': 'error', 'message': str(error)})
+
+    requested_ids = {habit_id for _, habit_id, _, _ in parsed}
+    owned_habits = {}
+    if requested_ids:
+        owned_habits = dict(db.session.execute(
+            db.select(Habit.id, Habit.frequency).filter(Habit.user_id == user_id, Habit.id.in_(requested_ids))
+        ).all())
+
+    # Later records for the same habit and day win, as they would when sent one by one
+    latest = {}
+    for index, habit_id, completed_on_date, completed in parsed:
+        if habit_id not in owned_habits:
+            results[index] = {'index': index, 'status': 'error', 'message': 'Habit not found'}
+            continue
+        latest[habit_id, completed_on_date] = completed
+
+    # Days recorded before this batch, or by an earlier record of it, are reported as updated
+    existing = recorded_keys(latest)
+    seen = set()
+    for index, habit_id, completed_on_date, _ in parsed:
+        if results[index]['status'] == 'recorded':
+            key = (habit_id, completed_on_date)
+            results[index]['status'] = 'updated' if key in existing or key in seen else 'created'
+            seen.add(key)
+
+    completed_dates = {}
+    missed_dates = {}
+    for (habit_id, completed_on_date), completed in latest.items():
+        (completed_dates if completed else missed_dates).setdefault(habit_id, []).append(completed_on_date)
+
+    if latest:
+        rows = [
+            {'habit_id': habit_id, 'completed_on': completed_on_date, 'completed': completed}
+            for (habit_id, completed_on_date), completed in latest.items()
+        ]
+        bump_data_version(user_id)
+        upsert_completions(rows)
+        record_completion_changes(user_id, rows)
+        for habit_id, frequency in owned_habits.items():
+            if habit_id in missed_dates and retract_completions(habit_id, frequency, missed_dates[habit_id]):
+                resync_bitmaps(habit_id, frequency)
+            elif habit_id in completed_dates:
+                apply_completions(habit_id, frequency, completed_dates[habit_id])
+                sync_bitmaps(habit_id, frequency, completed_dates[habit_id])
+        update_leaderboard(user_id)
+        db.session.commit()
+
+    counts = Counter(result['status'] for result in results)
+    return jsonify({'created': counts['created'], 'updated': counts['updated'], 'failed': counts['error'], 'results': results}), 200
+
+@api.route('/sync', methods=['GET'])
+@jwt_required()
+def sync():
+    """Returns the habit and completion changes after ?since=<seq>, oldest first"""
+    user_id = current_user_id()
+    try:
+        since = parse_int_arg('since', 0)
+        limit = min(parse_int_arg('limit', current_app.config['MAX_PAGE_SIZE']), current_app.config['MAX_PAGE_SIZE'])
+    except ValueError as error:
+        return jsonify({'message': str(error)}), 400
+    if since < 0 or limit < 1:
+        return jsonify({'message': 'since must be >= 0 and limit positive'}), 400
+
+    try:
+        changes, has_more = get_changes(user_id, since, limit, token_username())
+    except KeyError:
+        reject_stale_token()
+    except LookupError:
+        return jsonify({'message': 'Changes since this point were compacted. Refetch all data, then sync from seq.',
+                        'seq': get_latest_seq(user_id)}), 410
+
+    return jsonify({
+        'changes': [
+            {'seq': change.seq, 'entity': change.entity, 'id': change.entity_id, 'op': change.op, 'data': change.payload}
+            for change in changes
+        ],
+        'seq': changes[-1].seq if changes else since,
+        'has_more': has_more,
+    }), 200
+
+@api.route('/events', methods=['GET'])
 @jwt_required()
+def stream_events():
+    """Streams the user's habit, completion and streak changes as server-sent events"""
+    from events import StreamsFull, broker, event_stream
+
+    user_id = current_user_id()
+    g.read_replica = False  # the change log is read right after writes commit on the primary
+    get_data_version(user_id)  # rejects the token of a deleted user before the stream opens
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        since = int(last_event_id) if last_event_id else get_latest_seq(user_id)
+    except ValueError:
+        return jsonify({'message': 'Last-Event-ID must be an integer'}), 400
+
+    try:
+        subscription = broker.subscribe(user_id, current_app.config['EVENTS_MAX_STREAMS'])
+    except StreamsFull:
+        response = jsonify({'message': 'Too many open event streams, please retry shortly'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    stream = event_stream(user_id, subscription, since, current_app.config['EVENTS_HEARTBEAT_SECONDS'],
+                          current_app.config['EVENTS_MAX_STREAM_SECONDS'], current_app.config['MAX_PAGE_SIZE'])
+    response = Response(stream_with_context(stream), mimetype='text/event-stream')
+    response.call_on_close(lambda: broker.unsubscribe(subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # keep proxies from buffering the stream
+    return response
+
+@api.route('/habits/completions', methods=['GET'])
+@jwt_required()
+@conditional
 def get_completions():
     """Shows the completed habits"""
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
-    habits = Habit.query.filter_by(user_id=user.id).all()
-    completions_list = []
-    for habit in habits:
-        completions = HabitCompletion.query.filter_by(habit_id=habit.id).all()
-        for completion in completions:
-            completions_list.append({
-                'habit_id': habit.id,
-                'completed_on': completion.completed_on.isoformat(),
-                'completed': completion.completed
-            })
-    return jsonify(completions_list), 200
-
-@app.route('/habits/analytics/all', methods=['GET'])
+    user_id = current_user_id()
+    try:
+        date_from = parse_date_arg('from')
+        date_to = parse_date_arg('to')
+    except ValueError:
+        return jsonify({'message': 'Invalid date format. Use YYYY-MM-DD'}), 400
+    try:
+        habit_id = parse_int_arg('habit_id')
+    except ValueError as error:
+        return jsonify({'message': str(error)}), 400
+
+    # Archived days are listed too; (habit_id, completed_on) is unique across rows and rollups
+    query = user_completions_query(user_id, habit_id=habit_id, date_from=date_from, date_to=date_to)
+    fields = {name: query.selected_columns[name] for name in COMPLETION_FIELDS}
+    return list_response(query, fields, COMPLETION_FIELDS, [fields['habit_id'], fields['completed_on']])
+
+@api.route('/habits/completions/export', methods=['GET'])
 @jwt_required()
+@conditional
+def export_completions():
+    """Streams the completion history as NDJSON or CSV"""
+    user_id = current_user_id()
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'message': 'Format must be ndjson or csv'}), 400
+
+    try:
+        date_from = parse_date_arg('from')
+        date_to = parse_date_arg('to')
+    except ValueError:
+        return jsonify({'message': 'Invalid date format. Use YYYY-MM-DD'}), 400
+    try:
+        habit_id = parse_int_arg('habit_id')
+    except ValueError as error:
+        return jsonify({'message': str(error)}), 400
+
+    query = user_completions_query(user_id, habit_id=habit_id, date_from=date_from, date_to=date_to)
+
+    def generate():
+        if export_format == 'csv':
+            yield 'habit_id,completed_on,completed\n'
+        # yield_per streams through a server-side cursor where the driver supports one
+        result = db.session.execute(query.execution_options(yield_per=current_app.config['EXPORT_CHUNK_ROWS']))
+        for rows in result.partitions():
+            if export_format == 'csv':
+                yield ''.join(f'{habit_id},{completed_on.isoformat()},{str(completed).lower()}\n' for habit_id, completed_on, completed in rows)
+            else:
+                yield ''.join(
+                    f'{{"habit_id": {habit_id}, "completed_on": "{completed_on.isoformat()}", "completed": {str(completed).lower()}}}\n'
+                    for habit_id, completed_on, completed in rows
+                )
+
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=completions.{export_format}'
+    return response
+
+@api.route('/leaderboard', methods=['GET'])
+@jwt_required()
+def get_leaderboard():
+    """Returns a page of the top streaks across all users, optionally for one habit frequency"""
+    from leaderboard import METRICS, GLOBAL_BOARD, leaderboard_query
+
+    metric = request.args.get('metric', 'longest')
+    if metric not in METRICS:
+        return jsonify({'message': f"Metric must be one of {', '.join(METRICS)}"}), 400
+
+    query, ranked = leaderboard_query(request.args.get('frequency', GLOBAL_BOARD), metric)
+    fields = {'rank': ranked.c.rank, 'username': ranked.c.username, 'streak': ranked.c.streak}
+    return list_response(query, fields, fields, [ranked.c.rank, ranked.c.user_id])
+
+@api.route('/habits/analytics/all', methods=['GET'])
+@jwt_required()
+@conditional
+@cached
 def get_all_habits():
     """Shows all habits"""
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
-    habits = Habit.query.filter_by(user_id=user.id).all()
-    habits_list = [{'id': habit.id, 'name': habit.name, 'description': habit.description, 'frequency': habit.frequency} for habit in habits]
-    return jsonify(habits_list), 200
+    user_id = current_user_id()
+    query = db.select(Habit.id).filter(Habit.user_id == user_id).order_by(Habit.id)
+    return list_response(query, HABIT_FIELDS, ['id', 'name', 'description', 'frequency'], [Habit.id])
 
-@app.route('/habits/analytics/periodicity/<periodicity>', methods=['GET'])
+@api.route('/habits/analytics/periodicity/<periodicity>', methods=['GET'])
 @jwt_required()
+@conditional
+@cached
 def get_habits_by_periodicity(periodicity):
     """Shows habits by periodicity"""
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
-    habits = Habit.query.filter_by(user_id=user.id, frequency=periodicity).all()
+    user_id = current_user_id()
+    habits = Habit.query.filter_by(user_id=user_id, frequency=periodicity).all()
     habits_list = [{'id': habit.id, 'name': habit.name, 'description': habit.description, 'frequency': habit.frequency} for habit in habits]
     return jsonify(habits_list), 200
 
-@app.route('/habits/analytics/longest_streak', methods=['GET'])
+@api.route('/habits/analytics/longest_streak', methods=['GET'])
 @jwt_required()
+@conditional
+@cached
 def get_longest_streak():
-    """Calculates the longest streak"""
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
-    habits = Habit.query.filter_by(user_id=user.id).all()
-    longest_streak = 0
-    for habit in habits:
-        streak = calculate_streak(habit.id)
-        if streak > longest_streak:
-            longest_streak = streak
-    return jsonify({'longest_streak': longest_streak}), 200
-
-@app.route('/habits/analytics/longest_streak/<int:habit_id>', methods=['GET'])
+    """Returns the longest run streak across all defined habits for the user."""
+    user_id = current_user_id()
+    return jsonify({'longest_streak': get_user_longest_streak(user_id)}), 200
+
+@api.route('/habits/analytics/longest_streak/<int:habit_id>', methods=['GET'])
 @jwt_required()
-def get_longest_streak_for_given_habit(habit_id):
-    """Returns the longest run streak for a given habit."""
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
-    habit = Habit.query.filter_by(id=habit_id, user_id=user.id).first()
+@conditional
+@cached
+def get_longest_streak_by_habit(habit_id):
+    """Returns the longest and current run streak for a given habit."""
+    user_id = current_user_id()
+    streak = get_habit_streak(user_id, habit_id)
 
-    if not habit:
+    if streak is None:
         return jsonify({'message': 'Habit not found'}), 404
 
-    completions = HabitCompletion.query.filter_by(habit_id=habit_id, completed=True).order_by(HabitCompletion.completed_on).all()
-
-    if not completions:
-        return jsonify({'longest_streak': 0}), 200
-
-    longest_streak = 0
-    current_streak = 0
-    previous_date = None
-
-    for completion in completions:
-        if previous_date is None or (completion.completed_on - previous_date).days == 1:
-            current_streak += 1
-        else:
-            longest_streak = max(longest_streak, current_streak)
-            current_streak = 1
-        previous_date = completion.completed_on
-
-    longest_streak = max(longest_streak, current_streak)  # Check for streak ending on the last completion
+    longest_streak, current_streak = streak
+    return jsonify({'longest_streak': longest_streak, 'current_streak': current_streak}), 200
 
-    return jsonify({'longest_streak': longest_streak}), 200
+@api.route('/habits/analytics/summary', methods=['GET'])
+@jwt_required()
+@conditional
+@cached
+def get_habits_summary():
+    """Returns longest streak, current streak and completion rate for every habit"""
+    from analytics import compute_habit_stats
 
-def calculate_longest_streak(completions):
-    """Helper function to calculate the longest streak from a list of completions."""
-    if not completions:
-        return 0
+    user_id = current_user_id()
+    stats = compute_habit_stats(user_id)
+    return jsonify([{'habit_id': habit_id, **habit_stats} for habit_id, habit_stats in stats.items()]), 200
 
-    longest_streak = 0
-    current_streak = 0
-    previous_date = None
+@api.route('/habits/analytics/completion_rate', methods=['GET'])
+@jwt_required()
+@conditional
+@cached
+def get_completion_rate():
+    """Returns completion rates per day, week or month bucket, per habit or for the whole user"""
+    from sql_analytics import BUCKETS, MAX_BUCKETS, completion_rates
+
+    user_id = current_user_id()
+    bucket = request.args.get('bucket', 'week')
+    scope = request.args.get('scope', 'habit')
+    if bucket not in BUCKETS:
+        return jsonify({'message': f"Bucket must be one of {', '.join(BUCKETS)}"}), 400
+    if scope not in ('habit', 'user'):
+        return jsonify({'message': 'Scope must be habit or user'}), 400
+    try:
+        window = parse_int_arg('window', 1)
+    except ValueError as error:
+        return jsonify({'message': str(error)}), 400
+    if window < 1 or window > MAX_BUCKETS:
+        return jsonify({'message': f'Window must be between 1 and {MAX_BUCKETS}'}), 400
 
-    for completion in completions:
-        if previous_date is None or (completion.completed_on - previous_date).days == 1:
-            current_streak += 1
-        else:
-            longest_streak = max(longest_streak, current_streak)
-            current_streak = 1
-        previous_date = completion.completed_on
+    try:
+        date_from = parse_date_arg('from')
+        date_to = parse_date_arg('to')
+    except ValueError:
+        return jsonify({'message': 'Invalid date format. Use YYYY-MM-DD'}), 400
 
-    longest_streak = max(longest_streak, current_streak)
-    return longest_streak
+    try:
+        series = completion_rates(user_id, bucket, date_from, date_to, window,
+                                  habit_id=parse_int_arg('habit_id'), per_habit=scope == 'habit')
+    except ValueError as error:
+        return jsonify({'message': str(error)}), 400
+    return jsonify(series), 200
 
-@app.route('/habits/analytics/longest_streak', methods=['GET'])
+@api.route('/habits/analytics/heatmap', methods=['GET'])
 @jwt_required()
-def get_longest_streak_of_all_habits():
-    """Returns the longest run streak across all defined habits for the user."""
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
-    habits = Habit.query.filter_by(user_id=user.id).all()
-
-    overall_longest_streak = 0
+@conditional
+@cached
+def get_heatmap():
+    """Returns each habit's completed days (or ISO weeks for Weekly habits) in a date range as base64 bits"""
+    from bitmaps import heatmap, heatmap_layout
 
-    for habit in habits:
-        completions = HabitCompletion.query.filter_by(habit_id=habit.id, completed=True).order_by(HabitCompletion.completed_on).all()
-        habit_longest_streak = calculate_longest_streak(completions)
-        overall_longest_streak = max(overall_longest_streak, habit_longest_streak)
-
-    return jsonify({'longest_streak': overall_longest_streak}), 200
+    user_id = current_user_id()
+    try:
+        date_to = parse_date_arg('to') or datetime.date.today()
+        date_from = parse_date_arg('from') or date_to - datetime.timedelta(days=364)
+    except ValueError:
+        return jsonify({'message': 'Invalid date format. Use YYYY-MM-DD'}), 400
 
-@app.route('/habits/analytics/longest_streak/<int:habit_id>', methods=['GET'])
-@jwt_required()
-def get_longest_streak_by_habit(habit_id):
-    """Calculates the longest streak for a given habit."""
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user).first()
-    habit = Habit.query.filter_by(user_id=user.id, id=habit_id).first()
-    if not habit:
-        return jsonify({'message': 'Habit not found'}), 404
-    streak = calculate_streak(habit_id)
-    return jsonify({'longest_streak': streak}), 200
-
-def calculate_streak(habit_id):
-    completions = HabitCompletion.query.filter_by(habit_id=habit_id, completed=True).order_by(HabitCompletion.completed_on).all()
-    if not completions:
-        return 0
-    streak = 1
-    longest_streak = 1
-    for i in range(1, len(completions)):
-        if (completions[i].completed_on - completions[i - 1].completed_on).days == 1:
-            streak += 1
-            if streak > longest_streak:
-                longest_streak = streak
-        else:
-            streak = 1
-    return longest_streak
\ No newline at end of file
+    try:
+        maps = heatmap(user_id, date_from, date_to, habit_id=parse_int_arg('habit_id'))
+    except ValueError as error:
+        return jsonify({'message': str(error)}), 400
+
+    habits = {'daily': {}, 'weekly': {}}
+    for habit_id, (frequency, bits) in maps.items():
+        habits['weekly' if frequency == 'Weekly' else 'daily'][str(habit_id)] = bits
+
+    body = {'from': date_from.isoformat(), 'to': date_to.isoformat()}
+    for key, frequency in (('daily', 'Daily'), ('weekly', 'Weekly')):
+        first, count = heatmap_layout(date_from, date_to, frequency)
+        start = datetime.date.fromordinal(first * 7 + 1 if frequency == 'Weekly' else first)
+        body[key] = {'start': start.isoformat(), 'length': count, 'habits': habits[key]}
+    return jsonify(body), 200
@@ -0,0 +1,100 @@
+from flask import current_app, g, has_request_context, request
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from flask_sqlalchemy.session import Session
+import os
+import threading
+import time
+
+def engine_options(url):
+    """Builds SQLAlchemy engine options for a database URL from the DB_* environment variables.
+
+    Pool sizing only applies to server databases; SQLite keeps the pool Flask-SQLAlchemy picks.
+    DB_STATEMENT_TIMEOUT_MS is passed to PostgreSQL as statement_timeout (0 disables it).
+    """
+    options = {
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+    if not url.startswith('sqlite'):
+        options['pool_size'] = int(os.environ.get('DB_POOL_SIZE', 5))
+        options['max_overflow'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+        options['pool_timeout'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    if statement_timeout and url.startswith('postgresql'):
+        options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+    return options
+
+class RecentWrites:
+    """Remembers which users wrote recently, so their reads can stick to the primary.
+
+    The state is per process; a user whose requests land on another worker within
+    the window may briefly read from the replica.
+    """
+
+    def __init__(self):
+        self._until = {}
+        self._lock = threading.Lock()
+
+    def record(self, user_id, seconds):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._until) > 10000:
+                self._until = {user: until for user, until in self._until.items() if until > now}
+            self._until[user_id] = now + seconds
+
+    def is_recent(self, user_id):
+        with self._lock:
+            return self._until.get(user_id, 0) > time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._until.clear()
+
+recent_writes = RecentWrites()
+
+def record_write(user_id):
+    """Pins the user's reads to the primary for REPLICA_STICKY_SECONDS."""
+    if current_app.config['REPLICA_STICKY_SECONDS']:
+        recent_writes.record(user_id, current_app.config['REPLICA_STICKY_SECONDS'])
+
+def reads_from_replica():
+    """Decides once per request whether its queries may go to the read replica.
+
+    Only GET and HEAD requests qualify, and not for a user who wrote within the
+    sticky window. The user is the token's 'uid' claim or, for older tokens,
+    its identity resolved through the identity cache, so deciding costs no
+    query; a user missing from the cache reads from the primary.
+    """
+    from auth import identity_cache  # auth imports extensions, which imports this module
+
+    if not has_request_context() or request.method not in ('GET', 'HEAD'):
+        return False
+    if 'read_replica' not in g:
+        try:
+            username, user_id = get_jwt_identity(), get_jwt().get('uid')
+        except RuntimeError:  # no token was verified for this request
+            username = user_id = None
+        if username is None:
+            g.read_replica = True
+        else:
+            if user_id is None:
+                user_id = identity_cache.get(username)
+            g.read_replica = user_id is not None and not recent_writes.is_recent(user_id)
+    return g.read_replica
+
+def reset_routing():
+    g.pop('read_replica', None)
+
+def init_app(app):
+    """Makes every request decide afresh where its reads go."""
+    app.before_request(reset_routing)
+
+class RoutingSession(Session):
+    """Sends the queries of read-only requests to the 'replica' bind when one is configured."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing:
+            replica = self._db.engines.get('replica')
+            if replica is not None and reads_from_replica():
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
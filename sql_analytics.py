@@ -0,0 +1,219 @@
+from extensions import db
+from models import Habit
+from sqlalchemy import Integer, and_, case, cast, func, literal, literal_column, select
+from utils import completed_days_query, dialect_name
+import calendar
+import datetime
+
+EPOCH = datetime.date(1970, 1, 1)
+BUCKETS = ('day', 'week', 'month')
+DEFAULT_BUCKET_COUNTS = {'day': 30, 'week': 26, 'month': 12}
+MAX_BUCKETS = 1000
+
+def epoch_days(column):
+    """SQL expression for the number of days between 1970-01-01 and a date column."""
+    if dialect_name() == 'postgresql':
+        return column - literal_column("DATE '1970-01-01'")
+    return cast(func.julianday(column) - 2440587.5, Integer)
+
+def month_index(days):
+    """SQL expression turning epoch days into year * 12 + month - 1."""
+    if dialect_name() == 'postgresql':
+        day = literal_column("DATE '1970-01-01'") + days
+        return cast(func.extract('year', day) * 12 + func.extract('month', day) - 1, Integer)
+    day = func.date(days * 86400, 'unixepoch')
+    return cast(func.strftime('%Y', day), Integer) * 12 + cast(func.strftime('%m', day), Integer) - 1
+
+def bucket_index_of(day, bucket):
+    """Python counterpart of the SQL bucket index: epoch day, Monday-based week or month number."""
+    days = (day - EPOCH).days
+    if bucket == 'day':
+        return days
+    if bucket == 'week':
+        return (days + 3) // 7
+    return day.year * 12 + day.month - 1
+
+def bucket_start(index, bucket):
+    """Returns the first day of a bucket index."""
+    if bucket == 'day':
+        return EPOCH + datetime.timedelta(days=index)
+    if bucket == 'week':
+        return EPOCH + datetime.timedelta(days=index * 7 - 3)
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+def expected_periods(index, bucket, frequency):
+    """Returns how many check-ins a habit of the given frequency owes within a bucket.
+
+    Daily habits owe one per day. Weekly habits owe one per week, counted in the
+    bucket holding the week's Monday.
+    """
+    start = bucket_start(index, bucket)
+    if bucket == 'day':
+        return 1 if frequency != 'Weekly' or start.weekday() == 0 else 0
+    if bucket == 'week':
+        return 1 if frequency == 'Weekly' else 7
+    days = calendar.monthrange(start.year, start.month)[1]
+    if frequency != 'Weekly':
+        return days
+    first_monday = (7 - start.weekday()) % 7
+    return (days - first_monday + 6) // 7
+
+def completion_rate_query(user_id, bucket, first, last, window, habit_id=None):
+    """Builds the per-habit bucket series with completed periods and their rolling sum.
+
+    Completed days, raw and archived, are grouped in SQL per (habit, bucket)
+    counting distinct days, or distinct ISO weeks for Weekly habits (attributed
+    to the bucket of the week's Monday). A recursive calendar of bucket indexes
+    fills empty buckets so the window function can sum the trailing `window` buckets.
+    """
+    habit_filter = Habit.user_id == user_id
+    if habit_id is not None:
+        habit_filter = and_(habit_filter, Habit.id == habit_id)
+
+    # Weeks run Monday to Sunday as in streaks.period_of, so the week of the last
+    # bucket's last day is read to its Sunday even when that lies past the bucket
+    date_to = bucket_start(last + 1, bucket) - datetime.timedelta(days=1)
+    completions = completed_days_query(
+        habit_filter, bucket_start(first, bucket), date_to + datetime.timedelta(days=6 - date_to.weekday()),
+    ).subquery('completions')
+    days = epoch_days(completions.c.completed_on)
+    weekly = Habit.frequency == 'Weekly'
+    week = (days + 3) // 7
+    attributed_day = case((weekly, week * 7 - 3), else_=days)
+    period = case((weekly, week), else_=days)
+    bucket_expression = {'day': attributed_day, 'week': (attributed_day + 3) // 7, 'month': month_index(attributed_day)}[bucket]
+
+    counts = (
+        select(
+            completions.c.habit_id.label('habit_id'),
+            bucket_expression.label('bucket'),
+            func.count(period.distinct()).label('completed'),
+        )
+        .join(Habit, Habit.id == completions.c.habit_id)
+        .group_by(completions.c.habit_id, bucket_expression)
+        .cte('counts')
+    )
+
+    buckets = select(literal(first, Integer).label('bucket')).cte('buckets', recursive=True)
+    buckets = buckets.union_all(select((buckets.c.bucket + 1).label('bucket')).filter(buckets.c.bucket < last))
+
+    completed = func.coalesce(counts.c.completed, 0)
+    return (
+        select(
+            Habit.id.label('habit_id'),
+            Habit.frequency,
+            buckets.c.bucket,
+            completed.label('completed'),
+            func.sum(completed).over(partition_by=Habit.id, order_by=buckets.c.bucket, rows=(-(window - 1), 0)).label('rolling_completed'),
+        )
+        .select_from(Habit)
+        .join(buckets, literal(True))
+        .outerjoin(counts, and_(counts.c.habit_id == Habit.id, counts.c.bucket == buckets.c.bucket))
+        .filter(habit_filter)
+        .order_by(Habit.id, buckets.c.bucket)
+    )
+
+def rate(completed, expected):
+    return round(completed / expected, 4) if expected else None
+
+def completion_rates(user_id, bucket='week', date_from=None, date_to=None, window=1, habit_id=None, per_habit=True):
+    """Returns the completion rate series of a user's habits, or of the user as a whole.
+
+    Only the aggregated series leaves the database: one row per habit and bucket.
+    """
+    date_to = date_to or datetime.date.today()
+    last = bucket_index_of(date_to, bucket)
+    first = bucket_index_of(date_from, bucket) if date_from else last - DEFAULT_BUCKET_COUNTS[bucket] + 1
+    if first > last:
+        return []
+    if last - first + 1 > MAX_BUCKETS:
+        raise ValueError(f'At most {MAX_BUCKETS} buckets can be requested at once')
+
+    rows = db.session.execute(completion_rate_query(user_id, bucket, first, last, window, habit_id)).all()
+
+    series = {}
+    for row in rows:
+        expected = [expected_periods(index, bucket, row.frequency) for index in range(max(first, row.bucket - window + 1), row.bucket + 1)]
+        key = row.habit_id if per_habit else None
+        point = series.setdefault(key, {}).setdefault(row.bucket, [0, 0, 0, 0])
+        point[0] += row.completed
+        point[1] += expected[-1]
+        point[2] += row.rolling_completed
+        point[3] += sum(expected)
+
+    return [
+        {
+            **({'habit_id': key} if per_habit else {}),
+            'bucket': bucket_start(index, bucket).isoformat(),
+            'completed': completed,
+            'expected': expected,
+            'rate': rate(completed, expected),
+            'rolling_rate': rate(rolling_completed, rolling_expected),
+        }
+        for key, points in series.items()
+        for index, (completed, expected, rolling_completed, rolling_expected) in points.items()
+    ]
+
+def streak_query(user_id, habit_id=None, today=None):
+    """Builds a gaps-and-islands select of (habit_id, longest, current) for a user's habits.
+
+    Completed periods (days, or ISO weeks for Weekly habits; raw and archived)
+    minus their row_number() are constant within a run of consecutive periods,
+    so grouping by that difference yields every run and its length. The current
+    streak is the run ending at the latest completion, as long as that is in
+    today's or the previous period. Habits without completions get 0.
+    """
+    habit_filter = Habit.user_id == user_id
+    if habit_id is not None:
+        habit_filter = and_(habit_filter, Habit.id == habit_id)
+
+    today_days = ((today or datetime.date.today()) - EPOCH).days
+    today_period = case((Habit.frequency == 'Weekly', (today_days + 3) // 7), else_=today_days)
+
+    completions = completed_days_query(habit_filter).subquery('completions')
+    days = epoch_days(completions.c.completed_on)
+    period = case((Habit.frequency == 'Weekly', (days + 3) // 7), else_=days).label('period')
+
+    periods = (
+        select(completions.c.habit_id, period)
+        .join(Habit, Habit.id == completions.c.habit_id)
+        .distinct()
+        .subquery('periods')
+    )
+    islands = select(
+        periods.c.habit_id,
+        periods.c.period,
+        (periods.c.period - func.row_number().over(partition_by=periods.c.habit_id, order_by=periods.c.period)).label('island'),
+    ).subquery('islands')
+    runs = (
+        select(
+            islands.c.habit_id,
+            func.count().label('length'),
+            func.max(islands.c.period).label('end_period'),
+            func.max(func.max(islands.c.period)).over(partition_by=islands.c.habit_id).label('latest_period'),
+        )
+        .group_by(islands.c.habit_id, islands.c.island)
+        .subquery('runs')
+    )
+    return (
+        select(
+            Habit.id.label('habit_id'),
+            func.coalesce(func.max(runs.c.length), 0).label('longest'),
+            func.coalesce(func.max(case(
+                (and_(runs.c.end_period == runs.c.latest_period, runs.c.end_period >= today_period - 1), runs.c.length),
+            )), 0).label('current'),
+        )
+        .outerjoin(runs, runs.c.habit_id == Habit.id)
+        .filter(habit_filter)
+        .group_by(Habit.id)
+        .order_by(Habit.id)
+    )
+
+def compute_sql_streaks(user_id, habit_id=None, today=None):
+    """Returns habit_id -> (longest, current) streak for a user's habits, computed by the database."""
+    return {row.habit_id: (row.longest, row.current) for row in db.session.execute(streak_query(user_id, habit_id, today))}
+
+def get_sql_longest_streak(user_id):
+    """Returns the longest streak across a user's habits as a single value computed by the database."""
+    streaks = streak_query(user_id).subquery()
+    return db.session.execute(select(func.coalesce(func.max(streaks.c.longest), 0))).scalar()
@@ -0,0 +1,226 @@
+from extensions import db
+from models import Habit, HabitCompletion, HabitStreak
+from utils import iter_habit_histories, user_completions_query
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func
+import datetime
+
+def period_of(day, frequency):
+    """Maps a date to its streak period: the day itself, or its ISO week for Weekly habits."""
+    ordinal = day.toordinal()
+    return (ordinal - 1) // 7 if frequency == 'Weekly' else ordinal
+
+def live_current_length(current_length, last_completed_on, frequency, today=None):
+    """Returns a stored current streak as of today: 0 once neither today's nor the previous period was completed."""
+    if last_completed_on is None:
+        return 0
+    if period_of(last_completed_on, frequency) < period_of(today or datetime.date.today(), frequency) - 1:
+        return 0
+    return current_length
+
+def current_expires_on(last_completed_on, frequency):
+    """Returns the first day on which a current streak ending on `last_completed_on` has lapsed."""
+    if frequency == 'Weekly':
+        monday = last_completed_on - datetime.timedelta(days=last_completed_on.weekday())
+        return monday + datetime.timedelta(days=14)
+    return last_completed_on + datetime.timedelta(days=2)
+
+def streak_lengths(dates, frequency, today=None):
+    """Returns the (longest, current) streak of completed dates by walking them in order.
+
+    A plain reference for the streak engines, used by the tests and benchmarks.
+    Weekly dates are reduced to the Monday of their week, so consecutive periods
+    are 7 days apart instead of 1.
+    """
+    step = 7 if frequency == 'Weekly' else 1
+
+    def start(day):
+        return day - datetime.timedelta(days=day.weekday()) if frequency == 'Weekly' else day
+
+    longest = run = 0
+    previous = None
+    for period in sorted({start(day) for day in dates}):
+        run = run + 1 if previous is not None and (period - previous).days == step else 1
+        longest = max(longest, run)
+        previous = period
+    lapsed = previous is None or (start(today or datetime.date.today()) - previous).days > step
+    return longest, 0 if lapsed else run
+
+def note_streak_change(habit_id):
+    """Records that a habit's streak state changed in this transaction, for update_leaderboard."""
+    db.session.info.setdefault('changed_streaks', set()).add(habit_id)
+
+def streak_state(streak):
+    """Returns the fields of a streak state that the leaderboards read."""
+    return streak.current_length, streak.longest_length, streak.last_completed_on
+
+def get_or_create_streak(habit_id):
+    """Returns the streak state of a habit, creating an empty one if needed."""
+    streak = db.session.get(HabitStreak, habit_id)
+    if streak is None:
+        streak = HabitStreak(habit_id=habit_id, current_length=0, longest_length=0)
+        db.session.add(streak)
+    return streak
+
+def extend_streak(streak, completed_on, frequency):
+    """Advances the streak state by one completed day in O(1).
+
+    Returns False when the day lies before the last completed period, since the
+    state then has to be rebuilt from the completion table.
+    """
+    period = period_of(completed_on, frequency)
+    last = period_of(streak.last_completed_on, frequency) if streak.last_completed_on else None
+
+    if last is None or period > last + 1:
+        streak.current_start = completed_on
+        streak.current_length = 1
+    elif period == last + 1:
+        streak.current_length += 1
+    elif period == last:
+        streak.last_completed_on = max(streak.last_completed_on, completed_on)
+        return True
+    else:
+        return False
+
+    streak.last_completed_on = completed_on
+    streak.longest_length = max(streak.longest_length, streak.current_length)
+    return True
+
+def apply_completion(habit, completed_on, completed):
+    """Folds a newly recorded completion into the habit's streak state."""
+    if completed:
+        apply_completions(habit.id, habit.frequency, [completed_on])
+
+def apply_completions(habit_id, frequency, dates):
+    """Folds a batch of completed dates for one habit into its streak state.
+
+    The state is rebuilt once if any date lands before the last completed period,
+    rather than once per backdated row.
+    """
+    dates = sorted(set(dates))
+    if not dates:
+        return
+
+    streak = get_or_create_streak(habit_id)
+    before = streak_state(streak)
+    if not all(extend_streak(streak, completed_on, frequency) for completed_on in dates):
+        rebuild_streak(habit_id, frequency)
+    if streak_state(streak) != before:
+        note_streak_change(habit_id)
+
+def retract_completions(habit_id, frequency, dates):
+    """Updates the streak state after days of one habit were recorded as not completed.
+
+    Only a day up to the last completed one can have been counted before, so the
+    state is rebuilt just in that case. Returns whether it was rebuilt.
+    """
+    streak = db.session.get(HabitStreak, habit_id)
+    if streak is None or streak.last_completed_on is None or min(dates) > streak.last_completed_on:
+        return False
+    rebuild_streak(habit_id, frequency)
+    return True
+
+def rebuild_streak(habit_id, frequency, dates=None):
+    """Recomputes the streak state of a habit from its full completion history.
+
+    The ordered completed dates can be passed in when they were already fetched.
+    """
+    if dates is None:
+        dates = [row.completed_on for row in db.session.execute(user_completions_query(completed_only=True, habit_id=habit_id))]
+
+    streak = get_or_create_streak(habit_id)
+    before = streak_state(streak)
+    streak.current_start = None
+    streak.current_length = 0
+    streak.longest_length = 0
+    streak.last_completed_on = None
+
+    for completed_on in dates:
+        extend_streak(streak, completed_on, frequency)
+
+    if streak_state(streak) != before:
+        note_streak_change(habit_id)
+    return streak
+
+def rebuild_all_streaks(habit_filter=None):
+    """Recomputes the streak state of every habit, or of those matching habit_filter, one habit at a time."""
+    existing = db.select(HabitStreak)
+    if habit_filter is not None:
+        existing = existing.join(Habit, Habit.id == HabitStreak.habit_id).filter(habit_filter)
+    db.session.execute(existing).scalars().all()  # load existing state into the identity map
+    count = 0
+    for habit_id, frequency, dates in iter_habit_histories(habit_filter):
+        rebuild_streak(habit_id, frequency, dates)
+        count += 1
+    return count
+
+def get_user_longest_streak(user_id):
+    """Returns the longest streak across a user's habits, computed by the configured STREAK_ENGINE."""
+    if current_app.config['STREAK_ENGINE'] == 'numpy':
+        from analytics import compute_habit_stats
+        return max((stats['longest_streak'] for stats in compute_habit_stats(user_id).values()), default=0)
+    if current_app.config['STREAK_ENGINE'] == 'bitmap':
+        from bitmaps import compute_bitmap_streaks
+        return max((longest for longest, _ in compute_bitmap_streaks(user_id).values()), default=0)
+    if current_app.config['STREAK_ENGINE'] == 'sql':
+        from sql_analytics import get_sql_longest_streak
+        return get_sql_longest_streak(user_id)
+
+    longest_streak = db.session.execute(
+        db.select(func.max(HabitStreak.longest_length)).join(Habit).filter(Habit.user_id == user_id)
+    ).scalar()
+    return longest_streak or 0
+
+def get_habit_streak(user_id, habit_id):
+    """Returns (longest, current) streak of one of the user's habits, or None if it does not exist."""
+    if current_app.config['STREAK_ENGINE'] == 'numpy':
+        from analytics import compute_habit_stats
+        stats = compute_habit_stats(user_id, habit_id).get(habit_id)
+        return (stats['longest_streak'], stats['current_streak']) if stats else None
+    if current_app.config['STREAK_ENGINE'] == 'bitmap':
+        from bitmaps import compute_bitmap_streaks
+        return compute_bitmap_streaks(user_id, habit_id).get(habit_id)
+    if current_app.config['STREAK_ENGINE'] == 'sql':
+        from sql_analytics import compute_sql_streaks
+        return compute_sql_streaks(user_id, habit_id).get(habit_id)
+
+    row = db.session.execute(
+        db.select(Habit.id, Habit.frequency, HabitStreak.longest_length, HabitStreak.current_length, HabitStreak.last_completed_on)
+        .outerjoin(HabitStreak)
+        .filter(Habit.id == habit_id, Habit.user_id == user_id)
+    ).first()
+    if row is None:
+        return None
+    return row.longest_length or 0, live_current_length(row.current_length, row.last_completed_on, row.frequency)
+
+@click.command('rebuild-streaks')
+@click.option('--habit-id', type=int, help='Only rebuild the streak of this habit.')
+@with_appcontext
+def rebuild_streaks_command(habit_id):
+    """Recomputes the stored streak state from the completion table."""
+    if habit_id:
+        habit = db.get_or_404(Habit, habit_id)
+        rebuild_streak(habit.id, habit.frequency)
+        count = 1
+    else:
+        count = rebuild_all_streaks()
+    db.session.commit()
+    click.echo(f'Rebuilt streaks for {count} habit(s).')
+
+@click.command('dedupe-completions')
+@with_appcontext
+def dedupe_completions_command():
+    """Keeps only the latest completion row per habit and day, then rebuilds the streak state.
+
+    The migration that adds the unique (habit_id, completed_on) index removes duplicates the same way.
+    """
+    latest = db.select(func.max(HabitCompletion.id)).group_by(HabitCompletion.habit_id, HabitCompletion.completed_on)
+    deleted = db.session.execute(db.delete(HabitCompletion).where(HabitCompletion.id.not_in(latest))).rowcount
+    if deleted:
+        rebuild_all_streaks()
+    db.session.commit()
+    click.echo(f'Removed {deleted} duplicate completion(s).')
+    if deleted and current_app.config['COMPLETION_BITMAPS']:
+        click.echo('Run `flask build-bitmaps` to refresh the bitmap store.')
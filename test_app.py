@@ -1,19 +1,29 @@
+import os
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'  # Use an in-memory database for testing
+os.environ['BCRYPT_LOG_ROUNDS'] = '4'  # Keep password hashing cheap in tests
+
 import unittest
 import json
-from app import app, db
-from models import User, Habit, HabitCompletion
+import threading
+from app import app, db, bcrypt
+from models import User, Habit, HabitCompletion, HabitBitmap
+import caching
+from auth import identity_cache
 
 class HabitTrackerTestCase(unittest.TestCase):
 
     def setUp(self):
         """Set up test environment."""
         app.config['TESTING'] = True
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'  # Use an in-memory database for testing
         self.app = app.test_client()
+        self.ctx = app.app_context()
+        self.ctx.push()
         db.create_all()
+        caching.response_cache.clear()  # ids and data versions restart with every in-memory database
+        identity_cache.clear()
 
         # Create a user for testing
-        user = User(username='testuser', email='test@example.com', password='password')
+        user = User(username='testuser', email='test@example.com', password=bcrypt.generate_password_hash('password').decode('utf-8'))
         db.session.add(user)
         db.session.commit()
 
@@ -25,6 +35,7 @@ class HabitTrackerTestCase(unittest.TestCase):
         """Clean up after each test."""
         db.session.remove()
         db.drop_all()
+        self.ctx.pop()
 
     def test_register_user(self):
         """Test user registration."""
@@ -92,5 +103,1009 @@ class HabitTrackerTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn('longest_streak', json.loads(response.data))
 
+    def test_streak_state_is_maintained_on_completion(self):
+        """Test that recording completions keeps the stored streak state current."""
+        import datetime
+        response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Test Habit', 'description': 'Test Description', 'frequency': 'Daily'})
+        habit_id = json.loads(response.data)['id']
+
+        def days_ago(days):
+            return (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+
+        for completed_on in [days_ago(5), days_ago(4), days_ago(3), days_ago(1), days_ago(0)]:
+            self.app.post(f'/habits/{habit_id}/completions', headers={'Authorization': f'Bearer {self.token}'}, json={'completed_on': completed_on, 'completed': True})
+
+        response = self.app.get(f'/habits/analytics/longest_streak/{habit_id}', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(json.loads(response.data), {'longest_streak': 3, 'current_streak': 2})
+
+        # Backfilling the gap joins both runs
+        self.app.post(f'/habits/{habit_id}/completions', headers={'Authorization': f'Bearer {self.token}'}, json={'completed_on': days_ago(2), 'completed': True})
+        response = self.app.get('/habits/analytics/longest_streak', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(json.loads(response.data)['longest_streak'], 6)
+
+    def test_current_streak_lapses(self):
+        """Test that every engine reports no current streak once a whole period passed without a completion."""
+        import datetime
+        headers = {'Authorization': f'Bearer {self.token}'}
+        app.config['COMPLETION_BITMAPS'] = True
+        self.addCleanup(app.config.update, COMPLETION_BITMAPS=False, STREAK_ENGINE='table')
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        habit_ids = []
+        for start, length in [(datetime.date(2022, 1, 1), 30), (yesterday - datetime.timedelta(days=2), 3)]:
+            response = self.app.post('/habits', headers=headers, json={'name': 'Run', 'frequency': 'Daily'})
+            habit_ids.append(json.loads(response.data)['id'])
+            records = [{'habit_id': habit_ids[-1], 'completed_on': (start + datetime.timedelta(days=day)).isoformat(), 'completed': True} for day in range(length)]
+            self.app.post('/habits/completions/batch', headers=headers, json=records)
+
+        for engine in ['table', 'numpy', 'bitmap', 'sql']:
+            app.config['STREAK_ENGINE'] = engine
+            caching.response_cache.clear()
+            streaks = [json.loads(self.app.get(f'/habits/analytics/longest_streak/{habit_id}', headers=headers).data) for habit_id in habit_ids]
+            self.assertEqual(streaks, [{'longest_streak': 30, 'current_streak': 0}, {'longest_streak': 3, 'current_streak': 3}], engine)
+        summary = json.loads(self.app.get('/habits/analytics/summary', headers=headers).data)
+        self.assertEqual([habit['current_streak'] for habit in summary], [0, 3])
+
+    def test_rebuild_streaks_command(self):
+        """Test rebuilding the streak state from existing completions."""
+        from models import HabitStreak
+        import datetime
+        user = User.query.filter_by(username='testuser').first()
+        habit = Habit(name='Test Habit', frequency='Daily', user_id=user.id)
+        db.session.add(habit)
+        db.session.commit()
+        for day in [1, 2, 4, 5, 6]:
+            db.session.add(HabitCompletion(habit_id=habit.id, completed_on=datetime.date(2024, 10, day), completed=True))
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['rebuild-streaks'])
+        self.assertEqual(result.exit_code, 0)
+        streak = db.session.get(HabitStreak, habit.id)
+        self.assertEqual((streak.longest_length, streak.current_length, streak.current_start), (3, 3, datetime.date(2024, 10, 4)))
+
+    def count_statements(self, path, token=None, headers=None, status_code=200):
+        """Returns the number of SQL statements executed while serving a GET request."""
+        from sqlalchemy import event
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            response = self.app.get(path, headers={'Authorization': f'Bearer {token or self.token}', **(headers or {})})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(response.status_code, status_code)
+        return len(statements)
+
+    def test_get_completions_statement_count_is_constant(self):
+        """Test that listing completions costs the same number of queries regardless of habit count."""
+        count_statements = lambda: self.count_statements('/habits/completions')
+
+        def add_habits(count):
+            for i in range(count):
+                response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': f'Habit {i}', 'frequency': 'Daily'})
+                habit_id = json.loads(response.data)['id']
+                self.app.post(f'/habits/{habit_id}/completions', headers={'Authorization': f'Bearer {self.token}'}, json={'completed_on': '2024-10-27', 'completed': True})
+
+        add_habits(1)
+        baseline = count_statements()
+        add_habits(10)
+        self.assertEqual(count_statements(), baseline)
+
+    def test_record_completions_batch(self):
+        """Test recording a batch of completions with per-row results."""
+        response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Test Habit', 'description': 'Test Description', 'frequency': 'Daily'})
+        habit_id = json.loads(response.data)['id']
+
+        records = [
+            {'habit_id': habit_id, 'completed_on': '2024-10-02', 'completed': True},
+            {'habit_id': habit_id, 'completed_on': '2024-10-01', 'completed': True},
+            {'habit_id': habit_id, 'completed_on': '10/03/2024', 'completed': True},
+            {'habit_id': habit_id + 100, 'completed_on': '2024-10-03', 'completed': True},
+            {'habit_id': habit_id, 'completed_on': '2024-10-01', 'completed': True},
+        ]
+        response = self.app.post('/habits/completions/batch', headers={'Authorization': f'Bearer {self.token}'}, json=records)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual((data['created'], data['updated'], data['failed']), (2, 1, 2))
+        self.assertEqual([result['status'] for result in data['results']], ['created', 'created', 'error', 'error', 'updated'])
+        self.assertEqual(data['results'][3]['message'], 'Habit not found')
+
+        response = self.app.get(f'/habits/analytics/longest_streak/{habit_id}', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(json.loads(response.data)['longest_streak'], 2)
+
+        # Sending recorded days again updates them
+        records = [{'habit_id': habit_id, 'completed_on': '2024-10-02', 'completed': False},
+                   {'habit_id': habit_id, 'completed_on': '2024-10-04', 'completed': True}]
+        response = self.app.post('/habits/completions/batch', headers={'Authorization': f'Bearer {self.token}'}, json=records)
+        data = json.loads(response.data)
+        self.assertEqual((data['created'], data['updated'], data['failed']), (1, 1, 0))
+        self.assertEqual([result['status'] for result in data['results']], ['updated', 'created'])
+
+    def test_record_completions_batch_ndjson(self):
+        """Test recording a batch of completions sent as NDJSON."""
+        response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Test Habit', 'description': 'Test Description', 'frequency': 'Daily'})
+        habit_id = json.loads(response.data)['id']
+
+        body = '\n'.join(json.dumps({'habit_id': habit_id, 'completed_on': f'2024-10-{day:02d}', 'completed': True}) for day in range(1, 11))
+        response = self.app.post('/habits/completions/batch', headers={'Authorization': f'Bearer {self.token}'}, data=body + '\nnot json', content_type='application/x-ndjson')
+        data = json.loads(response.data)
+        self.assertEqual((data['created'], data['failed']), (10, 1))
+        self.assertEqual(HabitCompletion.query.filter_by(habit_id=habit_id).count(), 10)
+
+    def test_completions_are_upserted(self):
+        """Test that repeated check-ins update the existing row and that withdrawing one updates the streak."""
+        import datetime
+        response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Test Habit', 'frequency': 'Daily'})
+        habit_id = json.loads(response.data)['id']
+        day = [(datetime.date.today() - datetime.timedelta(days=3 - offset)).isoformat() for offset in range(4)]
+        for completed_on in [day[0], day[1], day[1], day[2]]:
+            response = self.app.post(f'/habits/{habit_id}/completions', headers={'Authorization': f'Bearer {self.token}'}, json={'completed_on': completed_on, 'completed': True})
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(HabitCompletion.query.filter_by(habit_id=habit_id).count(), 3)
+
+        self.app.post(f'/habits/{habit_id}/completions', headers={'Authorization': f'Bearer {self.token}'}, json={'completed_on': day[1], 'completed': False})
+        response = self.app.get(f'/habits/analytics/longest_streak/{habit_id}', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(json.loads(response.data), {'longest_streak': 1, 'current_streak': 1})
+
+        # Within a batch the last record for a day wins
+        records = [{'habit_id': habit_id, 'completed_on': day[1], 'completed': completed} for completed in (False, True)]
+        records.append({'habit_id': habit_id, 'completed_on': day[3], 'completed': True})
+        response = self.app.post('/habits/completions/batch', headers={'Authorization': f'Bearer {self.token}'}, json=records)
+        data = json.loads(response.data)
+        self.assertEqual((data['created'], data['updated']), (1, 2))
+        self.assertEqual(HabitCompletion.query.filter_by(habit_id=habit_id).count(), 4)
+        response = self.app.get(f'/habits/analytics/longest_streak/{habit_id}', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(json.loads(response.data), {'longest_streak': 4, 'current_streak': 4})
+
+    def test_dedupe_completions_command(self):
+        """Test removing duplicate completion rows left over from before the unique index."""
+        import datetime
+        from sqlalchemy import text
+        user = User.query.filter_by(username='testuser').first()
+        habit = Habit(name='Test Habit', frequency='Daily', user_id=user.id)
+        db.session.add(habit)
+        db.session.commit()
+        db.session.execute(text('DROP INDEX ix_habit_completion_habit_id_completed_on'))
+        for day, completed in [(1, True), (1, True), (2, True), (2, False), (3, True)]:
+            db.session.add(HabitCompletion(habit_id=habit.id, completed_on=datetime.date(2024, 10, day), completed=completed))
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['dedupe-completions'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Removed 2 duplicate completion(s).', result.output)
+        rows = db.session.execute(db.select(HabitCompletion.completed_on, HabitCompletion.completed).order_by(HabitCompletion.completed_on)).all()
+        self.assertEqual([(row.completed_on.day, row.completed) for row in rows], [(1, True), (2, False), (3, True)])
+        self.assertEqual(habit.streak.longest_length, 1)
+
+    def test_streak_engines_match_reference(self):
+        """Test on seeded random histories that the numpy and table engines agree with the reference walk for both frequencies."""
+        import datetime
+        import random
+        from analytics import compute_habit_stats
+        from streaks import live_current_length, rebuild_all_streaks, streak_lengths
+        from models import HabitStreak
+
+        user = User.query.filter_by(username='testuser').first()
+        # The starts cover a 53-week ISO year (2020) and weeks that straddle New Year
+        for seed, start in enumerate([datetime.date(2023, 12, 20), datetime.date(2020, 11, 30), datetime.date(2021, 12, 27), datetime.date(2024, 2, 10)]):
+            rng = random.Random(seed)
+            span = rng.randint(30, 200)
+            histories = {}
+            for trial in range(12):
+                habit = Habit(name=f'Habit {seed}-{trial}', frequency=rng.choice(['Daily', 'Weekly']), user_id=user.id)
+                db.session.add(habit)
+                db.session.flush()
+                density = rng.random()
+                histories[habit.id] = (habit.frequency, [])
+                for day in rng.sample(range(span), int(span * density)):
+                    completed = rng.random() < 0.9
+                    db.session.add(HabitCompletion(habit_id=habit.id, completed_on=start + datetime.timedelta(days=day), completed=completed))
+                    if completed:
+                        histories[habit.id][1].append(start + datetime.timedelta(days=day))
+            db.session.commit()
+            rebuild_all_streaks()
+
+            today = start + datetime.timedelta(days=span - 1 + rng.randint(0, 10))
+            stats = compute_habit_stats(user.id, today=today)
+            for habit_id, (frequency, dates) in histories.items():
+                with self.subTest(seed=seed, habit_id=habit_id, frequency=frequency):
+                    expected = streak_lengths(dates, frequency, today)
+                    streak = db.session.get(HabitStreak, habit_id)
+                    current = live_current_length(streak.current_length, streak.last_completed_on, frequency, today)
+                    self.assertEqual((stats[habit_id]['longest_streak'], stats[habit_id]['current_streak']), expected)
+                    self.assertEqual((streak.longest_length, current), expected)
+
+    def test_get_habits_summary(self):
+        """Test the per-habit streak and completion rate summary."""
+        import datetime
+        response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Test Habit', 'description': 'Test Description', 'frequency': 'Weekly'})
+        habit_id = json.loads(response.data)['id']
+        # Two check-ins in the same ISO week count once; this week extends the streak
+        monday = datetime.date.today() - datetime.timedelta(days=datetime.date.today().weekday())
+        for offset in [-7, -1, 0]:
+            completed_on = (monday + datetime.timedelta(days=offset)).isoformat()
+            self.app.post(f'/habits/{habit_id}/completions', headers={'Authorization': f'Bearer {self.token}'}, json={'completed_on': completed_on, 'completed': True})
+
+        response = self.app.get('/habits/analytics/summary', headers={'Authorization': f'Bearer {self.token}'})
+        summary = json.loads(response.data)
+        self.assertEqual(summary[0]['habit_id'], habit_id)
+        self.assertEqual((summary[0]['longest_streak'], summary[0]['current_streak']), (2, 2))
+        self.assertTrue(0 < summary[0]['completion_rate'] <= 1)
+
+        app.config['STREAK_ENGINE'] = 'numpy'
+        try:
+            response = self.app.get(f'/habits/analytics/longest_streak/{habit_id}', headers={'Authorization': f'Bearer {self.token}'})
+        finally:
+            app.config['STREAK_ENGINE'] = 'table'
+        self.assertEqual(json.loads(response.data), {'longest_streak': 2, 'current_streak': 2})
+
+    def test_bitmap_store_matches_streak_table(self):
+        """Test that streaks read from the bitmap store match the stored streak state across year boundaries."""
+        import datetime
+        import random
+        from bitmaps import compute_bitmap_streaks
+        from models import HabitStreak
+        from streaks import live_current_length
+
+        app.config['COMPLETION_BITMAPS'] = True
+        try:
+            rng = random.Random(5)
+            start = datetime.date(2023, 12, 1)
+            for i, frequency in enumerate(['Daily', 'Daily', 'Weekly', 'Weekly']):
+                response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': f'Habit {i}', 'frequency': frequency})
+                habit_id = json.loads(response.data)['id']
+                days = sorted(rng.sample(range(500), 300))
+                records = [{'habit_id': habit_id, 'completed_on': (start + datetime.timedelta(days=day)).isoformat(), 'completed': True} for day in days]
+                self.app.post('/habits/completions/batch', headers={'Authorization': f'Bearer {self.token}'}, json=records)
+        finally:
+            app.config['COMPLETION_BITMAPS'] = False
+
+        user = User.query.filter_by(username='testuser').first()
+        today = start + datetime.timedelta(days=499)
+        streaks = compute_bitmap_streaks(user.id, today=today)
+        self.assertEqual(len(streaks), 4)
+        for habit_id, (longest, current) in streaks.items():
+            streak = db.session.get(HabitStreak, habit_id)
+            frequency = db.session.get(Habit, habit_id).frequency
+            expected = live_current_length(streak.current_length, streak.last_completed_on, frequency, today)
+            self.assertEqual((longest, current), (streak.longest_length, expected))
+
+        # Converting the rows from scratch yields the same bitmaps
+        before = {(bitmap.habit_id, bitmap.year): bitmap.bits for bitmap in HabitBitmap.query.all()}
+        result = app.test_cli_runner().invoke(args=['build-bitmaps'])
+        self.assertEqual(result.exit_code, 0)
+        db.session.expire_all()
+        self.assertEqual({(bitmap.habit_id, bitmap.year): bitmap.bits for bitmap in HabitBitmap.query.all()}, before)
+
+    def test_sql_engine_matches_streak_table(self):
+        """Test on random histories that the gaps-and-islands SQL engine agrees with the stored streak state."""
+        import datetime
+        import random
+        from sql_analytics import compute_sql_streaks
+        from streaks import live_current_length, rebuild_all_streaks
+        from models import HabitStreak
+
+        rng = random.Random(6)
+        user = User.query.filter_by(username='testuser').first()
+        start = datetime.date(2023, 12, 1)
+        habits = [Habit(name=f'Habit {i}', frequency=rng.choice(['Daily', 'Weekly']), user_id=user.id) for i in range(12)]
+        db.session.add_all(habits)
+        db.session.flush()
+        for habit in habits[1:]:
+            for day in rng.sample(range(150), rng.randint(1, 120)):
+                db.session.add(HabitCompletion(habit_id=habit.id, completed_on=start + datetime.timedelta(days=day), completed=rng.random() < 0.9))
+        db.session.commit()
+        rebuild_all_streaks()
+
+        today = start + datetime.timedelta(days=149)
+        streaks = compute_sql_streaks(user.id, today=today)
+        self.assertEqual(streaks[habits[0].id], (0, 0))
+        for habit in habits[1:]:
+            streak = db.session.get(HabitStreak, habit.id)
+            current = live_current_length(streak.current_length, streak.last_completed_on, habit.frequency, today)
+            self.assertEqual(streaks[habit.id], (streak.longest_length, current))
+
+        app.config['STREAK_ENGINE'] = 'sql'
+        try:
+            # One statement for the ETag data version, one for the streaks
+            self.assertEqual(self.count_statements(f'/habits/analytics/longest_streak/{habits[1].id}'), 2)
+            response = self.app.get('/habits/analytics/longest_streak', headers={'Authorization': f'Bearer {self.token}'})
+        finally:
+            app.config['STREAK_ENGINE'] = 'table'
+        self.assertEqual(json.loads(response.data)['longest_streak'], max(longest for longest, _ in streaks.values()))
+
+    def test_get_habits_query_count(self):
+        """Test that the user id is read from the token instead of the users table."""
+        # One query for the data version behind the ETag, one for the habits
+        self.assertEqual(self.count_statements('/habits'), 2)
+
+    def test_token_without_user_id_claim(self):
+        """Test that tokens issued before the user id claim resolve through the identity cache."""
+        from flask_jwt_extended import create_access_token
+        from auth import identity_cache
+
+        identity_cache.clear()
+        token = create_access_token(identity='testuser')
+        self.assertEqual(self.count_statements('/habits', token), 3)
+        # The username is now cached, and so is the response: only the data version is read
+        self.assertEqual(self.count_statements('/habits', token), 1)
+
+        # Renaming the user drops the cached entry
+        user = User.query.filter_by(username='testuser').first()
+        user.username = 'renamed'
+        db.session.commit()
+        response = self.app.get('/habits', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_token_of_deleted_user_is_rejected(self):
+        """Test that tokens expire and stop working once their user is deleted, even if the id is reused."""
+        from flask_jwt_extended import decode_token
+
+        headers = {'Authorization': f'Bearer {self.token}'}
+        self.assertIn('exp', decode_token(self.token))
+        self.assertEqual(self.app.get('/habits', headers=headers).status_code, 200)
+        user = User.query.filter_by(username='testuser').first()
+        user_id, password = user.id, user.password
+        # Delete with a bulk statement, as another process would: no ORM event reaches this process
+        db.session.execute(db.delete(User).filter(User.id == user_id))
+        db.session.commit()
+        db.session.expunge_all()
+        self.assertEqual(self.app.get('/habits', headers=headers).status_code, 401)
+        self.assertEqual(self.app.get('/sync', headers=headers).status_code, 401)
+
+        # An account that reuses the id under another name does not inherit the token
+        db.session.add(User(id=user_id, username='someoneelse', email='else@example.com', password=password))
+        db.session.commit()
+        self.assertEqual(self.app.get('/habits', headers=headers).status_code, 401)
+        self.assertEqual(self.app.get('/sync', headers=headers).status_code, 401)
+        response = self.app.post('/habits', json={'name': 'Stolen', 'frequency': 'Daily'}, headers=headers)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(Habit.query.filter_by(user_id=user_id).count(), 0)
+        self.assertEqual(db.session.get(User, user_id).data_version, 0)
+
+    def test_login_sheds_load_when_hash_pool_is_full(self):
+        """Test that password checks answer 503 instead of queueing when the hashing pool is saturated."""
+        from auth import hash_pool
+
+        hash_pool.configure(workers=1, max_pending=1)
+        hash_pool._slots.acquire()  # occupy the only slot
+        try:
+            response = self.app.post('/login', json={'username': 'testuser', 'password': 'password'})
+        finally:
+            hash_pool.configure(app.config['BCRYPT_POOL_WORKERS'], app.config['BCRYPT_POOL_MAX_PENDING'])
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('habit_hash_pool_pending 0', response.get_data(as_text=True))
+        self.assertRegex(response.get_data(as_text=True), r'habit_hash_pool_rejected_total [1-9]')
+
+    def test_hash_pool_can_be_reconfigured_while_jobs_run(self):
+        """Test that a job started before the pool was resized releases its slot without errors."""
+        from auth import HashPool
+
+        pool = HashPool(workers=1, max_pending=1)
+        started, finish = threading.Event(), threading.Event()
+        results = []
+
+        def job():
+            started.set()
+            finish.wait(5)
+            return 'done'
+
+        worker = threading.Thread(target=lambda: results.append(pool.run(job)))
+        worker.start()
+        self.assertTrue(started.wait(5))
+        pool.configure(workers=2, max_pending=2)
+        finish.set()
+        worker.join(5)
+        self.assertEqual(results, ['done'])
+        self.assertEqual(pool.stats()['pending'], 0)
+        self.assertEqual(pool.run(lambda: 'after'), 'after')
+
+    def test_conditional_get_with_etag(self):
+        """Test that an unchanged listing answers If-None-Match with 304 and writes change the ETag."""
+        for path in ['/habits', '/habits/completions', '/habits/analytics/longest_streak']:
+            response = self.app.get(path, headers={'Authorization': f'Bearer {self.token}'})
+            etag = response.headers['ETag']
+            self.assertFalse(etag.startswith('W/'))
+
+            # A 304 only looks up the data version
+            self.assertEqual(self.count_statements(path, headers={'If-None-Match': etag}, status_code=304), 1)
+
+        self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Test Habit', 'frequency': 'Daily'})
+        response = self.app.get(path, headers={'Authorization': f'Bearer {self.token}', 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_generate_dataset(self):
+        """Test that the synthetic data generator creates users x habits with completions."""
+        from datagen import generate_dataset
+
+        user_ids, habit_count, completion_count = generate_dataset(3, 4, 60, 'hash', seed=1)
+        self.assertEqual((len(user_ids), habit_count), (3, 12))
+        self.assertEqual(HabitCompletion.query.count(), completion_count)
+        self.assertGreater(HabitCompletion.query.filter_by(completed=True).count(), 0)
+        weekly = Habit.query.filter_by(frequency='Weekly').first()
+        weekdays = {completion.completed_on.weekday() for completion in HabitCompletion.query.filter_by(habit_id=weekly.id)}
+        self.assertEqual(len(weekdays), 1)
+
+    def test_seed_command(self):
+        """Test seeding users, habits and completions from the CLI, with a sync floor and the derived state."""
+        from flask_jwt_extended import create_access_token
+        from models import ChangeLog, HabitStreak, LeaderboardEntry
+
+        # A habit of an existing user whose streak state went stale is left alone by the seed's rebuild
+        response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Run', 'frequency': 'Daily'})
+        own_habit_id = json.loads(response.data)['id']
+        self.app.post(f'/habits/{own_habit_id}/completions', headers={'Authorization': f'Bearer {self.token}'}, json={'completed_on': '2024-10-01', 'completed': True})
+        db.session.delete(db.session.get(HabitStreak, own_habit_id))
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['seed', '--users', '2', '--habits', '3', '--days', '30', '--prefix', 'seeded', '--chunk-size', '7'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('rows/s', result.output)
+        seeded = User.query.filter(User.username.like('seeded%')).order_by(User.id).all()
+        self.assertEqual(len(seeded), 2)
+        self.assertEqual(Habit.query.count(), 7)
+        self.assertEqual(HabitStreak.query.count(), 6)
+        self.assertIsNone(db.session.get(HabitStreak, own_habit_id))
+        # No change log rows for the seeded data: syncing from 0 asks for a full refetch instead
+        self.assertEqual(ChangeLog.query.filter(ChangeLog.user_id.in_([user.id for user in seeded])).count(), 0)
+        self.assertTrue(all(user.sync_floor > 0 for user in seeded))
+        token = create_access_token(identity=seeded[0].username, additional_claims={'uid': seeded[0].id})
+        response = self.app.get('/sync?since=0', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 410)
+        seq = json.loads(response.data)['seq']
+        self.assertEqual(seq, seeded[0].sync_floor)
+        response = self.app.get(f'/sync?since={seq}', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(json.loads(response.data)['changes'], [])
+        self.assertLessEqual({user.id for user in seeded}, {entry.user_id for entry in LeaderboardEntry.query})
+        self.assertEqual([user.data_version for user in seeded], [1, 1])
+
+    def test_migrations_match_models(self):
+        """Test that the migrations build the schema of the models and deduplicate existing check-ins."""
+        import os
+        import sqlite3
+        import subprocess
+        import sys
+        import tempfile
+
+        path = os.path.join(tempfile.mkdtemp(), 'migrations.db')
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}')
+
+        def flask(*args):
+            result = subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'db', *args], env=env, cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stderr)
+
+        flask('upgrade', 'a6d3408648fd')
+        with sqlite3.connect(path) as connection:
+            connection.executescript("""
+                INSERT INTO user VALUES (1, 'old', 'old@example.com', 'x');
+                INSERT INTO habit VALUES (1, 'Run', NULL, 'Daily', NULL, 1);
+                INSERT INTO habit_completion VALUES (1, 1, '2024-01-01', 0), (2, 1, '2024-01-01', 1);
+            """)
+        flask('upgrade')
+        flask('check')
+        with sqlite3.connect(path) as connection:
+            self.assertEqual(connection.execute('SELECT id, completed FROM habit_completion').fetchall(), [(2, 1)])
+            self.assertEqual(connection.execute('SELECT sync_floor FROM user').fetchall(), [(1,)])
+            self.assertEqual(connection.execute('SELECT COUNT(*) FROM change_log').fetchone(), (0,))
+
+    def test_reads_are_routed_to_the_replica(self):
+        """Test that GET requests read from the replica except shortly after the user wrote."""
+        from sqlalchemy import create_engine
+        from sqlalchemy.pool import StaticPool
+        from flask_jwt_extended import create_access_token
+        from routing import recent_writes
+
+        # A second in-memory database stands in for a replica that has not caught up yet
+        replica = create_engine('sqlite://', poolclass=StaticPool)
+        db.metadata.create_all(replica)
+        user = User.query.filter_by(username='testuser').first()
+        with replica.begin() as connection:
+            connection.execute(db.insert(User).values(id=user.id, username=user.username, email=user.email, password=user.password))
+        db.engines['replica'] = replica
+        try:
+            response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Test Habit', 'frequency': 'Daily'})
+            self.assertEqual(response.status_code, 201)
+            response = self.app.get('/habits', headers={'Authorization': f'Bearer {self.token}'})
+            self.assertEqual([habit['name'] for habit in json.loads(response.data)], ['Test Habit'])
+
+            recent_writes.clear()
+            db.session.remove()
+            response = self.app.get('/habits', headers={'Authorization': f'Bearer {self.token}'})
+            self.assertEqual(json.loads(response.data), [])
+
+            # Tokens without a uid claim stick to the primary after a write as well
+            token = create_access_token(identity='testuser')
+            self.app.put(f"/habits/{Habit.query.first().id}", headers={'Authorization': f'Bearer {token}'}, json={'name': 'Renamed'})
+            response = self.app.get('/habits', headers={'Authorization': f'Bearer {token}'})
+            self.assertEqual([habit['name'] for habit in json.loads(response.data)], ['Renamed'])
+
+            # An account the replica has not seen yet is read from the primary instead of rejected
+            recent_writes.clear()
+            caching.response_cache.clear()
+            with replica.begin() as connection:
+                connection.execute(db.delete(User))
+            response = self.app.get('/habits', headers={'Authorization': f'Bearer {self.token}'})
+            self.assertEqual([habit['name'] for habit in json.loads(response.data)], ['Renamed'])
+        finally:
+            del db.engines['replica']
+            db.session.remove()
+            replica.dispose()
+
+    def test_response_cache(self):
+        """Test that read routes are served from the response cache until the user writes."""
+        response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Test Habit', 'frequency': 'Daily'})
+        habit_id = json.loads(response.data)['id']
+        first = self.app.get('/habits/analytics/summary', headers={'Authorization': f'Bearer {self.token}'})
+        # A hit only reads the data version; query parameter order does not matter
+        self.assertEqual(self.count_statements('/habits/analytics/summary'), 1)
+        self.count_statements('/habits?limit=5&fields=name')
+        self.assertEqual(self.count_statements('/habits?fields=name&limit=5'), 1)
+        self.assertEqual(caching.response_cache.stats()['entries'], 2)
+
+        self.app.post(f'/habits/{habit_id}/completions', headers={'Authorization': f'Bearer {self.token}'}, json={'completed_on': '2024-10-01', 'completed': True})
+        self.assertEqual(caching.response_cache.stats()['entries'], 0)
+        second = self.app.get('/habits/analytics/summary', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertNotEqual(first.get_data(), second.get_data())
+
+        metrics = self.app.get('/metrics').get_data(as_text=True)
+        self.assertIn('habit_response_cache_hits_total 2', metrics)
+
+        # The memory backend evicts the least recently used responses to stay within its size
+        backend = caching.MemoryCacheBackend(max_bytes=10)
+        backend.set(1, 'a', (b'12345', 200, []))
+        backend.set(2, 'b', (b'12345', 200, []))
+        backend.get(1, 'a')
+        backend.set(1, 'c', (b'123', 200, []))
+        self.assertIsNone(backend.get(2, 'b'))
+        self.assertIsNotNone(backend.get(1, 'a'))
+        self.assertEqual(backend.stats()['evictions'], 1)
+
+        # A backend missing part of the interface fails when it is created
+        class PartialBackend(caching.CacheBackend):
+            def get(self, user_id, key):
+                return None
+
+        with self.assertRaises(TypeError):
+            PartialBackend()
+
+    def test_request_instrumentation(self):
+        """Test the Server-Timing header, the request histograms and the slow request log."""
+        response = self.app.get('/habits', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertRegex(response.headers['Server-Timing'], r'^app;dur=[0-9.]+, db;dur=[0-9.]+;desc="2 queries"$')
+
+        metrics = self.app.get('/metrics').get_data(as_text=True)
+        self.assertIn('habit_request_duration_seconds_count{route="/habits",method="GET"}', metrics)
+        self.assertIn('habit_request_sql_statements_bucket{route="/habits",method="GET",le="2"}', metrics)
+
+        app.config['SLOW_REQUEST_MS'] = 0.001
+        try:
+            with self.assertLogs('metrics', level='WARNING') as logs:
+                self.app.get('/habits?fields=name', headers={'Authorization': f'Bearer {self.token}'})
+        finally:
+            app.config['SLOW_REQUEST_MS'] = 500
+        self.assertIn('FROM habit', logs.output[0])
+
+    def test_export_completions(self):
+        """Test exporting completions as NDJSON and CSV with date and habit filters."""
+        response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Test Habit', 'frequency': 'Daily'})
+        habit_id = json.loads(response.data)['id']
+        records = [{'habit_id': habit_id, 'completed_on': f'2024-10-{day:02d}', 'completed': day % 2 == 0} for day in range(1, 11)]
+        self.app.post('/habits/completions/batch', headers={'Authorization': f'Bearer {self.token}'}, json=records)
+
+        response = self.app.get('/habits/completions/export?from=2024-10-03&to=2024-10-05', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(lines, [{'habit_id': habit_id, 'completed_on': f'2024-10-0{day}', 'completed': day % 2 == 0} for day in (3, 4, 5)])
+
+        response = self.app.get(f'/habits/completions/export?format=csv&habit_id={habit_id}', headers={'Authorization': f'Bearer {self.token}'})
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(lines[0], 'habit_id,completed_on,completed')
+        self.assertEqual(lines[1], f'{habit_id},2024-10-01,false')
+        self.assertEqual(len(lines), 11)
+
+        response = self.app.get('/habits/completions/export?from=10/03/2024', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_memory_is_bounded(self):
+        """Test that exporting a million completions keeps peak memory flat."""
+        import datetime
+        import tracemalloc
+
+        user = User.query.filter_by(username='testuser').first()
+        habits = [Habit(name=f'Habit {i}', frequency='Daily', user_id=user.id) for i in range(100)]
+        db.session.add_all(habits)
+        db.session.commit()
+        start = datetime.date(1990, 1, 1)
+        db.session.execute(db.insert(HabitCompletion), [
+            {'habit_id': habits[0].id, 'completed_on': start + datetime.timedelta(days=day), 'completed': True} for day in range(10000)
+        ])
+        # Copy the first habit's history to the other 99 in SQL
+        db.session.execute(db.insert(HabitCompletion).from_select(
+            ['habit_id', 'completed_on', 'completed'],
+            db.select(Habit.id, HabitCompletion.completed_on, HabitCompletion.completed)
+            .join(HabitCompletion, HabitCompletion.habit_id == habits[0].id)
+            .filter(Habit.id != habits[0].id),
+        ))
+        db.session.commit()
+        self.assertEqual(HabitCompletion.query.count(), 1000000)
+
+        response = self.app.get('/habits/completions/export', headers={'Authorization': f'Bearer {self.token}'})
+        tracemalloc.start()
+        try:
+            size = sum(len(chunk) for chunk in response.response)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            response.close()
+        self.assertGreater(size, 50 * 1000 * 1000)  # ~60 MB of NDJSON went through
+        self.assertLess(peak, 5 * 1024 * 1024)
+
+    def test_cursor_pagination_and_fields(self):
+        """Test keyset pagination, sparse fields and date filters on the listings."""
+        habit_ids = []
+        for i in range(3):
+            response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': f'Habit {i}', 'frequency': 'Daily'})
+            habit_ids.append(json.loads(response.data)['id'])
+        records = [{'habit_id': habit_id, 'completed_on': f'2024-10-{day:02d}', 'completed': True} for habit_id in habit_ids for day in range(1, 6)]
+        self.app.post('/habits/completions/batch', headers={'Authorization': f'Bearer {self.token}'}, json=records)
+
+        pages = []
+        path = '/habits/completions?limit=4&fields=habit_id,completed_on&from=2024-10-02'
+        while path:
+            response = self.app.get(path, headers={'Authorization': f'Bearer {self.token}'})
+            self.assertEqual(response.status_code, 200)
+            pages.append(json.loads(response.data))
+            cursor = response.headers.get('X-Next-Cursor')
+            path = f'/habits/completions?limit=4&fields=habit_id,completed_on&from=2024-10-02&cursor={cursor}' if cursor else None
+        self.assertEqual([len(page) for page in pages], [4, 4, 4])
+        rows = [row for page in pages for row in page]
+        self.assertEqual(rows, [{'habit_id': habit_id, 'completed_on': f'2024-10-{day:02d}'} for habit_id in habit_ids for day in range(2, 6)])
+
+        response = self.app.get('/habits?limit=2&fields=name', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(json.loads(response.data), [{'name': 'Habit 0'}, {'name': 'Habit 1'}])
+        self.assertIn('rel="next"', response.headers['Link'])
+        response = self.app.get(f"/habits?limit=2&fields=name&cursor={response.headers['X-Next-Cursor']}", headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(json.loads(response.data), [{'name': 'Habit 2'}])
+        self.assertNotIn('X-Next-Cursor', response.headers)
+
+        for path in ['/habits?fields=password', '/habits/analytics/all?limit=0', '/habits/completions?cursor=bogus']:
+            response = self.app.get(path, headers={'Authorization': f'Bearer {self.token}'})
+            self.assertEqual(response.status_code, 400)
+
+    def test_completion_rate_buckets(self):
+        """Test SQL-side completion rates per week and month, rolling windows and the user scope."""
+        response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Daily', 'frequency': 'Daily'})
+        daily_id = json.loads(response.data)['id']
+        response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Weekly', 'frequency': 'Weekly'})
+        weekly_id = json.loads(response.data)['id']
+        records = [{'habit_id': daily_id, 'completed_on': f'2024-10-{day:02d}', 'completed': True} for day in range(1, 11) if day != 5]
+        records += [{'habit_id': weekly_id, 'completed_on': day, 'completed': True} for day in ['2024-10-21', '2024-10-27', '2024-10-28']]
+        self.app.post('/habits/completions/batch', headers={'Authorization': f'Bearer {self.token}'}, json=records)
+
+        response = self.app.get(f'/habits/analytics/completion_rate?bucket=week&window=2&from=2024-09-30&to=2024-10-13&habit_id={daily_id}', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(json.loads(response.data), [
+            {'habit_id': daily_id, 'bucket': '2024-09-30', 'completed': 5, 'expected': 7, 'rate': 0.7143, 'rolling_rate': 0.7143},
+            {'habit_id': daily_id, 'bucket': '2024-10-07', 'completed': 4, 'expected': 7, 'rate': 0.5714, 'rolling_rate': 0.6429},
+        ])
+
+        # Weekly habits owe one check-in per week: two of October's four Mondays were covered
+        response = self.app.get('/habits/analytics/completion_rate?bucket=month&from=2024-10-01&to=2024-10-31', headers={'Authorization': f'Bearer {self.token}'})
+        rates = {row['habit_id']: (row['completed'], row['expected']) for row in json.loads(response.data)}
+        self.assertEqual(rates, {daily_id: (9, 31), weekly_id: (2, 4)})
+
+        response = self.app.get('/habits/analytics/completion_rate?bucket=month&scope=user&from=2024-10-01&to=2024-10-31', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(json.loads(response.data), [{'bucket': '2024-10-01', 'completed': 11, 'expected': 35, 'rate': 0.3143, 'rolling_rate': 0.3143}])
+
+        for query in ['bucket=year', 'window=0', 'window=two', 'scope=team', 'bucket=day&from=2000-01-01']:
+            response = self.app.get(f'/habits/analytics/completion_rate?{query}', headers={'Authorization': f'Bearer {self.token}'})
+            self.assertEqual(response.status_code, 400)
+
+    def test_malformed_habit_id_is_rejected(self):
+        """Test that a habit_id filter that is not an integer answers 400 instead of listing every habit."""
+        for path in ['/habits/completions', '/habits/completions/export', '/habits/analytics/completion_rate', '/habits/analytics/heatmap']:
+            response = self.app.get(f'{path}?habit_id=x', headers={'Authorization': f'Bearer {self.token}'})
+            self.assertEqual(response.status_code, 400, path)
+            self.assertEqual(json.loads(response.data), {'message': 'habit_id must be an integer'})
+
+    def test_weekly_completion_rate_counts_the_whole_last_week(self):
+        """Test that a weekly check-in made after a range ending mid-week counts in the bucket of its week's Monday."""
+        response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Weekly', 'frequency': 'Weekly'})
+        habit_id = json.loads(response.data)['id']
+        # Friday of the week starting Monday 2024-10-28
+        self.app.post(f'/habits/{habit_id}/completions', headers={'Authorization': f'Bearer {self.token}'}, json={'completed_on': '2024-11-01', 'completed': True})
+
+        for query, expected in [
+            ('bucket=week&from=2024-10-28&to=2024-10-30', [('2024-10-28', 1, 1)]),
+            ('bucket=day&from=2024-10-27&to=2024-10-28', [('2024-10-27', 0, 0), ('2024-10-28', 1, 1)]),
+            ('bucket=month&from=2024-10-01&to=2024-10-15', [('2024-10-01', 1, 4)]),
+        ]:
+            response = self.app.get(f'/habits/analytics/completion_rate?{query}', headers={'Authorization': f'Bearer {self.token}'})
+            self.assertEqual([(row['bucket'], row['completed'], row['expected']) for row in json.loads(response.data)], expected, query)
+
+    def test_delta_sync(self):
+        """Test that /sync returns changes after a seq, tombstones deletes and answers 410 after compaction."""
+        response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Read', 'frequency': 'Daily'})
+        habit_id = json.loads(response.data)['id']
+        self.app.post(f'/habits/{habit_id}/completions', headers={'Authorization': f'Bearer {self.token}'}, json={'completed_on': '2024-10-01', 'completed': True})
+
+        response = self.app.get('/sync?since=0&limit=1', headers={'Authorization': f'Bearer {self.token}'})
+        page = json.loads(response.data)
+        self.assertEqual([(c['entity'], c['op'], c['data']['name']) for c in page['changes']], [('habit', 'create', 'Read')])
+        self.assertTrue(page['has_more'])
+
+        self.app.delete(f'/habits/{habit_id}', headers={'Authorization': f'Bearer {self.token}'})
+        response = self.app.get(f"/sync?since={page['seq']}", headers={'Authorization': f'Bearer {self.token}'})
+        page = json.loads(response.data)
+        self.assertEqual([(c['entity'], c['id'], c['op'], c['data']) for c in page['changes']], [
+            ('completion', habit_id, 'upsert', {'completed_on': '2024-10-01', 'completed': True}),
+            ('habit', habit_id, 'delete', None),
+        ])
+        self.assertFalse(page['has_more'])
+
+        for query in ['since=abc', 'since=-1', 'limit=all']:
+            response = self.app.get(f'/sync?{query}', headers={'Authorization': f'Bearer {self.token}'})
+            self.assertEqual(response.status_code, 400, query)
+
+        # An up-to-date client costs a single query
+        self.assertEqual(self.count_statements(f"/sync?since={page['seq']}"), 1)
+
+        result = app.test_cli_runner().invoke(args=['compact-changelog', '--days', '0'])
+        self.assertIn('Removed 3', result.output)
+        response = self.app.get('/sync?since=1', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(json.loads(response.data)['seq'], page['seq'])
+        response = self.app.get(f"/sync?since={page['seq']}", headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(json.loads(response.data), {'changes': [], 'seq': page['seq'], 'has_more': False})
+
+    def test_writes_lock_the_user_before_logging_changes(self):
+        """Test that every write bumps the user's data version before it allocates change log seqs."""
+        from sqlalchemy import event
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Read', 'frequency': 'Daily'})
+            habit_id = json.loads(response.data)['id']
+            self.app.post(f'/habits/{habit_id}/completions', headers={'Authorization': f'Bearer {self.token}'}, json={'completed_on': '2024-10-01', 'completed': True})
+            self.app.post('/habits/completions/batch', headers={'Authorization': f'Bearer {self.token}'}, json=[{'habit_id': habit_id, 'completed_on': '2024-10-02', 'completed': True}])
+            self.app.put(f'/habits/{habit_id}', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Read more'})
+            self.app.delete(f'/habits/{habit_id}', headers={'Authorization': f'Bearer {self.token}'})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+        writes = ['lock' if statement.startswith('UPDATE user ') else 'log'
+                  for statement in statements if statement.startswith(('UPDATE user ', 'INSERT INTO change_log'))]
+        self.assertEqual(writes, ['lock', 'log'] * 5)
+
+    def test_create_app(self):
+        """Test that create_app builds an independent app whose settings override the environment."""
+        from app import create_app
+        other = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:', 'MAX_PAGE_SIZE': 2, 'CLI_COMMANDS': False})
+        self.assertIn('seed', app.cli.commands)
+        self.assertNotIn('seed', other.cli.commands)
+        with other.app_context():
+            db.create_all()
+            client = other.test_client()
+            client.post('/register', json={'username': 'other', 'email': 'other@example.com', 'password': 'password'})
+            token = client.post('/login', json={'username': 'other', 'password': 'password'}).get_json()['access_token']
+            for i in range(3):
+                client.post('/habits', headers={'Authorization': f'Bearer {token}'}, json={'name': f'Habit {i}', 'frequency': 'Daily'})
+            response = client.get('/habits?limit=5', headers={'Authorization': f'Bearer {token}'})
+            self.assertEqual(len(response.get_json()), 2)
+            db.drop_all()
+        self.assertEqual(db.session.scalar(db.select(db.func.count(Habit.id))), 0)
+
+    def test_archived_completions_keep_streaks_and_rates(self):
+        """Test that archiving old months into rollups changes neither streaks, completion rates nor listings."""
+        import datetime
+        from models import CompletionRollup, HabitStreak
+        from rollups import archive_completions
+        from analytics import compute_habit_stats
+        from sql_analytics import compute_sql_streaks, completion_rates
+        from utils import user_completions_query
+
+        # Without archiving, reads never look at the rollups
+        self.assertNotIn('UNION', str(user_completions_query(1)))
+        # Archive the months before 2024-10; ranges from the cutoff on still read the table alone
+        app.config['ARCHIVE_AFTER_DAYS'] = (datetime.date.today() - datetime.date(2024, 10, 15)).days
+        self.addCleanup(app.config.__setitem__, 'ARCHIVE_AFTER_DAYS', 0)
+        self.assertNotIn('UNION', str(user_completions_query(1, date_from=datetime.date(2024, 10, 1))))
+        self.assertIn('UNION', str(user_completions_query(1, date_from=datetime.date(2024, 9, 30))))
+
+        response = self.app.post('/habits', headers={'Authorization': f'Bearer {self.token}'}, json={'name': 'Run', 'frequency': 'Daily'})
+        habit_id = json.loads(response.data)['id']
+        records = [{'habit_id': habit_id, 'completed_on': day, 'completed': True}
+                   for day in ['2024-09-05', '2024-09-25', '2024-09-26', '2024-09-27', '2024-09-28', '2024-09-29', '2024-09-30', '2024-10-01', '2024-10-02']]
+        records.append({'habit_id': habit_id, 'completed_on': '2024-09-10', 'completed': False})
+        self.app.post('/habits/completions/batch', headers={'Authorization': f'Bearer {self.token}'}, json=records)
+        user_id = db.session.get(Habit, habit_id).user_id
+
+        def analytics():
+            return (compute_sql_streaks(user_id), compute_habit_stats(user_id),
+                    completion_rates(user_id, 'month', datetime.date(2024, 9, 1), datetime.date(2024, 10, 31)))
+
+        def listings():
+            headers = {'Authorization': f'Bearer {self.token}'}
+            listing = self.app.get('/habits/completions', headers=headers)
+            export = self.app.get('/habits/completions/export?format=csv', headers=headers)
+            return listing.headers['ETag'], json.loads(listing.data), export.get_data(as_text=True)
+
+        before = analytics()
+        etag, listing, export = listings()
+        self.assertEqual(len(listing), 10)
+        self.assertEqual(archive_completions(datetime.date(2024, 10, 15)), (8, 1))
+        self.assertEqual(db.session.query(HabitCompletion).count(), 2)
+        rollup = db.session.get(CompletionRollup, (habit_id, datetime.date(2024, 9, 1)))
+        self.assertEqual((rollup.completed_count, rollup.missed_count, rollup.missed_days), (7, 1, 1 << 9))
+        self.assertEqual(analytics(), before)
+        # Archived days, missed ones included, are still listed and exported; the ETag changes with the rewrite
+        new_etag, *after = listings()
+        self.assertEqual(after, [listing, export])
+        self.assertNotEqual(new_etag, etag)
+        app.test_cli_runner().invoke(args=['rebuild-streaks'])
+        self.assertEqual(db.session.get(HabitStreak, habit_id).longest_length, 8)
+
+        # A backfilled day of an archived month counts right away and is folded in by the next run
+        self.app.post(f'/habits/{habit_id}/completions', headers={'Authorization': f'Bearer {self.token}'}, json={'completed_on': '2024-09-24', 'completed': True})
+        response = self.app.get(f'/habits/analytics/longest_streak/{habit_id}', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(json.loads(response.data)['longest_streak'], 9)
+        self.assertEqual(archive_completions(datetime.date(2024, 10, 15)), (1, 1))
+        self.assertEqual(compute_sql_streaks(user_id, habit_id)[habit_id][0], 9)
+
+    def test_leaderboard(self):
+        """Test that the top-N leaderboards follow completion writes, leave out lapsed runs and match a full rebuild."""
+        import datetime
+        from sqlalchemy import event
+        from models import LeaderboardEntry
+
+        app.config['LEADERBOARD_SIZE'] = 2
+        self.addCleanup(app.config.__setitem__, 'LEADERBOARD_SIZE', 100)
+        tokens = {'testuser': self.token}
+        for username in ['runner', 'swimmer', 'walker']:
+            self.app.post('/register', json={'username': username, 'email': f'{username}@example.com', 'password': 'password'})
+            tokens[username] = json.loads(self.app.post('/login', json={'username': username, 'password': 'password'}).data)['access_token']
+
+        def check_in(username, frequency, days, step=1, last_day=None):
+            headers = {'Authorization': f'Bearer {tokens[username]}'}
+            habit_id = json.loads(self.app.post('/habits', headers=headers, json={'name': frequency, 'frequency': frequency}).data)['id']
+            last_day = last_day or datetime.date.today()
+            records = [{'habit_id': habit_id, 'completed_on': (last_day - datetime.timedelta(days=day * step)).isoformat(), 'completed': True} for day in range(days)]
+            self.app.post('/habits/completions/batch', headers=headers, json=records)
+            return habit_id, records
+
+        def leaderboard(query=''):
+            response = self.app.get(f'/leaderboard{query}', headers={'Authorization': f'Bearer {self.token}'})
+            return [(row['rank'], row['username'], row['streak']) for row in json.loads(response.data)]
+
+        check_in('testuser', 'Daily', 3)
+        check_in('runner', 'Daily', 5)
+        check_in('swimmer', 'Weekly', 2, step=7)
+        self.assertEqual(leaderboard(), [(1, 'runner', 5), (2, 'testuser', 3)])
+        self.assertEqual(leaderboard('?frequency=Weekly&metric=current'), [(1, 'swimmer', 2)])
+
+        # Climbing onto a full board pushes the lowest entry off
+        check_in('swimmer', 'Daily', 4)
+        self.assertEqual(leaderboard(), [(1, 'runner', 5), (2, 'swimmer', 4)])
+        response = self.app.get('/leaderboard?limit=1', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(leaderboard(f"?limit=1&cursor={response.headers['X-Next-Cursor']}"), [(2, 'swimmer', 4)])
+
+        # A long run from years ago tops the longest board but is no current streak
+        habit_id, records = check_in('walker', 'Daily', 6, last_day=datetime.date(2022, 1, 31))
+        self.assertEqual(leaderboard(), [(1, 'walker', 6), (2, 'runner', 5)])
+        self.assertEqual(leaderboard('?metric=current'), [(1, 'runner', 5), (2, 'swimmer', 4)])
+
+        # Recording a check-in again changes no streak, so the boards are not even read
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            self.app.post(f'/habits/{habit_id}/completions', headers={'Authorization': f'Bearer {tokens["walker"]}'},
+                          json={'completed_on': records[0]['completed_on'], 'completed': True})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertFalse([statement for statement in statements if 'leaderboard_entry' in statement])
+
+        # A current streak that lapses after it was written drops off without another write
+        db.session.execute(db.update(LeaderboardEntry).filter_by(metric='current', user_id=2).values(expires_on=datetime.date.today()))
+        db.session.commit()
+        caching.response_cache.clear()
+        self.assertEqual(leaderboard('?metric=current'), [(1, 'swimmer', 4)])
+
+        result = app.test_cli_runner().invoke(args=['rebuild-leaderboard'])
+        self.assertIn('Wrote 10 leaderboard entries', result.output)
+        self.assertEqual(leaderboard(), [(1, 'walker', 6), (2, 'runner', 5)])
+        self.assertEqual(leaderboard('?frequency=Daily&metric=current'), [(1, 'runner', 5), (2, 'swimmer', 4)])
+
+        response = self.app.get('/leaderboard?metric=best', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_event_stream(self):
+        """Test that /events pushes habit, completion and streak events, heartbeats and resumes from Last-Event-ID."""
+        import datetime
+        app.config.update(EVENTS_HEARTBEAT_SECONDS=0.05, EVENTS_MAX_STREAMS=1)
+        self.addCleanup(app.config.update, EVENTS_HEARTBEAT_SECONDS=15, EVENTS_MAX_STREAMS=100)
+        headers = {'Authorization': f'Bearer {self.token}'}
+
+        def events(chunk):
+            parsed = []
+            for block in chunk.decode().strip().split('\n\n'):
+                fields = dict(line.split(': ', 1) for line in block.split('\n') if line.startswith(('id: ', 'event: ', 'data: ')))
+                parsed.append((fields.get('id'), fields.get('event'), json.loads(fields['data'])))
+            return parsed
+
+        response = self.app.post('/habits', headers=headers, json={'name': 'Read', 'frequency': 'Daily'})
+        habit_id = json.loads(response.data)['id']
+        stream = self.app.get('/events', headers={**headers, 'Last-Event-ID': '0'}, buffered=False)
+        self.assertEqual(stream.mimetype, 'text/event-stream')
+        chunks = iter(stream.response)
+        self.assertTrue(next(chunks).startswith(b'retry: 50'))
+        self.assertEqual(events(next(chunks))[0][:2], ('1', 'habit.created'))
+
+        today = datetime.date.today().isoformat()
+        self.app.post(f'/habits/{habit_id}/completions', headers=headers, json={'completed_on': today, 'completed': True})
+        live = events(next(chunks))
+        self.assertEqual(live, [
+            ('2', 'completion.recorded', {'id': habit_id, 'data': {'completed_on': today, 'completed': True}}),
+            (None, 'streak.updated', {'habit_id': habit_id, 'longest_streak': 1, 'current_streak': 1}),
+        ])
+        self.assertEqual(next(chunks), b': heartbeat\n\n')
+
+        # One stream per process is allowed here, so a second is shed until the first closes
+        self.assertEqual(self.app.get('/events', headers=headers).status_code, 503)
+        stream.close()
+        stream = self.app.get('/events', headers={**headers, 'Last-Event-ID': '1'}, buffered=False)
+        chunks = iter(stream.response)
+        next(chunks)
+        self.assertEqual(events(next(chunks)), live)
+        stream.close()
+
+        response = self.app.get('/events', headers={**headers, 'Last-Event-ID': 'latest'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_heatmap(self):
+        """Test that the heatmap packs completed days and ISO weeks into base64 bits, from rows or bitmaps alike."""
+        import base64
+        import datetime
+        from bitmaps import heatmap
+
+        headers = {'Authorization': f'Bearer {self.token}'}
+        app.config['COMPLETION_BITMAPS'] = True
+        self.addCleanup(app.config.__setitem__, 'COMPLETION_BITMAPS', False)
+        habit_ids = []
+        for frequency, days in [('Daily', ['2023-12-31', '2024-01-01', '2024-03-01']), ('Weekly', ['2024-01-03', '2024-01-15', '2025-01-01'])]:
+            response = self.app.post('/habits', headers=headers, json={'name': frequency, 'frequency': frequency})
+            habit_ids.append(json.loads(response.data)['id'])
+            self.app.post('/habits/completions/batch', headers=headers,
+                          json=[{'habit_id': habit_ids[-1], 'completed_on': day, 'completed': True} for day in days])
+
+        response = self.app.get('/habits/analytics/heatmap?from=2024-01-01&to=2024-12-31', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.data)
+
+        def set_bits(encoded):
+            bits = int.from_bytes(base64.b64decode(encoded), 'little')
+            return [i for i in range(bits.bit_length()) if bits >> i & 1]
+
+        daily, weekly = body['daily'], body['weekly']
+        self.assertEqual((daily['start'], daily['length'], weekly['start'], weekly['length']), ('2024-01-01', 366, '2024-01-01', 53))
+        self.assertEqual(set_bits(daily['habits'][str(habit_ids[0])]), [0, 60])
+        self.assertEqual(set_bits(weekly['habits'][str(habit_ids[1])]), [0, 2, 52])  # 2025-01-01 lies in the week of 2024-12-30
+        self.assertEqual(len(daily['habits'][str(habit_ids[0])]), 64)  # 46 bytes for a year of days
+
+        # The bitmap store and the completion rows give the same maps
+        user_id = db.session.get(Habit, habit_ids[0]).user_id
+        from_bitmaps = heatmap(user_id, datetime.date(2023, 12, 20), datetime.date(2025, 1, 10))
+        app.config['COMPLETION_BITMAPS'] = False
+        self.assertEqual(heatmap(user_id, datetime.date(2023, 12, 20), datetime.date(2025, 1, 10)), from_bitmaps)
+
+        self.assertEqual(self.app.get('/habits/analytics/heatmap?from=2024-02-30', headers=headers).status_code, 400)
+        self.assertEqual(self.app.get('/habits/analytics/heatmap?from=2024-02-01&to=2024-01-01', headers=headers).status_code, 400)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,241 @@
+from extensions import db
+from flask import current_app
+from models import Habit, HabitCompletion, CompletionRollup
+from sqlalchemy import Date, Integer, String, and_, cast, func, literal, tuple_, type_coerce, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from itertools import groupby
+from operator import attrgetter
+import base64
+import datetime
+import json
+
+def dialect_name():
+    """Returns the name of the database dialect the session talks to."""
+    return db.session.get_bind().dialect.name
+
+def upsert_completions(rows):
+    """Inserts completion rows, updating the completed flag of existing (habit_id, completed_on) rows.
+
+    Uses INSERT ... ON CONFLICT DO UPDATE, which PostgreSQL and SQLite both
+    support, so retried or repeated check-ins never add rows. The rows must not
+    repeat a (habit_id, completed_on) pair.
+    """
+    insert = postgresql.insert if dialect_name() == 'postgresql' else sqlite.insert
+    statement = insert(HabitCompletion)
+    statement = statement.on_conflict_do_update(
+        index_elements=[HabitCompletion.habit_id, HabitCompletion.completed_on],
+        set_={'completed': statement.excluded.completed},
+    )
+    db.session.execute(statement, rows)
+
+def add_days(column, days):
+    """SQL expression for a date column plus an integer number of days."""
+    if dialect_name() == 'postgresql':
+        return column + days
+    return type_coerce(func.date(column, cast(days, String) + ' days'), Date)
+
+def archive_cutoff():
+    """Returns the first day the archiver leaves in the completion table, or None when archiving is disabled.
+
+    archive-completions only folds the months before the month that was
+    ARCHIVE_AFTER_DAYS days ago, so days from the cutoff on are never in a rollup.
+    """
+    days = current_app.config['ARCHIVE_AFTER_DAYS']
+    if not days:
+        return None
+    return (datetime.date.today() - datetime.timedelta(days=days)).replace(day=1)
+
+def reads_rollups(date_from=None):
+    """Tells whether a range starting at date_from (None: the beginning) can hold archived days."""
+    cutoff = archive_cutoff()
+    return cutoff is not None and (date_from is None or date_from < cutoff)
+
+def recorded_days_query(habit_filter=None, date_from=None, date_to=None, completed_only=False):
+    """Builds a select of the recorded (habit_id, completed_on, completed) days, raw and archived alike.
+
+    When the range reaches before the archive cutoff, rows of the completion
+    table are combined with the days set in the monthly rollups that old rows
+    were archived into (see rollups.py). A raw row for an archived day wins over
+    its rollup bit, so check-ins recorded after archiving count as written.
+    Otherwise only the completion table is read. habit_filter is a condition on
+    Habit. With completed_only the days recorded as not completed are left out.
+    """
+    raw = (
+        db.select(HabitCompletion.habit_id, HabitCompletion.completed_on, HabitCompletion.completed)
+        .join(Habit, Habit.id == HabitCompletion.habit_id)
+    )
+    if completed_only:
+        raw = raw.filter(HabitCompletion.completed.is_(True))
+    if habit_filter is not None:
+        raw = raw.filter(habit_filter)
+    if date_from is not None:
+        raw = raw.filter(HabitCompletion.completed_on >= date_from)
+    if date_to is not None:
+        raw = raw.filter(HabitCompletion.completed_on <= date_to)
+    if not reads_rollups(date_from):
+        return raw
+
+    month_days = db.select(literal(0, Integer).label('day_offset')).cte('month_days', recursive=True)
+    month_days = month_days.union_all(db.select((month_days.c.day_offset + 1).label('day_offset')).filter(month_days.c.day_offset < 30))
+    archived_on = add_days(CompletionRollup.month, month_days.c.day_offset)
+
+    def day_set(bits):
+        return bits.op('>>')(month_days.c.day_offset).op('&')(1) == 1
+
+    recorded_bits = CompletionRollup.completed_days
+    if not completed_only:
+        recorded_bits = recorded_bits.op('|')(CompletionRollup.missed_days)
+
+    archived = (
+        db.select(CompletionRollup.habit_id, archived_on.label('completed_on'), day_set(CompletionRollup.completed_days).label('completed'))
+        .join(Habit, Habit.id == CompletionRollup.habit_id)
+        .join(month_days, day_set(recorded_bits))
+        .filter(~db.select(HabitCompletion.id).filter(
+            HabitCompletion.habit_id == CompletionRollup.habit_id, HabitCompletion.completed_on == archived_on,
+        ).exists())
+    )
+    if habit_filter is not None:
+        archived = archived.filter(habit_filter)
+    if date_from is not None:
+        archived = archived.filter(CompletionRollup.month >= date_from.replace(day=1), archived_on >= date_from)
+    if date_to is not None:
+        archived = archived.filter(CompletionRollup.month <= date_to, archived_on <= date_to)
+    return union_all(raw, archived)
+
+def completed_days_query(habit_filter=None, date_from=None, date_to=None):
+    """Builds a select of the completed (habit_id, completed_on) days, raw and archived alike."""
+    return recorded_days_query(habit_filter, date_from, date_to, completed_only=True)
+
+def recorded_keys(keys):
+    """Returns which of the given (habit_id, completed_on) pairs already have a recorded day, archived ones included."""
+    if not keys:
+        return set()
+    dates = [completed_on for _, completed_on in keys]
+    days = recorded_days_query(Habit.id.in_({habit_id for habit_id, _ in keys}), min(dates), max(dates)).subquery('recorded_days')
+    return set(db.session.execute(
+        db.select(days.c.habit_id, days.c.completed_on).filter(tuple_(days.c.habit_id, days.c.completed_on).in_(list(keys)))
+    ).all())
+
+def user_completions_query(user_id=None, completed_only=False, habit_id=None, date_from=None, date_to=None):
+    """Builds one select over completions joined to their habits, ordered by (habit_id, completed_on).
+
+    Passing no user_id selects the completions of every user. The habit and
+    inclusive date range filters are applied in SQL. Days archived into monthly
+    rollups are included, so the result is the same before and after archiving.
+    A range the archiver never reaches reads the completion table directly, in
+    the order of its (habit_id, completed_on) index.
+    """
+    conditions = [Habit.user_id == user_id] if user_id is not None else []
+    if habit_id is not None:
+        conditions.append(Habit.id == habit_id)
+    days = recorded_days_query(and_(*conditions) if conditions else None, date_from, date_to, completed_only)
+    if not reads_rollups(date_from):
+        return days.order_by(HabitCompletion.habit_id, HabitCompletion.completed_on)
+    days = days.subquery('recorded_days')
+    return db.select(days.c.habit_id, days.c.completed_on, days.c.completed).order_by(days.c.habit_id, days.c.completed_on)
+
+def get_user_completions(user_id=None, completed_only=False):
+    """Returns the (habit_id, completed_on, completed) rows of a user in a single round trip."""
+    return db.session.execute(user_completions_query(user_id, completed_only)).all()
+
+def group_by_habit(rows):
+    """Groups rows ordered by habit_id into a dict of habit_id -> list of rows."""
+    return {habit_id: list(habit_rows) for habit_id, habit_rows in groupby(rows, key=attrgetter('habit_id'))}
+
+def get_completions_by_habit(user_id=None, completed_only=False):
+    """Returns a user's completions grouped per habit, fetched with one query."""
+    return group_by_habit(get_user_completions(user_id, completed_only))
+
+def iter_habit_histories(habit_filter=None, chunk_rows=10000):
+    """Yields (habit_id, frequency, completed dates) for every habit, oldest date first.
+
+    One query streams the completed days, raw and archived, joined to their
+    habits in chunks of chunk_rows rows, so only one habit's history is held at a
+    time instead of the whole table. Habits without completions get no dates.
+    habit_filter is a condition on Habit that limits which habits are read.
+    """
+    days = completed_days_query(habit_filter).subquery('completed_days')
+    query = (
+        db.select(Habit.id, Habit.frequency, days.c.completed_on)
+        .outerjoin(days, days.c.habit_id == Habit.id)
+        .order_by(Habit.id, days.c.completed_on)
+        .execution_options(yield_per=chunk_rows)
+    )
+    if habit_filter is not None:
+        query = query.filter(habit_filter)
+    for habit_id, rows in groupby(db.session.execute(query), key=attrgetter('id')):
+        rows = list(rows)
+        yield habit_id, rows[0].frequency, [row.completed_on for row in rows if row.completed_on is not None]
+
+HABIT_FIELDS = {
+    'id': Habit.id,
+    'name': Habit.name,
+    'description': Habit.description,
+    'frequency': Habit.frequency,
+    'creation_date': Habit.creation_date,
+}
+
+COMPLETION_FIELDS = {
+    'habit_id': HabitCompletion.habit_id,
+    'completed_on': HabitCompletion.completed_on,
+    'completed': HabitCompletion.completed,
+}
+
+def parse_fields(value, allowed, default):
+    """Parses a comma separated fields= parameter into a list of allowed field names."""
+    if not value:
+        return list(default)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown or not fields:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}")
+    return fields
+
+def encode_cursor(values):
+    """Encodes the sort key of the last row on a page as an opaque cursor."""
+    values = [value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, key_columns):
+    """Decodes a cursor back into sort key values typed for the key columns."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(key_columns):
+        raise ValueError('Invalid cursor')
+    try:
+        return [
+            datetime.date.fromisoformat(value) if isinstance(column.type, db.Date) else int(value)
+            for value, column in zip(values, key_columns)
+        ]
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+def paginate(query, fields, key_columns, limit=None, cursor=None):
+    """Runs a keyset-paginated select of only the requested fields.
+
+    The query must be ordered by key_columns. Returns (rows, next_cursor); the
+    cursor is None on the last page. Without a limit every row is returned.
+    """
+    selected = [column.label(name) for name, column in fields.items()]
+    keys = [column.label(f'_key{i}') for i, column in enumerate(key_columns)]
+    query = query.with_only_columns(*selected, *keys)
+    if cursor:
+        query = query.filter(tuple_(*key_columns) > tuple_(*decode_cursor(cursor, key_columns)))
+    if limit is None:
+        return db.session.execute(query).all(), None
+
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([getattr(rows[-1], f'_key{i}') for i in range(len(key_columns))])
+
+def serialize_rows(rows, fields):
+    """Turns rows into JSON-ready dicts holding only the requested fields."""
+    return [
+        {field: value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else value
+         for field, value in zip(fields, row)}
+        for row in rows
+    ]
@@ -0,0 +1,16 @@
+"""Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is built without the CLI commands, so workers never import Alembic.
+"""
+from app import create_app
+from extensions import db
+from auth import hash_pool
+
+app = create_app({'CLI_COMMANDS': False})
+
+def reset_after_fork():
+    """Drops the connection pools and bcrypt threads a forked worker inherited from the master."""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)  # leave the master's connections open for the master
+    hash_pool.configure(app.config['BCRYPT_POOL_WORKERS'], app.config['BCRYPT_POOL_MAX_PENDING'])